@@ -3,10 +3,19 @@ import asyncio
 from fastapi import APIRouter
 from loguru import logger
 
+from .auto_swaps import auto_swap_index
+from .boltz_client.helpers import close_http_clients
 from .crud import db
+from .events import swap_event_broker
+from .nodes import node_registry
+from .rbf import fee_bumper
+from .refunds import refund_schedulers
+from .supervisor import task_supervisor
 from .tasks import check_for_pending_swaps, wait_for_paid_invoices
+from .utils import boltz_clients
 from .views import boltz_generic_router
 from .views_api import boltz_api_router
+from .watcher import swap_watcher
 
 boltz_ext = APIRouter(prefix="/boltz", tags=["boltz"])
 boltz_ext.include_router(boltz_generic_router)
@@ -29,6 +38,15 @@ def boltz_stop():
             task.cancel()
         except Exception as ex:
             logger.warning(ex)
+    scheduled_tasks.clear()
+    task_supervisor.cancel_all()
+
+    # close the boltz status websocket and the pooled boltz api connections
+    boltz_clients.clear()
+    try:
+        asyncio.get_running_loop().create_task(close_http_clients())
+    except RuntimeError:
+        asyncio.run(close_http_clients())
 
 
 def boltz_start():
@@ -39,10 +57,37 @@ def boltz_start():
     )
     scheduled_tasks.append(pending_swaps)
 
+    auto_swaps = create_permanent_unique_task(
+        "ext_boltz_auto_swap_index", auto_swap_index.run
+    )
+    scheduled_tasks.append(auto_swaps)
+
     paid_invoices = create_permanent_unique_task(
         "ext_boltz_paid_invoices", wait_for_paid_invoices
     )
     scheduled_tasks.append(paid_invoices)
 
+    watcher = create_permanent_unique_task("ext_boltz_swap_watcher", swap_watcher.run)
+    scheduled_tasks.append(watcher)
+
+    heartbeat = create_permanent_unique_task(
+        "ext_boltz_node_heartbeat", node_registry.run
+    )
+    scheduled_tasks.append(heartbeat)
+
+    swap_events = create_permanent_unique_task(
+        "ext_boltz_swap_events", swap_event_broker.run
+    )
+    scheduled_tasks.append(swap_events)
+
+    fee_bumps = create_permanent_unique_task("ext_boltz_fee_bumps", fee_bumper.run)
+    scheduled_tasks.append(fee_bumps)
+
+    for pair, scheduler in refund_schedulers.items():
+        refund_scheduler = create_permanent_unique_task(
+            f"ext_boltz_refund_scheduler_{pair}", scheduler.run
+        )
+        scheduled_tasks.append(refund_scheduler)
+
 
 __all__ = ["boltz_ext", "boltz_start", "boltz_static_files", "boltz_stop", "db"]
@@ -0,0 +1,56 @@
+import asyncio
+
+from loguru import logger
+
+from .crud import get_auto_reverse_submarine_swap_wallet_ids
+
+# picks up auto swaps created or deleted on other lnbits nodes
+AUTO_SWAP_INDEX_REFRESH_INTERVAL = 60
+
+
+class AutoSwapIndex:
+    """
+    Wallets with an auto reverse swap, so that paid invoices of all other
+    wallets are skipped without touching the database. Kept up to date by the
+    auto swap endpoints and reloaded periodically.
+    """
+
+    def __init__(self) -> None:
+        self.wallet_ids: set[str] = set()
+        self.loaded = False
+        # changes since the last load started, they win over a racing load
+        self._changes: dict[str, bool] = {}
+
+    def __contains__(self, wallet_id: str) -> bool:
+        # until it is loaded every wallet may have an auto swap
+        return not self.loaded or wallet_id in self.wallet_ids
+
+    def add(self, wallet_id: str) -> None:
+        self.wallet_ids.add(wallet_id)
+        self._changes[wallet_id] = True
+
+    def discard(self, wallet_id: str) -> None:
+        self.wallet_ids.discard(wallet_id)
+        self._changes[wallet_id] = False
+
+    async def load(self) -> None:
+        self._changes = {}
+        wallet_ids = set(await get_auto_reverse_submarine_swap_wallet_ids())
+        for wallet_id, added in self._changes.items():
+            if added:
+                wallet_ids.add(wallet_id)
+            else:
+                wallet_ids.discard(wallet_id)
+        self.wallet_ids = wallet_ids
+        self.loaded = True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.load()
+            except Exception as exc:
+                logger.error(f"Boltz - loading auto swap wallets failed: {exc!s}")
+            await asyncio.sleep(AUTO_SWAP_INDEX_REFRESH_INTERVAL)
+
+
+auto_swap_index = AutoSwapIndex()
@@ -0,0 +1,245 @@
+import asyncio
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+from loguru import logger
+
+from .boltz_client.boltz import BoltzClient
+from .boltz_client.onchain import ClaimInput, RefundInput
+from .crud import update_swap_statuses
+from .models import ReverseSubmarineSwap, SubmarineSwap
+from .rbf import fee_bumper
+from .utils import swap_claim_input, swap_refund_input
+
+# inputs of one batch transaction, a full batch is sent right away
+CLAIM_BATCH_MAX_SIZE = 50
+REFUND_BATCH_MAX_SIZE = 50
+# seconds, the job lease of a batched swap has to outlast the wait and the
+# broadcast of its batch, see `JOB_LEASE_TIME` of the watcher
+BATCH_MAX_WAIT = 30
+
+
+@dataclass
+class PendingClaim:
+    swap: ReverseSubmarineSwap
+    claim: ClaimInput
+    lockup_rawtx: str
+    txid: asyncio.Future[str]
+
+
+@dataclass
+class PendingRefund:
+    swap: SubmarineSwap
+    refund: RefundInput
+    lockup_rawtx: str
+    txid: asyncio.Future[str]
+
+
+PendingT = TypeVar("PendingT", PendingClaim, PendingRefund)
+
+
+class TransactionBatcher(ABC, Generic[PendingT]):
+    """
+    Collects swaps by key and spends their lockups with one multi input
+    transaction, instead of paying the transaction overhead for every swap. A
+    batch is sent at the latest `wait` seconds after its first swap was added.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._batches: dict[tuple[str, ...], list[PendingT]] = {}
+        self._timers: dict[tuple[str, ...], asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def _add(
+        self,
+        key: tuple[str, ...],
+        client: BoltzClient,
+        pending: PendingT,
+        wait: float,
+    ) -> asyncio.Future[str]:
+        batch = self._batches.setdefault(key, [])
+        batch.append(pending)
+        if len(batch) >= self.max_size:
+            self._flush(key, client)
+        elif len(batch) == 1:
+            loop = asyncio.get_running_loop()
+            wait = min(wait, BATCH_MAX_WAIT)
+            self._timers[key] = loop.call_later(wait, self._flush, key, client)
+        # shielded, a cancelled waiter does not cancel the transaction of the batch
+        return asyncio.shield(pending.txid)
+
+    def _flush(self, key: tuple[str, ...], client: BoltzClient) -> None:
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._batches.pop(key, [])
+        if batch:
+            task = asyncio.create_task(self._send(client, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @abstractmethod
+    async def _send(self, client: BoltzClient, batch: list[PendingT]) -> None:
+        """spend the lockups of a batch, resolve the txid future of every swap"""
+
+
+def batch_feerate(batch: list[PendingClaim] | list[PendingRefund]) -> int | None:
+    """highest custom feerate of the swaps of a batch, if any set one"""
+    feerates = [
+        pending.swap.feerate_value
+        for pending in batch
+        if pending.swap.feerate and pending.swap.feerate_value
+    ]
+    return max(feerates, default=None)
+
+
+class ClaimBatcher(TransactionBatcher[PendingClaim]):
+    """claims reverse swaps to the same onchain address in one transaction"""
+
+    def __init__(self, max_size: int = CLAIM_BATCH_MAX_SIZE) -> None:
+        super().__init__(max_size)
+
+    def claim(
+        self,
+        client: BoltzClient,
+        swap: ReverseSubmarineSwap,
+        lockup_rawtx: str,
+        wait: float,
+    ) -> asyncio.Future[str]:
+        """add a swap to the batch of its address, resolves to the claim txid"""
+        pending = PendingClaim(
+            swap=swap,
+            claim=swap_claim_input(swap, lockup_rawtx),
+            lockup_rawtx=lockup_rawtx,
+            txid=asyncio.get_running_loop().create_future(),
+        )
+        key = (client.pair, swap.onchain_address)
+        return self._add(key, client, pending, wait)
+
+    async def _send(self, client: BoltzClient, batch: list[PendingClaim]) -> None:
+        if len(batch) > 1:
+            try:
+                txid = await client.claim_reverse_swaps(
+                    [pending.claim for pending in batch],
+                    batch[0].swap.onchain_address,
+                    feerate=batch_feerate(batch),
+                )
+                logger.info(f"Boltz - {len(batch)} reverse swaps claimed, txid: {txid}")
+                await fee_bumper.track(
+                    client,
+                    txid,
+                    [pending.swap for pending in batch],
+                    [pending.lockup_rawtx for pending in batch],
+                )
+                for pending in batch:
+                    pending.txid.set_result(txid)
+                return
+            except Exception as exc:
+                # e.g. one lockup is already spent, do not hold back the others
+                logger.warning(
+                    f"Boltz - batch claim of {len(batch)} swaps failed, "
+                    f"claiming them one by one - {exc!s}"
+                )
+        for pending in batch:
+            swap = pending.swap
+            try:
+                txid = await client.claim_reverse_swap(
+                    boltz_id=swap.boltz_id,
+                    lockup_address=swap.lockup_address,
+                    receive_address=swap.onchain_address,
+                    privkey_wif=swap.claim_privkey,
+                    preimage_hex=swap.preimage,
+                    redeem_script_hex=swap.redeem_script,
+                    zeroconf=swap.instant_settlement,
+                    feerate=swap.feerate_value if swap.feerate else None,
+                    blinding_key=swap.blinding_key,
+                    lockup_rawtx=pending.lockup_rawtx,
+                )
+                await fee_bumper.track(client, txid, [swap], [pending.lockup_rawtx])
+                pending.txid.set_result(txid)
+            except Exception as exc:
+                pending.txid.set_exception(exc)
+
+
+class RefundBatcher(TransactionBatcher[PendingRefund]):
+    """
+    refunds expired swaps of the same pair in one transaction, e.g. after an
+    outage many swaps time out together. the swaps of a broadcasted batch are
+    marked refunded together.
+    """
+
+    def __init__(self, max_size: int = REFUND_BATCH_MAX_SIZE) -> None:
+        super().__init__(max_size)
+
+    def refund(
+        self,
+        client: BoltzClient,
+        swap: SubmarineSwap,
+        lockup_rawtx: str,
+        wait: float,
+    ) -> asyncio.Future[str]:
+        """add a swap to the batch of its pair, resolves to the refund txid"""
+        pending = PendingRefund(
+            swap=swap,
+            refund=swap_refund_input(swap, lockup_rawtx),
+            lockup_rawtx=lockup_rawtx,
+            txid=asyncio.get_running_loop().create_future(),
+        )
+        return self._add((client.pair,), client, pending, wait)
+
+    async def _send(self, client: BoltzClient, batch: list[PendingRefund]) -> None:
+        if len(batch) > 1:
+            try:
+                txid = await client.refund_swaps(
+                    [pending.refund for pending in batch], feerate=batch_feerate(batch)
+                )
+            except Exception as exc:
+                logger.warning(
+                    f"Boltz - batch refund of {len(batch)} swaps failed, "
+                    f"refunding them one by one - {exc!s}"
+                )
+            else:
+                logger.info(f"Boltz - {len(batch)} swaps refunded, txid: {txid}")
+                await fee_bumper.track(
+                    client,
+                    txid,
+                    [pending.swap for pending in batch],
+                    [pending.lockup_rawtx for pending in batch],
+                )
+                try:
+                    await update_swap_statuses(
+                        [pending.swap.id for pending in batch],
+                        "refunded",
+                        reverse=False,
+                        txid=txid,
+                    )
+                except Exception as exc:
+                    # broadcasted anyway, the watcher updates the swaps one by one
+                    logger.error(f"Boltz - could not mark swaps refunded: {exc!s}")
+                for pending in batch:
+                    pending.txid.set_result(txid)
+                return
+        for pending in batch:
+            swap = pending.swap
+            try:
+                txid = await client.refund_swap(
+                    boltz_id=swap.boltz_id,
+                    privkey_wif=swap.refund_privkey,
+                    lockup_address=swap.address,
+                    receive_address=swap.refund_address,
+                    redeem_script_hex=swap.redeem_script,
+                    timeout_block_height=swap.timeout_block_height,
+                    feerate=swap.feerate_value if swap.feerate else None,
+                    blinding_key=swap.blinding_key,
+                    lockup_rawtx=pending.lockup_rawtx,
+                )
+                await fee_bumper.track(client, txid, [swap], [pending.lockup_rawtx])
+                pending.txid.set_result(txid)
+            except Exception as exc:
+                pending.txid.set_exception(exc)
+
+
+claim_batcher = ClaimBatcher()
+refund_batcher = RefundBatcher()
@@ -1,15 +1,26 @@
 """boltz_client main module"""
 
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from enum import Enum
 from math import ceil, floor
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import httpx
 
-from .helpers import req_wrap
+from .helpers import get_http_client, req_wrap
 from .onchain import (
+    CLAIM_INPUT_VSIZE,
+    CLAIM_TX_VSIZE,
+    REFUND_INPUT_VSIZE,
+    REFUND_OUTPUT_VSIZE,
+    REFUND_TX_VSIZE,
+    ClaimInput,
+    RefundInput,
+    create_batch_claim_tx,
+    create_batch_refund_tx,
     create_claim_tx,
     create_key_pair,
     create_preimage,
@@ -17,6 +28,14 @@ from .onchain import (
     validate_address,
 )
 
+if TYPE_CHECKING:
+    from .websocket import BoltzSwapStatusStream, BoltzSwapStatusSubscription
+
+# seconds a fee estimation of boltz is reused for claims and refunds
+FEERATE_TTL = 30
+# raw transactions of the latest broadcasts kept for the caller, see `broadcasts`
+BROADCASTS_MAX = 100
+
 
 class SwapDirection(str, Enum):
     send = "send"
@@ -43,6 +62,14 @@ class BoltzPairException(Exception):
     pass
 
 
+class BoltzPairHashException(BoltzApiException):
+    pass
+
+
+class BoltzBlockHeightException(Exception):
+    pass
+
+
 class BoltzSwapStatusException(Exception):
     def __init__(self, message: str, status: str):
         self.message = message
@@ -104,6 +131,22 @@ class BoltzConfig:
     network_liquid: str = "liquidv1"
     api_url: str = "https://boltz.exchange/api"
     referral_id: str = "dni"
+    # connection pool of the shared http client, per boltz api host
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    # websocket for swap status updates, defaults to `{api_url}/v2/ws`
+    ws_url: Optional[str] = None
+    # polling interval without websocket, and as safety net while connected
+    poll_interval: float = 3
+    ws_poll_interval: float = 60
+
+    @property
+    def websocket_url(self) -> str:
+        if self.ws_url:
+            return self.ws_url
+        return self.api_url.replace("http", "ws", 1).rstrip("/") + "/v2/ws"
 
 
 class BoltzClient:
@@ -119,16 +162,41 @@ class BoltzClient:
             self.network = self._cfg.network_liquid
         else:
             self.network = self._cfg.network
+        self.pair_hash: Optional[str] = None
+        self.pairs_updated_at: float = 0
+        # optional, shared websocket stream. without it the status is polled
+        self.status_stream: Optional[BoltzSwapStatusStream] = None
+        self._feerate: Optional[tuple[float, float]] = None
+        # raw transaction by txid of the latest broadcasts, e.g. to replace them
+        self.broadcasts: dict[str, str] = {}
         return None
 
     async def init_pairs(self):
-        self.pairs = await self.get_pairs()
-        self.fees = self.pairs[self.pair]["fees"]
-        self.limits = self.pairs[self.pair]["limits"]
+        self.set_pairs(await self.get_pairs())
+
+    def set_pairs(self, pairs: dict) -> None:
+        """set pairs, fees, limits and the pair hash from a `getpairs` response"""
+        if self.pair not in pairs:
+            raise BoltzPairException(f"pair {self.pair} not offered by boltz")
+        self.pairs = pairs
+        self.fees = pairs[self.pair]["fees"]
+        self.limits = pairs[self.pair]["limits"]
+        self.pair_hash = pairs[self.pair].get("hash")
+        self.pairs_updated_at = time.time()
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        return get_http_client(
+            self._cfg.api_url,
+            max_connections=self._cfg.max_connections,
+            max_keepalive_connections=self._cfg.max_keepalive_connections,
+            keepalive_expiry=self._cfg.keepalive_expiry,
+            http2=self._cfg.http2,
+        )
 
     async def request(self, funcname, *args, **kwargs) -> dict:
         try:
-            return await req_wrap(funcname, *args, **kwargs)
+            return await req_wrap(funcname, *args, client=self.http_client, **kwargs)
         except httpx.RequestError as exc:
             msg = f"unreachable: {exc.request.url!r}."
             raise BoltzApiException(f"boltz api connection error: {msg}") from exc
@@ -140,6 +208,8 @@ class BoltzClient:
             code = exc.response.status_code
             if code == 404:
                 raise BoltzNotFoundException(err_msg) from exc
+            if "pair hash" in str(err_msg).lower():
+                raise BoltzPairHashException(err_msg) from exc
             msg = f"{code} while requesting {exc.request.url!r}. message: {err_msg}"
             raise BoltzApiException(f"boltz api status error: {msg}") from exc
 
@@ -157,7 +227,11 @@ class BoltzClient:
             headers={"Content-Type": "application/json"},
             json={"currency": self.pair.split("/")[0], "transactionHex": rawtw},
         )
-        return data["transactionId"]
+        txid = data["transactionId"]
+        self.broadcasts[txid] = rawtw
+        while len(self.broadcasts) > BROADCASTS_MAX:
+            del self.broadcasts[next(iter(self.broadcasts))]
+        return txid
 
     def add_reverse_swap_fees(self, amount: int) -> int:
         rev = self.fees["minerFees"]["baseAsset"]["reverse"]
@@ -173,9 +247,50 @@ class BoltzClient:
     def get_fee_estimation_claim(self) -> int:
         return self.fees["minerFees"]["baseAsset"]["reverse"]["claim"]
 
+    def get_fee_estimation_batch_claim(self, inputs: int) -> int:
+        """claim fee estimation of a single claim, scaled to `inputs` inputs"""
+        vsize = CLAIM_INPUT_VSIZE * inputs + CLAIM_TX_VSIZE
+        single_vsize = CLAIM_INPUT_VSIZE + CLAIM_TX_VSIZE
+        return ceil(self.get_fee_estimation_claim() * vsize / single_vsize)
+
     def get_fee_estimation_refund(self) -> int:
         return self.fees["minerFees"]["baseAsset"]["normal"]
 
+    def get_fee_estimation_batch_refund(self, inputs: int, outputs: int = 1) -> int:
+        """refund fee estimation of a single refund, scaled to the batch size"""
+        vsize = (
+            REFUND_INPUT_VSIZE * inputs
+            + REFUND_OUTPUT_VSIZE * (outputs - 1)
+            + REFUND_TX_VSIZE
+        )
+        single_vsize = REFUND_INPUT_VSIZE + REFUND_TX_VSIZE
+        return ceil(self.get_fee_estimation_refund() * vsize / single_vsize)
+
+    async def get_feerate(self) -> float:
+        """boltz fee estimation for the chain of the pair, in sat/vbyte"""
+        if self._feerate and time.time() - self._feerate[1] < FEERATE_TTL:
+            return self._feerate[0]
+        data = await self.request(
+            "get",
+            f"{self._cfg.api_url}/v2/chain/fees",
+            headers={"Content-Type": "application/json"},
+        )
+        feerate = float(data[self.pair.split("/")[0]])
+        self._feerate = (feerate, time.time())
+        return feerate
+
+    async def resolve_feerate(self, feerate: Optional[float] = None) -> Optional[float]:
+        """
+        `feerate` or the boltz fee estimation. None if boltz has no estimation,
+        the static miner fees of the pair are paid then.
+        """
+        if feerate:
+            return feerate
+        try:
+            return await self.get_feerate()
+        except (BoltzApiException, KeyError, ValueError):
+            return None
+
     async def get_pairs(self) -> dict:
         data = await self.request(
             "get",
@@ -184,6 +299,33 @@ class BoltzClient:
         )
         return data["pairs"]
 
+    async def get_block_height(self) -> int:
+        """current block height of the chain of the pair"""
+        data = await self.request(
+            "get",
+            f"{self._cfg.api_url}/v2/chain/heights",
+            headers={"Content-Type": "application/json"},
+        )
+        return int(data[self.pair.split("/")[0]])
+
+    async def get_transaction_confirmations(self, txid: str) -> int:
+        """confirmations of a transaction on the chain of the pair, 0 if unconfirmed"""
+        data = await self.request(
+            "get",
+            f"{self._cfg.api_url}/v2/chain/{self.pair.split('/')[0]}/transaction/{txid}",
+            headers={"Content-Type": "application/json"},
+        )
+        return int(data.get("confirmations") or 0)
+
+    async def check_block_height(self, timeout_block_height: int) -> None:
+        """a refund is valid from the timeout block height on"""
+        height = await self.get_block_height()
+        if height < timeout_block_height:
+            raise BoltzBlockHeightException(
+                f"refund is possible from block {timeout_block_height}, "
+                f"current block: {height}"
+            )
+
     def check_limits(self, amount: int) -> None:
         limits = self.limits
         valid = limits["minimal"] <= amount <= limits["maximal"]
@@ -221,27 +363,62 @@ class BoltzClient:
 
         return res
 
+    @asynccontextmanager
+    async def status_updates(self, boltz_id: str):
+        """websocket status updates of a swap, None if there is no status stream"""
+        if not self.status_stream:
+            yield None
+            return
+        subscription = await self.status_stream.updates(boltz_id)
+        try:
+            yield subscription
+        finally:
+            await subscription.close()
+
+    async def wait_for_status_update(
+        self, updates: Optional["BoltzSwapStatusSubscription"]
+    ) -> Optional[BoltzSwapStatusResponse]:
+        """
+        wait for the next websocket update, falls back to the polling interval.
+        returns None if the caller has to poll the status itself.
+        """
+        if not updates or not self.status_stream:
+            await asyncio.sleep(self._cfg.poll_interval)
+            return None
+        if self.status_stream.connected.is_set():
+            timeout = self._cfg.ws_poll_interval
+        else:
+            timeout = self._cfg.poll_interval
+        try:
+            return await updates.next(timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
     async def wait_for_tx(self, boltz_id: str) -> str:
-        while True:
-            try:
-                swap_transaction = await self.swap_transaction(boltz_id)
-                assert swap_transaction.transactionHex
-                return swap_transaction.transactionHex
-            except (ValueError, BoltzApiException, BoltzSwapTransactionException):
-                await asyncio.sleep(3)
+        async with self.status_updates(boltz_id) as updates:
+            while True:
+                try:
+                    swap_transaction = await self.swap_transaction(boltz_id)
+                    assert swap_transaction.transactionHex
+                    return swap_transaction.transactionHex
+                except (ValueError, BoltzApiException, BoltzSwapTransactionException):
+                    await self.wait_for_status_update(updates)
 
     async def wait_for_tx_on_status(self, boltz_id: str, zeroconf: bool = True) -> str:
-        while True:
-            try:
-                status = await self.swap_status(boltz_id)
-                assert status.transaction
-                tx_hex = status.transaction.get("hex")
-                assert tx_hex
-                if not zeroconf:
-                    assert status.status == "transaction.confirmed"
-                return tx_hex
-            except (BoltzApiException, BoltzSwapStatusException, AssertionError):
-                await asyncio.sleep(3)
+        async with self.status_updates(boltz_id) as updates:
+            status: Optional[BoltzSwapStatusResponse] = None
+            while True:
+                try:
+                    if not status:
+                        status = await self.swap_status(boltz_id)
+                    assert status.transaction
+                    tx_hex = status.transaction.get("hex")
+                    assert tx_hex
+                    if not zeroconf:
+                        assert status.status == "transaction.confirmed"
+                    return tx_hex
+                except (BoltzApiException, BoltzSwapStatusException, AssertionError):
+                    status = await self.wait_for_status_update(updates)
 
     def validate_address(self, address: str) -> str:
         try:
@@ -259,10 +436,13 @@ class BoltzClient:
         redeem_script_hex: str,
         zeroconf: bool = True,
         blinding_key: Optional[str] = None,
-    ):
+        lockup_rawtx: Optional[str] = None,
+        feerate: Optional[float] = None,
+    ) -> str:
         self.validate_address(receive_address)
         self.validate_address(lockup_address)
-        lockup_rawtx = await self.wait_for_tx_on_status(boltz_id, zeroconf)
+        if not lockup_rawtx:
+            lockup_rawtx = await self.wait_for_tx_on_status(boltz_id, zeroconf)
 
         transaction = create_claim_tx(
             lockup_address=lockup_address,
@@ -274,8 +454,29 @@ class BoltzClient:
             pair=self.pair,
             blinding_key=blinding_key,
             fees=self.get_fee_estimation_claim(),
+            feerate=await self.resolve_feerate(feerate),
         )
-        return self.send_onchain_tx(transaction)
+        return await self.send_onchain_tx(transaction)
+
+    async def claim_reverse_swaps(
+        self,
+        claims: list[ClaimInput],
+        receive_address: str,
+        feerate: Optional[float] = None,
+    ) -> str:
+        """claim the lockups of several reverse swaps in one transaction"""
+        if self.pair != "BTC/BTC":
+            raise BoltzPairException(f"batch claims are not supported for {self.pair}")
+        self.validate_address(receive_address)
+        for claim in claims:
+            self.validate_address(claim.lockup_address)
+        transaction = create_batch_claim_tx(
+            claims=claims,
+            receive_address=receive_address,
+            fees=self.get_fee_estimation_batch_claim(len(claims)),
+            feerate=await self.resolve_feerate(feerate),
+        )
+        return await self.send_onchain_tx(transaction)
 
     async def refund_swap(
         self,
@@ -286,12 +487,15 @@ class BoltzClient:
         redeem_script_hex: str,
         timeout_block_height: int,
         blinding_key: Optional[str] = None,
+        lockup_rawtx: Optional[str] = None,
+        feerate: Optional[float] = None,
     ) -> str:
-        # self.mempool.check_block_height(timeout_block_height)
+        await self.check_block_height(timeout_block_height)
         self.validate_address(receive_address)
         self.validate_address(lockup_address)
 
-        lockup_rawtx = await self.wait_for_tx(boltz_id)
+        if not lockup_rawtx:
+            lockup_rawtx = await self.wait_for_tx(boltz_id)
         transaction = create_refund_tx(
             lockup_address=lockup_address,
             lockup_rawtx=lockup_rawtx,
@@ -302,24 +506,61 @@ class BoltzClient:
             pair=self.pair,
             blinding_key=blinding_key,
             fees=self.get_fee_estimation_refund(),
+            feerate=await self.resolve_feerate(feerate),
         )
         return await self.send_onchain_tx(transaction)
 
+    async def refund_swaps(
+        self, refunds: list[RefundInput], feerate: Optional[float] = None
+    ) -> str:
+        """refund the lockups of several swaps in one transaction"""
+        if self.pair != "BTC/BTC":
+            raise BoltzPairException(f"batch refunds are not supported for {self.pair}")
+        for refund in refunds:
+            self.validate_address(refund.receive_address)
+            self.validate_address(refund.lockup_address)
+        await self.check_block_height(
+            max((refund.timeout_block_height for refund in refunds), default=0)
+        )
+        outputs = len({refund.receive_address for refund in refunds})
+        transaction = create_batch_refund_tx(
+            refunds=refunds,
+            fees=self.get_fee_estimation_batch_refund(len(refunds), outputs),
+            feerate=await self.resolve_feerate(feerate),
+        )
+        return await self.send_onchain_tx(transaction)
+
+    def _pair_hash_param(self) -> dict:
+        # boltz rejects the swap if the fees changed since the pairs were fetched
+        return {"pairHash": self.pair_hash} if self.pair_hash else {}
+
+    async def _request_createswap(self, payload: dict) -> dict:
+        try:
+            return await self.request(
+                "post",
+                f"{self._cfg.api_url}/createswap",
+                json={**payload, **self._pair_hash_param()},
+                headers={"Content-Type": "application/json"},
+            )
+        except BoltzPairHashException as exc:
+            # fees are stale, refresh them so the next attempt uses the new fees
+            await self.init_pairs()
+            raise BoltzPairHashException(
+                f"boltz fees for {self.pair} changed, please try again."
+            ) from exc
+
     async def create_swap(self, payment_request: str) -> tuple[str, BoltzSwapResponse]:
         """create swap and return private key and boltz response"""
         refund_privkey_wif, refund_pubkey_hex = create_key_pair(self.network, self.pair)
-        data = await self.request(
-            "post",
-            f"{self._cfg.api_url}/createswap",
-            json={
+        data = await self._request_createswap(
+            {
                 "type": "submarine",
                 "pairId": self.pair,
                 "orderSide": "sell",
                 "refundPublicKey": refund_pubkey_hex,
                 "invoice": payment_request,
                 "referralId": self._cfg.referral_id,
-            },
-            headers={"Content-Type": "application/json"},
+            }
         )
         return refund_privkey_wif, BoltzSwapResponse(**data)
 
@@ -330,10 +571,8 @@ class BoltzClient:
         self.check_limits(amount)
         claim_privkey_wif, claim_pubkey_hex = create_key_pair(self.network, self.pair)
         preimage_hex, preimage_hash = create_preimage()
-        data = await self.request(
-            "post",
-            f"{self._cfg.api_url}/createswap",
-            json={
+        data = await self._request_createswap(
+            {
                 "type": "reversesubmarine",
                 "pairId": self.pair,
                 "orderSide": "buy",
@@ -341,8 +580,7 @@ class BoltzClient:
                 "preimageHash": preimage_hash,
                 "claimPublicKey": claim_pubkey_hex,
                 "referralId": self._cfg.referral_id,
-            },
-            headers={"Content-Type": "application/json"},
+            }
         )
         swap = BoltzReverseSwapResponse(**data)
         return claim_privkey_wif, preimage_hex, swap
@@ -9,6 +9,7 @@ from typing import Optional
 import click
 
 from boltz_client.boltz import BoltzClient, BoltzConfig, SwapDirection
+from boltz_client.onchain import ClaimInput, RefundInput
 
 # disable tracebacks on exceptions
 # sys.tracebacklimit = 0
@@ -105,6 +106,43 @@ def refund_swap(
     click.echo(f"TXID: {txid}")
 
 
+@click.command()
+@click.argument("refunds_file", type=click.File("r"))
+def refund_swaps(refunds_file):
+    """
+    refunds several expired BTC swaps in one transaction
+
+    REFUNDS_FILE is a json list of swaps with `lockup_address`, `privkey_wif`,
+    `redeem_script_hex`, `timeout_block_height`, `receive_address` and either
+    `lockup_rawtx` or the `boltz_id` to fetch the lockup transaction from boltz
+    """
+    client = BoltzClient(config, "BTC/BTC")
+
+    async def _refund() -> str:
+        await client.init_pairs()
+        refunds = []
+        for swap in json.load(refunds_file):
+            lockup_rawtx = swap.get("lockup_rawtx")
+            if not lockup_rawtx:
+                lockup_rawtx = await client.wait_for_tx(swap["boltz_id"])
+            refunds.append(
+                RefundInput(
+                    lockup_address=swap["lockup_address"],
+                    lockup_rawtx=lockup_rawtx,
+                    privkey_wif=swap["privkey_wif"],
+                    redeem_script_hex=swap["redeem_script_hex"],
+                    timeout_block_height=swap["timeout_block_height"],
+                    receive_address=swap["receive_address"],
+                )
+            )
+        click.echo(f"refunding {len(refunds)} swaps...")
+        return await client.refund_swaps(refunds)
+
+    txid = asyncio.run(_refund())
+    click.echo("swaps refunded!")
+    click.echo(f"TXID: {txid}")
+
+
 @click.command()
 @click.argument("sats", type=int)
 @click.argument("pair", type=str, default="BTC/BTC")
@@ -261,6 +299,62 @@ async def claim_reverse_swap(
     click.echo(f"TXID: {txid}")
 
 
+@click.command()
+@click.argument("receive_address", type=str)
+@click.argument("claims_file", type=click.File("r"))
+@click.option(
+    "--wait",
+    type=click.FloatRange(min=0, min_open=True),
+    default=60,
+    show_default=True,
+    help="max seconds to wait for the lockup transactions of swaps without one",
+)
+def claim_reverse_swaps(receive_address: str, claims_file, wait: float = 60):
+    """
+    claims several BTC reverse swaps in one transaction
+
+    CLAIMS_FILE is a json list of reverse swaps with `lockup_address`,
+    `privkey_wif`, `preimage_hex`, `redeem_script_hex` and either `lockup_rawtx`
+    or the `boltz_id` to fetch the lockup transaction from boltz, optionally
+    with `zeroconf` false to wait for its confirmation
+    """
+    client = BoltzClient(config, "BTC/BTC")
+
+    async def _claim() -> str:
+        await client.init_pairs()
+        claims = []
+        for swap in json.load(claims_file):
+            lockup_rawtx = swap.get("lockup_rawtx")
+            if not lockup_rawtx:
+                try:
+                    lockup_rawtx = await asyncio.wait_for(
+                        client.wait_for_tx_on_status(
+                            swap["boltz_id"], swap.get("zeroconf", True)
+                        ),
+                        wait,
+                    )
+                except asyncio.TimeoutError:
+                    click.echo(
+                        f"no lockup transaction yet, skipped: {swap['boltz_id']}"
+                    )
+                    continue
+            claims.append(
+                ClaimInput(
+                    lockup_address=swap["lockup_address"],
+                    lockup_rawtx=lockup_rawtx,
+                    privkey_wif=swap["privkey_wif"],
+                    preimage_hex=swap["preimage_hex"],
+                    redeem_script_hex=swap["redeem_script_hex"],
+                )
+            )
+        click.echo(f"claiming {len(claims)} reverse swaps...")
+        return await client.claim_reverse_swaps(claims, receive_address)
+
+    txid = asyncio.run(_claim())
+    click.echo("reverse swaps claimed!")
+    click.echo(f"TXID: {txid}")
+
+
 @click.command()
 @click.argument("swap_id", type=str)
 async def swap_status(swap_id):
@@ -305,9 +399,11 @@ def main():
     command_group.add_command(show_pairs)
     command_group.add_command(create_swap)
     command_group.add_command(refund_swap)
+    command_group.add_command(refund_swaps)
     command_group.add_command(create_reverse_swap)
     command_group.add_command(create_reverse_swap_and_claim)
     command_group.add_command(claim_reverse_swap)
+    command_group.add_command(claim_reverse_swaps)
     command_group.add_command(calculate_swap_send_amount)
     command_group()
 
@@ -1,16 +1,94 @@
 """boltz_client helpers"""
 
-from httpx import AsyncClient
+from importlib import util
+from math import ceil
+from typing import Callable, Optional, TypeVar
+from urllib.parse import urlparse
 
+from httpx import AsyncClient, Limits
 
-async def req_wrap(funcname, *args, **kwargs) -> dict:
-    """request wrapper for httpx"""
-    async with AsyncClient(follow_redirects=True) as client:
-        func = getattr(client, funcname)
-        res = await func(*args, timeout=30, **kwargs)
-        res.raise_for_status()
-        return (
-            res.json()
-            if kwargs["headers"]["Content-Type"] == "application/json"
-            else {"text": res.text}
+# http2 is only negotiated if the optional `h2` package is installed
+http2_support = util.find_spec("h2") is not None
+
+# one pooled client per host, shared by every BoltzClient of the process
+_http_clients: dict[str, AsyncClient] = {}
+
+
+def get_http_client(
+    url: str,
+    max_connections: int = 20,
+    max_keepalive_connections: int = 10,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+) -> AsyncClient:
+    """get or create the pooled keep-alive client for the host of `url`"""
+    parsed = urlparse(url)
+    host = f"{parsed.scheme}://{parsed.netloc}"
+    client = _http_clients.get(host)
+    if client is None or client.is_closed:
+        client = AsyncClient(
+            follow_redirects=True,
+            http2=http2 and http2_support,
+            limits=Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=30,
         )
+        _http_clients[host] = client
+    return client
+
+
+async def close_http_clients() -> None:
+    """close all pooled clients, e.g. on extension shutdown"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        if not client.is_closed:
+            await client.aclose()
+
+
+async def req_wrap(
+    funcname, *args, client: Optional[AsyncClient] = None, **kwargs
+) -> dict:
+    """request wrapper for httpx"""
+    if client is None:
+        client = get_http_client(args[0])
+    func = getattr(client, funcname)
+    res = await func(*args, **kwargs)
+    res.raise_for_status()
+    return (
+        res.json()
+        if kwargs["headers"]["Content-Type"] == "application/json"
+        else {"text": res.text}
+    )
+
+
+TxT = TypeVar("TxT")
+
+
+def build_with_feerate(
+    build: Callable[[int], TxT],
+    fees: int,
+    feerate: Optional[float],
+    vsize: Callable[[TxT], int],
+) -> TxT:
+    """
+    build a transaction paying `fees`, or `feerate` sat/vbyte of its signed size.
+    the fee does not change the size, but a new signature can be a byte longer,
+    so the transaction is rebuilt until its fee covers its size.
+    """
+    if feerate is None:
+        return build(fees)
+    if feerate <= 0:
+        raise ValueError(f"Invalid feerate {feerate}")
+    tx = build(fees)
+    fees = ceil(vsize(tx) * feerate)
+    for _ in range(3):
+        tx = build(fees)
+        required = ceil(vsize(tx) * feerate)
+        if fees >= required:
+            return tx
+        fees = required
+    return build(fees)
@@ -1,7 +1,9 @@
 """boltz_client onchain module"""
 
 import os
+from dataclasses import dataclass
 from hashlib import sha256
+from math import ceil
 from typing import Optional
 
 from embit import ec, script
@@ -11,8 +13,22 @@ from embit.liquid.networks import NETWORKS as LNETWORKS
 from embit.networks import NETWORKS
 from embit.transaction import SIGHASH, Transaction, TransactionInput, TransactionOutput
 
+from .helpers import build_with_feerate
 from .onchain_wally import create_liquid_tx
 
+# virtual sizes of a claim transaction, its p2wsh input with signature, preimage
+# and redeem script, and everything else incl. a single segwit output
+CLAIM_INPUT_VSIZE = 93
+CLAIM_TX_VSIZE = 42
+# the same for a refund transaction, its input is p2sh wrapped p2wsh with the
+# longer refund branch of the redeem script, and every further segwit output
+REFUND_INPUT_VSIZE = 121
+REFUND_TX_VSIZE = 42
+REFUND_OUTPUT_VSIZE = 31
+# input sequence of BTC claims and refunds, signals replace-by-fee (bip125)
+# and enables the locktime of refunds
+RBF_SEQUENCE = 0xFFFFFFFD
+
 
 def validate_address(address: str, network: str, pair: str) -> str:
     if pair == "L-BTC/BTC":
@@ -64,6 +80,7 @@ def create_refund_tx(
     pair: str,
     fees: int,
     blinding_key: Optional[str] = None,
+    feerate: Optional[float] = None,
 ) -> str:
     # redeemscript to script_sig
     rs = bytes([34]) + bytes([0]) + bytes([32])
@@ -71,7 +88,7 @@ def create_refund_tx(
     script_sig = rs
     return create_onchain_tx(
         lockup_address=lockup_address,
-        sequence=0xFFFFFFFE,
+        sequence=0xFFFFFFFE if pair == "L-BTC/BTC" else RBF_SEQUENCE,
         redeem_script_hex=redeem_script_hex,
         privkey_wif=privkey_wif,
         lockup_rawtx=lockup_rawtx,
@@ -81,6 +98,7 @@ def create_refund_tx(
         pair=pair,
         fees=fees,
         blinding_key=blinding_key,
+        feerate=feerate,
     )
 
 
@@ -94,9 +112,11 @@ def create_claim_tx(
     fees: int,
     pair: str,
     blinding_key: Optional[str] = None,
+    feerate: Optional[float] = None,
 ) -> str:
     return create_onchain_tx(
         lockup_address=lockup_address,
+        sequence=0xFFFFFFFF if pair == "L-BTC/BTC" else RBF_SEQUENCE,
         preimage_hex=preimage_hex,
         lockup_rawtx=lockup_rawtx,
         receive_address=receive_address,
@@ -105,6 +125,7 @@ def create_claim_tx(
         fees=fees,
         pair=pair,
         blinding_key=blinding_key,
+        feerate=feerate,
     )
 
 
@@ -121,7 +142,12 @@ def create_onchain_tx(
     preimage_hex: str = "",
     script_sig: Optional[bytes] = None,
     blinding_key: Optional[str] = None,
+    feerate: Optional[float] = None,
 ) -> str:
+    """
+    spend a lockup output to `receive_address`. the fee is `fees`, or with a
+    `feerate` in sat/vbyte computed from the size of the signed transaction
+    """
 
     if pair == "L-BTC/BTC":
         if not blinding_key:
@@ -138,50 +164,204 @@ def create_onchain_tx(
             timeout_block_height=timeout_block_height,
             preimage_hex=preimage_hex,
             blinding_key=blinding_key,
+            feerate=feerate,
         )
 
-    try:
-        lockup_transaction = Transaction.from_string(lockup_rawtx)
-    except EmbitError as exc:
-        raise ValueError("Invalid lockup transaction hex") from exc
+    txid, vout_index, vout_amount = lockup_outpoint(lockup_address, lockup_rawtx)
 
-    txid = lockup_transaction.txid()
-    vout_amount: Optional[int] = None
-    vout_index: int = 0
-    for vout in lockup_transaction.vout:
-        if vout.script_pubkey == script.address_to_scriptpubkey(lockup_address):
-            vout_amount = vout.value
-            break
-        vout_index += 1
-
-    if vout_amount is None:
-        raise ValueError("No matching vout found in lockup transaction")
-
-    vout = TransactionOutput(
-        vout_amount - fees,
-        script.address_to_scriptpubkey(receive_address),
-    )
-    vout = [vout]
-    vin = TransactionInput(
-        txid,
-        vout_index,
-        sequence=sequence,
-        script_sig=script.Script(data=script_sig) if script_sig else None,
-    )
-    tx = Transaction(vin=[vin], vout=vout)
+    def build(fees: int) -> Transaction:
+        vout = TransactionOutput(
+            vout_amount - fees,
+            script.address_to_scriptpubkey(receive_address),
+        )
+        vin = TransactionInput(
+            txid,
+            vout_index,
+            sequence=sequence,
+            script_sig=script.Script(data=script_sig) if script_sig else None,
+        )
+        tx = Transaction(vin=[vin], vout=[vout])
 
-    if timeout_block_height > 0:
-        tx.locktime = timeout_block_height
+        if timeout_block_height > 0:
+            tx.locktime = timeout_block_height
 
-    redeem_script = script.Script(data=bytes.fromhex(redeem_script_hex))
-    h = tx.sighash_segwit(0, redeem_script, vout_amount)
-    sig = ec.PrivateKey.from_wif(privkey_wif).sign(h).serialize() + bytes([SIGHASH.ALL])
-    witness_script = script.Witness(
-        items=[sig, bytes.fromhex(preimage_hex), bytes.fromhex(redeem_script_hex)]
-    )
+        redeem_script = script.Script(data=bytes.fromhex(redeem_script_hex))
+        h = tx.sighash_segwit(0, redeem_script, vout_amount)
+        sig = ec.PrivateKey.from_wif(privkey_wif).sign(h).serialize()
+        tx.vin[0].witness = script.Witness(
+            items=[
+                sig + bytes([SIGHASH.ALL]),
+                bytes.fromhex(preimage_hex),
+                bytes.fromhex(redeem_script_hex),
+            ]
+        )
+        return tx
 
-    tx.vin[0].witness = witness_script
-    if script_sig:
-        tx.vin[0].script_sig = script.Script(data=script_sig)
+    return bytes.hex(build_with_feerate(build, fees, feerate, tx_vsize).serialize())
+
+
+def tx_vsize(tx: Transaction) -> int:
+    """virtual size of a signed transaction, a quarter of its weight"""
+    size = len(tx.serialize())
+    if not tx.is_segwit:
+        return size
+    # segwit marker, flag and the witnesses are not multiplied by four
+    witness_size = 2 + sum(len(vin.witness.serialize()) for vin in tx.vin)
+    return ceil(((size - witness_size) * 4 + witness_size) / 4)
+
+
+@dataclass
+class ClaimInput:
+    """a reverse swap lockup output to be claimed in a batch"""
+
+    lockup_address: str
+    lockup_rawtx: str
+    privkey_wif: str
+    preimage_hex: str
+    redeem_script_hex: str
+
+
+def create_batch_claim_tx(
+    claims: list[ClaimInput],
+    receive_address: str,
+    fees: int,
+    feerate: Optional[float] = None,
+) -> str:
+    """claim several BTC lockups into one output, every input signed on its own"""
+    if not claims:
+        raise ValueError("No lockups to claim")
+    vin = []
+    amounts = []
+    for claim in claims:
+        txid, vout_index, amount = lockup_outpoint(
+            claim.lockup_address, claim.lockup_rawtx
+        )
+        vin.append(TransactionInput(txid, vout_index, sequence=RBF_SEQUENCE))
+        amounts.append(amount)
 
-    return bytes.hex(tx.serialize())
+    def build(fees: int) -> Transaction:
+        output = TransactionOutput(
+            sum(amounts) - fees, script.address_to_scriptpubkey(receive_address)
+        )
+        tx = Transaction(vin=vin, vout=[output])
+        for index, claim in enumerate(claims):
+            redeem_script = script.Script(data=bytes.fromhex(claim.redeem_script_hex))
+            h = tx.sighash_segwit(index, redeem_script, amounts[index])
+            sig = ec.PrivateKey.from_wif(claim.privkey_wif).sign(h).serialize()
+            tx.vin[index].witness = script.Witness(
+                items=[
+                    sig + bytes([SIGHASH.ALL]),
+                    bytes.fromhex(claim.preimage_hex),
+                    bytes.fromhex(claim.redeem_script_hex),
+                ]
+            )
+        return tx
+
+    return bytes.hex(build_with_feerate(build, fees, feerate, tx_vsize).serialize())
+
+
+@dataclass
+class RefundInput:
+    """a submarine swap lockup output to be refunded in a batch"""
+
+    lockup_address: str
+    lockup_rawtx: str
+    privkey_wif: str
+    redeem_script_hex: str
+    timeout_block_height: int
+    receive_address: str
+
+
+def create_batch_refund_tx(
+    refunds: list[RefundInput], fees: int, feerate: Optional[float] = None
+) -> str:
+    """
+    refund several BTC lockups in one transaction, with one output per refund
+    address. the locktime is the latest timeout of the lockups, the fees are
+    shared by the outputs in proportion to their number of inputs.
+    """
+    if not refunds:
+        raise ValueError("No lockups to refund")
+    vin = []
+    amounts = []
+    for refund in refunds:
+        txid, vout_index, amount = lockup_outpoint(
+            refund.lockup_address, refund.lockup_rawtx
+        )
+        # p2sh wrapped p2wsh, the redeem script hash in the script_sig
+        script_sig = bytes([34, 0, 32])
+        script_sig += sha256(bytes.fromhex(refund.redeem_script_hex)).digest()
+        vin.append(
+            TransactionInput(
+                txid,
+                vout_index,
+                sequence=RBF_SEQUENCE,
+                script_sig=script.Script(data=script_sig),
+            )
+        )
+        amounts.append(amount)
+
+    outputs: dict[str, list[int]] = {}
+    for refund, amount in zip(refunds, amounts):
+        outputs.setdefault(refund.receive_address, []).append(amount)
+
+    def build(fees: int) -> Transaction:
+        vout = []
+        fees_left = fees
+        for index, (address, output_amounts) in enumerate(outputs.items()):
+            if index == len(outputs) - 1:
+                fee = fees_left
+            else:
+                fee = fees * len(output_amounts) // len(refunds)
+            fees_left -= fee
+            value = sum(output_amounts) - fee
+            if value <= 0:
+                raise ValueError(f"Refund to {address} does not cover its fees")
+            vout.append(
+                TransactionOutput(value, script.address_to_scriptpubkey(address))
+            )
+
+        tx = Transaction(vin=vin, vout=vout)
+        tx.locktime = max(refund.timeout_block_height for refund in refunds)
+        for index, refund in enumerate(refunds):
+            redeem_script = script.Script(data=bytes.fromhex(refund.redeem_script_hex))
+            h = tx.sighash_segwit(index, redeem_script, amounts[index])
+            sig = ec.PrivateKey.from_wif(refund.privkey_wif).sign(h).serialize()
+            tx.vin[index].witness = script.Witness(
+                items=[
+                    sig + bytes([SIGHASH.ALL]),
+                    b"",
+                    bytes.fromhex(refund.redeem_script_hex),
+                ]
+            )
+        return tx
+
+    return bytes.hex(build_with_feerate(build, fees, feerate, tx_vsize).serialize())
+
+
+def transaction_fee(rawtx: str, lockup_rawtxs: list[str]) -> int:
+    """fee of a BTC transaction spending only outputs of the lockup transactions"""
+    tx = Transaction.from_string(rawtx)
+    lockups = {}
+    for lockup_rawtx in lockup_rawtxs:
+        lockup = Transaction.from_string(lockup_rawtx)
+        lockups[lockup.txid()] = lockup
+    inputs = 0
+    for vin in tx.vin:
+        if vin.txid not in lockups:
+            raise ValueError("Input is not a lockup output")
+        inputs += lockups[vin.txid].vout[vin.vout].value
+    return inputs - sum(vout.value for vout in tx.vout)
+
+
+def lockup_outpoint(lockup_address: str, lockup_rawtx: str) -> tuple[bytes, int, int]:
+    """txid, vout index and amount of the lockup output of a BTC transaction"""
+    try:
+        lockup_transaction = Transaction.from_string(lockup_rawtx)
+    except EmbitError as exc:
+        raise ValueError("Invalid lockup transaction hex") from exc
+    lockup_script = script.address_to_scriptpubkey(lockup_address)
+    for vout_index, vout in enumerate(lockup_transaction.vout):
+        if vout.script_pubkey == lockup_script:
+            return lockup_transaction.txid(), vout_index, vout.value
+    raise ValueError("No matching vout found in lockup transaction")
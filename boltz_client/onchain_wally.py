@@ -11,6 +11,8 @@ import secrets
 from dataclasses import dataclass
 from typing import Any, Optional
 
+from .helpers import build_with_feerate
+
 
 @dataclass
 class Network:
@@ -156,6 +158,7 @@ def create_liquid_tx(
     timeout_block_height: int = 0,
     preimage_hex: str = "",
     blinding_key: Optional[str] = None,
+    feerate: Optional[float] = None,
 ) -> str:
     try:
         import wallycore as wally  # type: ignore
@@ -219,103 +222,110 @@ def create_liquid_tx(
 
     assert unblinded_asset == network.lbtc_asset, "Wrong asset"
 
-    # INITIALIZE PSBT (PSET)
-    num_vin = 1
-    num_vout = 2
-    psbt_flags = wally.WALLY_PSBT_INIT_PSET  # Make an Elements PSET
-    psbt_version = wally.WALLY_PSBT_VERSION_2  # PSET only supports v2
-    psbt = wally.psbt_init(psbt_version, num_vin, num_vout, 0, psbt_flags)
-
-    if timeout_block_height > 0:
-        wally.psbt_set_fallback_locktime(psbt, timeout_block_height)
-
-    # ADD PSBT INPUT
-    idx = wally.psbt_get_num_inputs(psbt)
-    # Add the txout from the lockup tx as the witness UTXO for our input
-    input_ = wally.tx_input_init(txid, vout_n, sequence, None, None)
-    wally.psbt_add_tx_input_at(psbt, idx, 0, input_)
-    wally.psbt_set_input_witness_utxo_from_tx(psbt, idx, lockup_transaction, vout_n)
-    # Add the rangeproof
-    wally.psbt_set_input_utxo_rangeproof(psbt, idx, lockup_rangeproof)
-    # And the witness script
-    wally.psbt_set_input_witness_script(psbt, idx, redeem_script)
-    # Add the key info for our private key, so psbt_sign knows what input
-    # to sign when given the private key.
-    # Since we don't have a BIP32 key, add it with a dummy fingerprint and path.
-    # When signing with a non-BIP32 private key, wally uses the key as given
-    # and doesn't attempt to derive a BIP32 key to sign with, so these dummy
-    # values aren't used except to indicate that the key belongs to this input.
-    keypaths = wally.map_keypath_public_key_init(1)
-    signing_pubkey = wally.ec_public_key_from_private_key(private_key)  # type: ignore
-    wally.map_keypath_add(keypaths, signing_pubkey, bytes(4), [0])
-    wally.psbt_set_input_keypaths(psbt, idx, keypaths)
-
-    # Uncomment to generate explicit value proofs for the input.
-    # These expose the unblinded value and asset in the PSBT; we
-    # don't need them for this use-case.
-    # wally.psbt_generate_input_explicit_proofs(psbt, idx, unblinded_amount,
-    # unblinded_asset, abf, vbf, secrets.token_bytes(32))
-
-    # ADD PSBT OUTPUT
-    output_idx = wally.psbt_get_num_outputs(psbt)
-    asset_tag = bytearray([1]) + unblinded_asset  # Explicit (unblinded) asset
-    value = wally.tx_confidential_value_from_satoshi(unblinded_amount - fees)  # type: ignore
-    txout = wally.tx_elements_output_init(receive_script_pubkey, asset_tag, value, None)
-    wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout)
-    wally.psbt_set_output_blinding_public_key(psbt, output_idx, receive_blinding_pubkey)
-    wally.psbt_set_output_blinder_index(psbt, output_idx, 0)
-
-    # ADD FEE OUTPUT
-    fee_value = wally.tx_confidential_value_from_satoshi(fees)  # type: ignore
-    fee_txout = wally.tx_elements_output_init(None, asset_tag, fee_value)
-    wally.psbt_add_tx_output_at(psbt, output_idx + 1, 0, fee_txout)
-
-    # BLIND PSBT
-    entropy = get_entropy(1)
-    values, vbfs, assets, abfs = [wally.map_init(1, None) for _ in range(4)]
-
-    unblinded_value = wally.tx_confidential_value_from_satoshi(unblinded_amount)  # type: ignore
-    wally.map_add_integer(values, idx, unblinded_value)
-    wally.map_add_integer(vbfs, idx, vbf)
-    wally.map_add_integer(assets, idx, unblinded_asset)
-    wally.map_add_integer(abfs, idx, abf)
-
-    # returns ephemeral_keys
-    _ = wally.psbt_blind(psbt, values, vbfs, assets, abfs, entropy, output_idx, 0)
-
-    # SIGN PSBT
-    # wally can identify the input to sign because we gave the keypath above
-    wally.psbt_sign(psbt, private_key, wally.EC_FLAG_GRIND_R)
-    # Fetch the signature from the PSBT input for finalization
-    sig_pos = wally.psbt_find_input_signature(psbt, idx, signing_pubkey)
-    assert sig_pos != 0, "signature not found"
-    sig = wally.psbt_get_input_signature(psbt, idx, sig_pos - 1)  # type: ignore
-
-    # FINALIZE PSBT
-    # Wally can't know how to finalize our bespoke p2wsh input, so
-    # we do it manually:
-    # 1) Set the final_witness according to our script requirements
-    stack = wally.tx_witness_stack_init(3)
-    wally.tx_witness_stack_add(stack, sig)
-    wally.tx_witness_stack_add(stack, preimage)
-    wally.tx_witness_stack_add(stack, redeem_script)
-    wally.psbt_set_input_final_witness(psbt, idx, stack)
-    # 2) Set the final_scriptsig. For p2wsh this must be empty, so
-    #    we don't have to do anything.
-    # if script_sig:
-    #     wally.psbt_set_input_final_scriptsig(psbt, idx, script_sig)
-
-    # OUTPUT FINALIZED PSBT/TX
-    # Convert the PSBT to base64, then parse in strict mode.
-    # This uses wally to perform strict verification that everything is OK.
-    base64 = wally.psbt_to_base64(psbt, 0)
-    wally.psbt_from_base64(base64, wally.WALLY_PSBT_PARSE_FLAG_STRICT)
-    # Dump the psbt. To extract the finalized tx, use e.g:
-    # elements-cli-sim finalizepsbt $(python psbt_wally.py) true
-
-    # Extract the completed tx from the now-finalized psbt
-    tx = wally.psbt_extract(psbt, 0)  # 0 == must be finalized
-
+    def build(fees: int) -> Any:
+        # INITIALIZE PSBT (PSET)
+        num_vin = 1
+        num_vout = 2
+        psbt_flags = wally.WALLY_PSBT_INIT_PSET  # Make an Elements PSET
+        psbt_version = wally.WALLY_PSBT_VERSION_2  # PSET only supports v2
+        psbt = wally.psbt_init(psbt_version, num_vin, num_vout, 0, psbt_flags)
+
+        if timeout_block_height > 0:
+            wally.psbt_set_fallback_locktime(psbt, timeout_block_height)
+
+        # ADD PSBT INPUT
+        idx = wally.psbt_get_num_inputs(psbt)
+        # Add the txout from the lockup tx as the witness UTXO for our input
+        input_ = wally.tx_input_init(txid, vout_n, sequence, None, None)
+        wally.psbt_add_tx_input_at(psbt, idx, 0, input_)
+        wally.psbt_set_input_witness_utxo_from_tx(psbt, idx, lockup_transaction, vout_n)
+        # Add the rangeproof
+        wally.psbt_set_input_utxo_rangeproof(psbt, idx, lockup_rangeproof)
+        # And the witness script
+        wally.psbt_set_input_witness_script(psbt, idx, redeem_script)
+        # Add the key info for our private key, so psbt_sign knows what input
+        # to sign when given the private key.
+        # Since we don't have a BIP32 key, add it with a dummy fingerprint and path.
+        # When signing with a non-BIP32 private key, wally uses the key as given
+        # and doesn't attempt to derive a BIP32 key to sign with, so these dummy
+        # values aren't used except to indicate that the key belongs to this input.
+        keypaths = wally.map_keypath_public_key_init(1)
+        signing_pubkey = wally.ec_public_key_from_private_key(private_key)  # type: ignore
+        wally.map_keypath_add(keypaths, signing_pubkey, bytes(4), [0])
+        wally.psbt_set_input_keypaths(psbt, idx, keypaths)
+
+        # Uncomment to generate explicit value proofs for the input.
+        # These expose the unblinded value and asset in the PSBT; we
+        # don't need them for this use-case.
+        # wally.psbt_generate_input_explicit_proofs(psbt, idx, unblinded_amount,
+        # unblinded_asset, abf, vbf, secrets.token_bytes(32))
+
+        # ADD PSBT OUTPUT
+        output_idx = wally.psbt_get_num_outputs(psbt)
+        asset_tag = bytearray([1]) + unblinded_asset  # Explicit (unblinded) asset
+        value = wally.tx_confidential_value_from_satoshi(unblinded_amount - fees)  # type: ignore
+        txout = wally.tx_elements_output_init(
+            receive_script_pubkey, asset_tag, value, None
+        )
+        wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout)
+        wally.psbt_set_output_blinding_public_key(
+            psbt, output_idx, receive_blinding_pubkey
+        )
+        wally.psbt_set_output_blinder_index(psbt, output_idx, 0)
+
+        # ADD FEE OUTPUT
+        fee_value = wally.tx_confidential_value_from_satoshi(fees)  # type: ignore
+        fee_txout = wally.tx_elements_output_init(None, asset_tag, fee_value)
+        wally.psbt_add_tx_output_at(psbt, output_idx + 1, 0, fee_txout)
+
+        # BLIND PSBT
+        entropy = get_entropy(1)
+        values, vbfs, assets, abfs = [wally.map_init(1, None) for _ in range(4)]
+
+        unblinded_value = wally.tx_confidential_value_from_satoshi(unblinded_amount)  # type: ignore
+        wally.map_add_integer(values, idx, unblinded_value)
+        wally.map_add_integer(vbfs, idx, vbf)
+        wally.map_add_integer(assets, idx, unblinded_asset)
+        wally.map_add_integer(abfs, idx, abf)
+
+        # returns ephemeral_keys
+        _ = wally.psbt_blind(psbt, values, vbfs, assets, abfs, entropy, output_idx, 0)
+
+        # SIGN PSBT
+        # wally can identify the input to sign because we gave the keypath above
+        wally.psbt_sign(psbt, private_key, wally.EC_FLAG_GRIND_R)
+        # Fetch the signature from the PSBT input for finalization
+        sig_pos = wally.psbt_find_input_signature(psbt, idx, signing_pubkey)
+        assert sig_pos != 0, "signature not found"
+        sig = wally.psbt_get_input_signature(psbt, idx, sig_pos - 1)  # type: ignore
+
+        # FINALIZE PSBT
+        # Wally can't know how to finalize our bespoke p2wsh input, so
+        # we do it manually:
+        # 1) Set the final_witness according to our script requirements
+        stack = wally.tx_witness_stack_init(3)
+        wally.tx_witness_stack_add(stack, sig)
+        wally.tx_witness_stack_add(stack, preimage)
+        wally.tx_witness_stack_add(stack, redeem_script)
+        wally.psbt_set_input_final_witness(psbt, idx, stack)
+        # 2) Set the final_scriptsig. For p2wsh this must be empty, so
+        #    we don't have to do anything.
+        # if script_sig:
+        #     wally.psbt_set_input_final_scriptsig(psbt, idx, script_sig)
+
+        # OUTPUT FINALIZED PSBT/TX
+        # Convert the PSBT to base64, then parse in strict mode.
+        # This uses wally to perform strict verification that everything is OK.
+        base64 = wally.psbt_to_base64(psbt, 0)
+        wally.psbt_from_base64(base64, wally.WALLY_PSBT_PARSE_FLAG_STRICT)
+        # Dump the psbt. To extract the finalized tx, use e.g:
+        # elements-cli-sim finalizepsbt $(python psbt_wally.py) true
+
+        # Extract the completed tx from the now-finalized psbt
+        return wally.psbt_extract(psbt, 0)  # 0 == must be finalized
+
+    # the fee output is explicit, the exact size is known after blinding
+    tx = build_with_feerate(build, fees, feerate, wally.tx_get_vsize)
     rawtx = str(wally.tx_to_hex(tx, wally.WALLY_TX_FLAG_USE_WITNESS))
 
     return rawtx
@@ -0,0 +1,172 @@
+"""boltz_client websocket module, multiplexed swap status updates"""
+
+import asyncio
+import json
+from dataclasses import fields
+from typing import Any, Callable, Optional
+
+import websockets
+
+from .boltz import BoltzSwapStatusResponse
+
+STATUS_FIELDS = {field.name for field in fields(BoltzSwapStatusResponse)}
+
+
+class BoltzSwapStatusSubscription:
+    """status updates of a single swap, received through a BoltzSwapStatusStream"""
+
+    def __init__(self, stream: "BoltzSwapStatusStream", boltz_id: str):
+        self.stream = stream
+        self.boltz_id = boltz_id
+        self.queue: asyncio.Queue[BoltzSwapStatusResponse] = asyncio.Queue()
+
+    async def next(self, timeout: Optional[float] = None) -> BoltzSwapStatusResponse:
+        """next status update, raises asyncio.TimeoutError after `timeout`"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> BoltzSwapStatusResponse:
+        return await self.queue.get()
+
+    async def close(self) -> None:
+        await self.stream.remove(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class BoltzSwapStatusStream:
+    """
+    One websocket connection to the boltz `swap.update` channel for all swaps.
+    Swap ids are (un)subscribed in bulk, the connection is opened with the first
+    subscription and it reconnects and resubscribes automatically.
+    """
+
+    def __init__(self, ws_url: str, reconnect_interval: float = 5):
+        self.ws_url = ws_url
+        self.reconnect_interval = reconnect_interval
+        self.connected = asyncio.Event()
+        self.last_error: Optional[str] = None
+        self._subscriptions: dict[str, set[BoltzSwapStatusSubscription]] = {}
+        # called with every update of a subscribed swap
+        self.listeners: list[Callable[[str, BoltzSwapStatusResponse], None]] = []
+        self._wanted = asyncio.Event()
+        self._ws: Optional[Any] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def boltz_ids(self) -> list[str]:
+        return list(self._subscriptions.keys())
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        self._task = None
+
+    async def subscribe(self, boltz_ids: list[str]) -> None:
+        """subscribe to swap ids without consuming their updates, e.g. to preload"""
+        new_ids = [_id for _id in boltz_ids if _id not in self._subscriptions]
+        for boltz_id in new_ids:
+            self._subscriptions[boltz_id] = set()
+        if new_ids:
+            self._wanted.set()
+            await self._send("subscribe", new_ids)
+
+    async def unsubscribe(self, boltz_ids: list[str]) -> None:
+        old_ids = [_id for _id in boltz_ids if _id in self._subscriptions]
+        for boltz_id in old_ids:
+            del self._subscriptions[boltz_id]
+        if not self._subscriptions:
+            self._wanted.clear()
+        if old_ids:
+            await self._send("unsubscribe", old_ids)
+
+    async def updates(self, boltz_id: str) -> BoltzSwapStatusSubscription:
+        """subscribe to a swap and get an async iterator of its status updates"""
+        self.start()
+        subscription = BoltzSwapStatusSubscription(self, boltz_id)
+        await self.subscribe([boltz_id])
+        self._subscriptions[boltz_id].add(subscription)
+        return subscription
+
+    async def remove(self, subscription: BoltzSwapStatusSubscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.boltz_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            await self.unsubscribe([subscription.boltz_id])
+
+    async def wait_for(
+        self,
+        boltz_id: str,
+        predicate: Callable[[BoltzSwapStatusResponse], bool],
+        timeout: Optional[float] = None,
+    ) -> BoltzSwapStatusResponse:
+        """future like, wait for the first status update matching `predicate`"""
+        async with await self.updates(boltz_id) as subscription:
+
+            async def _wait():
+                async for status in subscription:
+                    if predicate(status):
+                        return status
+
+            return await asyncio.wait_for(_wait(), timeout)
+
+    def handle_message(self, message: dict) -> None:
+        if message.get("event") != "update" or message.get("channel") != "swap.update":
+            return
+        for update in message.get("args", []):
+            boltz_id = update.get("id")
+            subscriptions = self._subscriptions.get(boltz_id)
+            if subscriptions is None or "status" not in update:
+                continue
+            status = BoltzSwapStatusResponse(
+                **{k: v for k, v in update.items() if k in STATUS_FIELDS}
+            )
+            for listener in self.listeners:
+                listener(boltz_id, status)
+            for subscription in subscriptions:
+                subscription.queue.put_nowait(status)
+
+    async def _send(self, op: str, boltz_ids: list[str]) -> None:
+        if not self._ws or not self.connected.is_set():
+            # (re)subscribed on connect
+            return
+        try:
+            await self._ws.send(
+                json.dumps({"op": op, "channel": "swap.update", "args": boltz_ids})
+            )
+        except Exception as exc:
+            self.last_error = str(exc)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wanted.wait()
+            try:
+                async with websockets.connect(self.ws_url) as ws:
+                    self._ws = ws
+                    self.connected.set()
+                    self.last_error = None
+                    if self._subscriptions:
+                        await self._send("subscribe", self.boltz_ids)
+                    async for message in ws:
+                        self.handle_message(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.last_error = str(exc)
+            finally:
+                self._ws = None
+                self.connected.clear()
+            if self._subscriptions:
+                await asyncio.sleep(self.reconnect_interval)
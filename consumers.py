@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import time
+from collections.abc import Awaitable, Callable
+
+from lnbits.core.models import Payment
+from loguru import logger
+
+from .models import InvoiceQueueStats
+
+INVOICE_WORKERS = 8
+# per worker, a full queue holds back the dispatch of further invoices
+INVOICE_QUEUE_SIZE = 100
+
+
+class InvoiceConsumerPool:
+    """
+    Handles paid invoices with a bounded pool of workers, so a slow boltz api
+    during an auto swap does not stall the invoices of other wallets. Invoices
+    of a wallet always go to the same worker and are handled in order. Invoices
+    which `queued` rejects do not need a worker, they are handled right away by
+    the dispatcher and must be quick.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Payment], Awaitable[None]],
+        workers: int = INVOICE_WORKERS,
+        queue_size: int = INVOICE_QUEUE_SIZE,
+        queued: Callable[[Payment], bool] | None = None,
+    ) -> None:
+        self.handler = handler
+        self.queued = queued
+        self.source: asyncio.Queue[Payment] | None = None
+        self.queues: list[asyncio.Queue[tuple[float, Payment]]] = [
+            asyncio.Queue(queue_size) for _ in range(workers)
+        ]
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def worker(self, wallet_id: str) -> int:
+        digest = hashlib.sha256(wallet_id.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % len(self.queues)
+
+    async def dispatch(self, payment: Payment) -> None:
+        if self.queued and not self.queued(payment):
+            await self._handle(payment)
+            return
+        queue = self.queues[self.worker(payment.wallet_id)]
+        if queue.full():
+            logger.warning(
+                f"Boltz - invoice queue full, wallet: {payment.wallet_id}, "
+                f"waiting for worker {self.worker(payment.wallet_id)}"
+            )
+        await queue.put((time.monotonic(), payment))
+
+    async def run(self, source: asyncio.Queue[Payment]) -> None:
+        self.source = source
+        workers = [asyncio.create_task(self._work(queue)) for queue in self.queues]
+        try:
+            while True:
+                await self.dispatch(await source.get())
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _work(self, queue: asyncio.Queue[tuple[float, Payment]]) -> None:
+        while True:
+            received, payment = await queue.get()
+            self.lag = time.monotonic() - received
+            self.max_lag = max(self.max_lag, self.lag)
+            self.busy += 1
+            try:
+                await self._handle(payment)
+            finally:
+                self.busy -= 1
+
+    async def _handle(self, payment: Payment) -> None:
+        try:
+            await self.handler(payment)
+            self.processed += 1
+        except Exception as exc:
+            self.failed += 1
+            logger.error(
+                f"Boltz - paid invoice failed, payment: {payment.payment_hash} "
+                f"- {exc!s}"
+            )
+
+    def stats(self) -> InvoiceQueueStats:
+        return InvoiceQueueStats(
+            workers=len(self.queues),
+            busy=self.busy,
+            pending=self.source.qsize() if self.source else 0,
+            queued=[queue.qsize() for queue in self.queues],
+            processed=self.processed,
+            failed=self.failed,
+            lag=self.lag,
+            max_lag=self.max_lag,
+        )
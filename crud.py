@@ -1,8 +1,10 @@
-from datetime import datetime
+from collections.abc import Sequence
+from datetime import datetime, timezone
 from typing import Union
 
-from lnbits.db import Database
+from lnbits.db import Connection, Database, dict_to_model
 from lnbits.helpers import urlsafe_short_hash
+from lnbits.utils.cache import cache
 from loguru import logger
 
 from .boltz_client.boltz import BoltzReverseSwapResponse, BoltzSwapResponse
@@ -12,30 +14,138 @@ from .models import (
     CreateAutoReverseSubmarineSwap,
     CreateReverseSubmarineSwap,
     CreateSubmarineSwap,
+    OnchainTransaction,
     ReverseSubmarineSwap,
+    ReverseSubmarineSwapSummary,
     SubmarineSwap,
+    SubmarineSwapSummary,
+    SwapEvent,
+    SwapFilters,
+    SwapJob,
 )
 
 db = Database("ext_boltz")
 
+# settings are read on every swap, cache them in memory. writes go through the
+# cache, the expiry only matters for other lnbits processes sharing the database
+settings_cache_key = "boltz:settings"
+settings_cache_expiry = 300
 
-async def get_submarine_swaps(wallet_ids: Union[str, list[str]]) -> list[SubmarineSwap]:
+
+def parse_cursor(cursor: str) -> tuple[datetime, str]:
+    """a cursor is the `time:id` of the last swap of a page"""
+    timestamp, _, swap_id = cursor.partition(":")
+    if not swap_id:
+        raise ValueError(f"invalid cursor: {cursor}")
+    return datetime.fromtimestamp(float(timestamp), timezone.utc), swap_id
+
+
+def next_cursor(
+    swaps: Sequence[
+        SubmarineSwapSummary | ReverseSubmarineSwapSummary | AutoReverseSubmarineSwap
+    ],
+    limit: int,
+) -> str | None:
+    if len(swaps) < limit:
+        return None
+    return f"{swaps[-1].time.timestamp():.6f}:{swaps[-1].id}"
+
+
+def wallets_clause(wallet_ids: Union[str, list[str]]) -> tuple[str, dict]:
+    """`wallet IN (...)` with bound parameters"""
     if isinstance(wallet_ids, str):
         wallet_ids = [wallet_ids]
+    values = {f"wallet_{i}": wallet_id for i, wallet_id in enumerate(wallet_ids)}
+    placeholders = ", ".join(f":{key}" for key in values) or "NULL"
+    return f"wallet IN ({placeholders})", values
 
-    q = ",".join([f"'{wallet_id}'" for wallet_id in wallet_ids])
-    return await db.fetchall(
-        f"SELECT * FROM boltz.submarineswap WHERE wallet IN ({q}) order by time DESC",
-        model=SubmarineSwap,
+
+def swap_list_query(
+    table: str,
+    wallet_ids: Union[str, list[str]],
+    filters: SwapFilters | None = None,
+    columns: list[str] | None = None,
+) -> tuple[str, dict]:
+    """
+    select swaps of wallets, newest first. with filters a page of swaps is
+    selected with keyset pagination on `(time, id)`.
+    """
+    wallets, values = wallets_clause(wallet_ids)
+    where = [wallets]
+    limit = ""
+    if filters:
+        for column in ("status", "asset", "direction"):
+            value = getattr(filters, column)
+            if value is not None:
+                where.append(f"{column} = :{column}")
+                values[column] = value
+        # times are bound as epochs, lnbits binds datetimes on sqlite as whole
+        # seconds, but stores them with their fraction
+        if filters.since is not None:
+            where.append(f"time >= {db.timestamp_placeholder('since')}")
+            values["since"] = float(filters.since)
+        if filters.until is not None:
+            where.append(f"time < {db.timestamp_placeholder('until')}")
+            values["until"] = float(filters.until)
+        if filters.cursor:
+            last_time, values["cursor_id"] = parse_cursor(filters.cursor)
+            values["cursor_time"] = last_time.timestamp()
+            cursor_time = db.timestamp_placeholder("cursor_time")
+            where.append(
+                f"(time < {cursor_time} OR (time = {cursor_time} AND id < :cursor_id))"
+            )
+        values["limit"] = filters.limit
+        limit = "LIMIT :limit"
+    query = f"""
+        SELECT {", ".join(columns) if columns else "*"} FROM {table}
+        WHERE {" AND ".join(where)}
+        ORDER BY time DESC, id DESC {limit}
+    """
+    return query, values
+
+
+async def get_submarine_swaps(
+    wallet_ids: Union[str, list[str]], filters: SwapFilters | None = None
+) -> list[SubmarineSwap]:
+    query, values = swap_list_query("boltz.submarineswap", wallet_ids, filters)
+    return await db.fetchall(query, values, SubmarineSwap)
+
+
+async def get_submarine_swap_summaries(
+    wallet_ids: Union[str, list[str]], filters: SwapFilters | None = None
+) -> list[SubmarineSwapSummary]:
+    query, values = swap_list_query(
+        "boltz.submarineswap",
+        wallet_ids,
+        filters,
+        list(SubmarineSwapSummary.__fields__),
     )
+    return await db.fetchall(query, values, SubmarineSwapSummary)
 
 
 async def get_all_pending_submarine_swaps() -> list[SubmarineSwap]:
     return await db.fetchall(
         "SELECT * FROM boltz.submarineswap WHERE status='pending' order by time DESC",
+        model=SubmarineSwap,
     )
 
 
+async def get_pending_submarine_swap_timeouts(
+    asset: str, max_height: int | None = None
+) -> list[tuple[str, int]]:
+    """ids and timeout block heights of the pending swaps of `asset`"""
+    query = (
+        "SELECT id, timeout_block_height FROM boltz.submarineswap "
+        "WHERE status = 'pending' AND asset = :asset"
+    )
+    values: dict = {"asset": asset}
+    if max_height is not None:
+        query += " AND timeout_block_height <= :max_height"
+        values["max_height"] = max_height
+    rows: list[dict] = await db.fetchall(query, values)
+    return [(row["id"], row["timeout_block_height"]) for row in rows]
+
+
 async def get_submarine_swap(swap_id) -> SubmarineSwap | None:
     return await db.fetchone(
         "SELECT * FROM boltz.submarineswap WHERE id = :id",
@@ -68,24 +178,29 @@ async def create_submarine_swap(
         **data.dict(),
     )
 
-    await db.insert("boltz.submarineswap", swap)
+    async with db.connect() as conn:
+        await conn.insert("boltz.submarineswap", swap)
+        await insert_swap_event(conn, swap, boltz_status="swap.created")
     return swap
 
 
 async def get_reverse_submarine_swaps(
-    wallet_ids: Union[str, list[str]],
+    wallet_ids: Union[str, list[str]], filters: SwapFilters | None = None
 ) -> list[ReverseSubmarineSwap]:
-    if isinstance(wallet_ids, str):
-        wallet_ids = [wallet_ids]
-
-    q = ",".join([f"'{wallet_id}'" for wallet_id in wallet_ids])
-    return await db.fetchall(
-        f"""
-        SELECT * FROM boltz.reverse_submarineswap
-        WHERE wallet IN ({q}) order by time DESC
-        """,
-        model=ReverseSubmarineSwap,
+    query, values = swap_list_query("boltz.reverse_submarineswap", wallet_ids, filters)
+    return await db.fetchall(query, values, ReverseSubmarineSwap)
+
+
+async def get_reverse_submarine_swap_summaries(
+    wallet_ids: Union[str, list[str]], filters: SwapFilters | None = None
+) -> list[ReverseSubmarineSwapSummary]:
+    query, values = swap_list_query(
+        "boltz.reverse_submarineswap",
+        wallet_ids,
+        filters,
+        list(ReverseSubmarineSwapSummary.__fields__),
     )
+    return await db.fetchall(query, values, ReverseSubmarineSwapSummary)
 
 
 async def get_all_pending_reverse_submarine_swaps() -> list[ReverseSubmarineSwap]:
@@ -126,21 +241,19 @@ async def create_reverse_submarine_swap(
         blinding_key=swap.blindingKey,
         **data.dict(),
     )
-    await db.insert("boltz.reverse_submarineswap", reverse_swap)
+    async with db.connect() as conn:
+        await conn.insert("boltz.reverse_submarineswap", reverse_swap)
+        await insert_swap_event(conn, reverse_swap, boltz_status="swap.created")
     return reverse_swap
 
 
 async def get_auto_reverse_submarine_swaps(
-    wallet_ids: list[str],
+    wallet_ids: list[str], filters: SwapFilters | None = None
 ) -> list[AutoReverseSubmarineSwap]:
-    q = ",".join([f"'{wallet_id}'" for wallet_id in wallet_ids])
-    return await db.fetchall(
-        f"""
-        SELECT * FROM boltz.auto_reverse_submarineswap
-        WHERE wallet IN ({q}) order by time DESC
-        """,
-        model=AutoReverseSubmarineSwap,
+    query, values = swap_list_query(
+        "boltz.auto_reverse_submarineswap", wallet_ids, filters
     )
+    return await db.fetchall(query, values, AutoReverseSubmarineSwap)
 
 
 async def get_auto_reverse_submarine_swap(
@@ -163,6 +276,13 @@ async def get_auto_reverse_submarine_swap_by_wallet(
     )
 
 
+async def get_auto_reverse_submarine_swap_wallet_ids() -> list[str]:
+    rows: list[dict] = await db.fetchall(
+        "SELECT DISTINCT wallet FROM boltz.auto_reverse_submarineswap"
+    )
+    return [row["wallet"] for row in rows]
+
+
 async def create_auto_reverse_submarine_swap(
     create_swap: CreateAutoReverseSubmarineSwap,
 ) -> AutoReverseSubmarineSwap:
@@ -187,50 +307,349 @@ async def delete_auto_reverse_submarine_swap(swap_id):
     )
 
 
-async def update_swap_status(swap_id: str, status: str):
+# legal status transitions, every other status is final
+SWAP_STATUS_TRANSITIONS = {
+    "pending": {"complete", "failed", "refunded"},
+}
 
-    swap = await get_submarine_swap(swap_id)
-    if swap:
-        await db.execute(
-            "UPDATE boltz.submarineswap SET status = :status WHERE id = :id",
-            {"status": status, "id": swap_id},
-        )
-        logger.info(
-            f"Boltz - swap status change: {status}. "
-            f"boltz_id: {swap.boltz_id}, wallet: {swap.wallet}"
-        )
-        return swap
 
-    reverse_swap = await get_reverse_submarine_swap(swap_id)
-    if reverse_swap:
-        await db.execute(
-            "UPDATE boltz.reverse_submarineswap SET status = :status WHERE id = :id",
-            {"status": status, "id": swap_id},
+async def update_swap_status(
+    swap_id: str,
+    status: str,
+    reverse: bool,
+    expected: str = "pending",
+    boltz_status: str | None = None,
+    txid: str | None = None,
+) -> SubmarineSwap | ReverseSubmarineSwap | None:
+    """
+    compare-and-set the status of a swap in a single statement and log the
+    transition as swap event on the same connection. returns the updated swap,
+    or None if the swap is not found or its status is not `expected` anymore,
+    e.g. because another worker finished it first.
+    """
+    if status not in SWAP_STATUS_TRANSITIONS.get(expected, set()):
+        raise ValueError(f"illegal swap status transition: {expected} -> {status}")
+
+    table = "reverse_submarineswap" if reverse else "submarineswap"
+    model: type[SubmarineSwap | ReverseSubmarineSwap] = (
+        ReverseSubmarineSwap if reverse else SubmarineSwap
+    )
+    async with db.connect() as conn:
+        result = await conn.execute(
+            f"""
+            UPDATE boltz.{table} SET status = :status
+            WHERE id = :id AND status = :expected
+            RETURNING *
+            """,
+            {"id": swap_id, "status": status, "expected": expected},
         )
-        logger.info(
-            f"Boltz - reverse swap status change: {status}. "
-            f"boltz_id: {reverse_swap.boltz_id}, wallet: {reverse_swap.wallet}"
+        row = result.mappings().first()
+        if row:
+            swap = dict_to_model(row, model)
+            await insert_swap_event(conn, swap, boltz_status, txid)
+    if not row:
+        logger.debug(
+            f"Boltz - swap status not changed to {status}, swap: {swap_id} "
+            f"is not {expected}."
         )
-        return reverse_swap
+        return None
+    logger.info(
+        f"Boltz - {'reverse swap' if reverse else 'swap'} status change: {status}. "
+        f"boltz_id: {swap.boltz_id}, wallet: {swap.wallet}"
+    )
+    return swap
+
 
-    return None
+async def update_swap_statuses(
+    swap_ids: list[str],
+    status: str,
+    reverse: bool,
+    expected: str = "pending",
+    txid: str | None = None,
+) -> list[SubmarineSwap | ReverseSubmarineSwap]:
+    """
+    compare-and-set the status of several swaps in a single statement, e.g. all
+    swaps refunded by one batch transaction. returns the updated swaps, the ones
+    not `expected` anymore are left as they are.
+    """
+    if status not in SWAP_STATUS_TRANSITIONS.get(expected, set()):
+        raise ValueError(f"illegal swap status transition: {expected} -> {status}")
+    if not swap_ids:
+        return []
+
+    table = "reverse_submarineswap" if reverse else "submarineswap"
+    model: type[SubmarineSwap | ReverseSubmarineSwap] = (
+        ReverseSubmarineSwap if reverse else SubmarineSwap
+    )
+    values: dict = {f"id_{i}": swap_id for i, swap_id in enumerate(swap_ids)}
+    placeholders = ", ".join(f":{key}" for key in values)
+    async with db.connect() as conn:
+        result = await conn.execute(
+            f"""
+            UPDATE boltz.{table} SET status = :status
+            WHERE id IN ({placeholders}) AND status = :expected
+            RETURNING *
+            """,
+            {**values, "status": status, "expected": expected},
+        )
+        swaps = [dict_to_model(row, model) for row in result.mappings().all()]
+        for swap in swaps:
+            await insert_swap_event(conn, swap, txid=txid)
+    logger.info(
+        f"Boltz - {len(swaps)} {'reverse swaps' if reverse else 'swaps'} "
+        f"status change: {status}. txid: {txid}"
+    )
+    return swaps
 
 
 async def get_or_create_boltz_settings() -> BoltzSettings:
+    settings = cache.get(settings_cache_key)
+    if settings:
+        return settings
     settings = await db.fetchone(
         "SELECT * FROM boltz.settings LIMIT 1", model=BoltzSettings
     )
-    if settings:
-        return settings
-    settings = BoltzSettings()
-    await db.insert("boltz.settings", settings)
+    if not settings:
+        settings = BoltzSettings()
+        await db.insert("boltz.settings", settings)
+    cache.set(settings_cache_key, settings, expiry=settings_cache_expiry)
     return settings
 
 
 async def update_boltz_settings(settings: BoltzSettings) -> BoltzSettings:
     await db.update("boltz.settings", settings, "")
+    cache.set(settings_cache_key, settings, expiry=settings_cache_expiry)
     return settings
 
 
 async def delete_boltz_settings() -> None:
     await db.execute("DELETE FROM boltz.settings")
+    cache.pop(settings_cache_key)
+
+
+async def get_all_jobs() -> list[SwapJob]:
+    return await db.fetchall("SELECT * FROM boltz.jobs", model=SwapJob)
+
+
+async def get_due_jobs(now: int, limit: int = 100) -> list[SwapJob]:
+    """due jobs which are not leased by a running worker, oldest first"""
+    return await db.fetchall(
+        """
+        SELECT * FROM boltz.jobs
+        WHERE due <= :now AND (lease_until IS NULL OR lease_until < :now)
+        ORDER BY due LIMIT :limit
+        """,
+        {"now": now, "limit": limit},
+        SwapJob,
+    )
+
+
+async def upsert_jobs(jobs: list[SwapJob], owner: str, now: int) -> None:
+    """
+    create or reschedule jobs, rescheduling releases the lease. jobs leased by
+    another worker are left alone.
+    """
+    async with db.connect() as conn:
+        for job in jobs:
+            await conn.execute(
+                """
+                INSERT INTO boltz.jobs
+                (id, reverse, kind, due, attempts, last_status, last_error)
+                VALUES
+                (:id, :reverse, :kind, :due, :attempts, :last_status, :last_error)
+                ON CONFLICT (id) DO UPDATE SET
+                kind = :kind, due = :due, attempts = :attempts,
+                last_status = :last_status, last_error = :last_error,
+                lease_owner = NULL, lease_until = NULL
+                WHERE lease_owner IS NULL
+                OR lease_owner = :owner OR lease_until < :now
+                """,
+                {
+                    **job.dict(exclude={"lease_owner", "lease_until"}),
+                    "owner": owner,
+                    "now": now,
+                },
+            )
+
+
+async def lease_job(job: SwapJob, owner: str, now: int, until: int) -> bool:
+    """
+    take the lease of a job, unless another worker holds a valid one. a job which
+    is not written yet, e.g. its first write failed, is created leased.
+    """
+    result = await db.execute(
+        """
+        INSERT INTO boltz.jobs
+        (id, reverse, kind, due, attempts, last_status, last_error,
+        lease_owner, lease_until)
+        VALUES
+        (:id, :reverse, :kind, :due, :attempts, :last_status, :last_error,
+        :owner, :until)
+        ON CONFLICT (id) DO UPDATE SET lease_owner = :owner, lease_until = :until
+        WHERE lease_owner IS NULL OR lease_owner = :owner OR lease_until < :now
+        """,
+        {
+            **job.dict(exclude={"lease_owner", "lease_until"}),
+            "owner": owner,
+            "now": now,
+            "until": until,
+        },
+    )
+    return result.rowcount == 1
+
+
+async def delete_jobs(job_ids: list[str]) -> None:
+    async with db.connect() as conn:
+        for job_id in job_ids:
+            await conn.execute("DELETE FROM boltz.jobs WHERE id = :id", {"id": job_id})
+
+
+async def heartbeat_node(node_id: str, now: int) -> None:
+    await db.execute(
+        """
+        INSERT INTO boltz.nodes (id, heartbeat) VALUES (:id, :now)
+        ON CONFLICT (id) DO UPDATE SET heartbeat = :now
+        """,
+        {"id": node_id, "now": now},
+    )
+
+
+async def get_live_node_ids(since: int) -> list[str]:
+    rows: list[dict] = await db.fetchall(
+        "SELECT id FROM boltz.nodes WHERE heartbeat >= :since ORDER BY id",
+        {"since": since},
+    )
+    return [row["id"] for row in rows]
+
+
+async def delete_stale_nodes_and_leases(since: int, now: int) -> None:
+    await db.execute(
+        "DELETE FROM boltz.nodes WHERE heartbeat < :since", {"since": since}
+    )
+    await db.execute("DELETE FROM boltz.leases WHERE until < :now", {"now": now})
+
+
+async def acquire_lease(lease_id: str, owner: str, now: int, until: int) -> bool:
+    """take a named lease, unless another node holds a valid one"""
+    result = await db.execute(
+        """
+        INSERT INTO boltz.leases (id, owner, until) VALUES (:id, :owner, :until)
+        ON CONFLICT (id) DO UPDATE SET owner = :owner, until = :until
+        WHERE owner = :owner OR until < :now
+        """,
+        {"id": lease_id, "owner": owner, "now": now, "until": until},
+    )
+    return result.rowcount == 1
+
+
+async def release_lease(lease_id: str, owner: str) -> None:
+    await db.execute(
+        "DELETE FROM boltz.leases WHERE id = :id AND owner = :owner",
+        {"id": lease_id, "owner": owner},
+    )
+
+
+async def insert_swap_event(
+    conn: Connection,
+    swap: SubmarineSwap | ReverseSubmarineSwap,
+    boltz_status: str | None = None,
+    txid: str | None = None,
+) -> None:
+    """log a swap event on `conn`, e.g. the one which changed the swap status"""
+    await conn.execute(
+        """
+        INSERT INTO boltz.swap_events
+        (swap_id, wallet, reverse, status, boltz_status, txid)
+        VALUES (:swap_id, :wallet, :reverse, :status, :boltz_status, :txid)
+        """,
+        {
+            "swap_id": swap.id,
+            "wallet": swap.wallet,
+            "reverse": isinstance(swap, ReverseSubmarineSwap),
+            "status": swap.status,
+            "boltz_status": boltz_status,
+            "txid": txid,
+        },
+    )
+
+
+async def create_swap_event(
+    swap: SubmarineSwap | ReverseSubmarineSwap,
+    boltz_status: str | None = None,
+    txid: str | None = None,
+) -> None:
+    async with db.connect() as conn:
+        await insert_swap_event(conn, swap, boltz_status, txid)
+
+
+async def get_swap_events(
+    wallet_ids: Union[str, list[str]], since: int = 0, limit: int = 500
+) -> list[SwapEvent]:
+    """events of wallets after the event id `since`, oldest first"""
+    wallets, values = wallets_clause(wallet_ids)
+    return await db.fetchall(
+        f"""
+        SELECT * FROM boltz.swap_events
+        WHERE {wallets} AND id > :since
+        ORDER BY id LIMIT :limit
+        """,
+        {**values, "since": since, "limit": limit},
+        SwapEvent,
+    )
+
+
+async def get_all_swap_events(since: int, limit: int = 500) -> list[SwapEvent]:
+    """events of all wallets after the event id `since`, oldest first"""
+    return await db.fetchall(
+        "SELECT * FROM boltz.swap_events WHERE id > :since ORDER BY id LIMIT :limit",
+        {"since": since, "limit": limit},
+        SwapEvent,
+    )
+
+
+async def get_last_swap_event_id() -> int:
+    row: dict = await db.fetchone(
+        "SELECT COALESCE(MAX(id), 0) AS last_id FROM boltz.swap_events"
+    )
+    return row["last_id"]
+
+
+async def create_onchain_transaction(tx: OnchainTransaction) -> None:
+    await db.insert("boltz.onchain_transactions", tx)
+
+
+async def get_pending_onchain_transactions() -> list[OnchainTransaction]:
+    return await db.fetchall(
+        "SELECT * FROM boltz.onchain_transactions WHERE status = 'pending'",
+        model=OnchainTransaction,
+    )
+
+
+async def update_onchain_transaction(
+    txid: str, status: str | None = None, broadcast_height: int | None = None
+) -> None:
+    await db.execute(
+        """
+        UPDATE boltz.onchain_transactions
+        SET status = COALESCE(:status, status),
+            broadcast_height = COALESCE(:broadcast_height, broadcast_height)
+        WHERE id = :id
+        """,
+        {"id": txid, "status": status, "broadcast_height": broadcast_height},
+    )
+
+
+async def replace_onchain_transaction(txid: str, tx: OnchainTransaction) -> None:
+    """
+    keep `tx` and mark the transaction it replaces, `tx` is written first so it is
+    never lost, a replaced transaction still pending fails to broadcast later
+    """
+    async with db.connect() as conn:
+        await conn.insert("boltz.onchain_transactions", tx)
+        await conn.execute(
+            """
+            UPDATE boltz.onchain_transactions SET status = 'replaced'
+            WHERE id = :id AND status = 'pending'
+            """,
+            {"id": txid},
+        )
@@ -0,0 +1,108 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+from loguru import logger
+
+from .crud import get_all_swap_events, get_last_swap_event_id, get_swap_events
+from .models import SwapEvent
+
+EVENT_POLL_INTERVAL = 1
+EVENT_POLL_LIMIT = 500
+# events kept for a slow subscriber before it is dropped and has to reconnect
+EVENT_QUEUE_SIZE = 1000
+
+
+class SwapEventBroker:
+    """
+    Fans the swap event log out to the open event streams of this process. The
+    log is tailed with one query per interval for all subscribers, and only
+    while there are any, so events written by other lnbits nodes show up too.
+    """
+
+    def __init__(self) -> None:
+        self.last_id: int | None = None
+        self._subscribers: dict[asyncio.Queue[SwapEvent | None], set[str]] = {}
+
+    async def subscribe(self, wallet_ids: list[str]) -> asyncio.Queue[SwapEvent | None]:
+        """queue of the events of `wallet_ids` from now on"""
+        if self.last_id is None:
+            last_id = await get_last_swap_event_id()
+            if self.last_id is None:
+                self.last_id = last_id
+        queue: asyncio.Queue[SwapEvent | None] = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._subscribers[queue] = set(wallet_ids)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[SwapEvent | None]) -> None:
+        self._subscribers.pop(queue, None)
+
+    def publish(self, event: SwapEvent) -> None:
+        for queue, wallet_ids in list(self._subscribers.items()):
+            if event.wallet not in wallet_ids:
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # `None` ends the stream, the client resumes from its last id
+                self.unsubscribe(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def poll(self) -> None:
+        if not self._subscribers:
+            # resumed from the latest event with the next subscriber
+            self.last_id = None
+            return
+        assert self.last_id is not None
+        while True:
+            events = await get_all_swap_events(self.last_id, EVENT_POLL_LIMIT)
+            for event in events:
+                self.publish(event)
+                self.last_id = event.id
+            if len(events) < EVENT_POLL_LIMIT:
+                return
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception as exc:
+                logger.error(f"Boltz - swap event poll failed: {exc!s}")
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+
+swap_event_broker = SwapEventBroker()
+
+
+async def swap_event_stream(
+    wallet_ids: list[str], since: int | None = None
+) -> AsyncIterator[dict]:
+    """
+    server-sent events of the swaps of `wallet_ids`, the ones after the event id
+    `since` first if it is given, e.g. from the `Last-Event-ID` of a reconnect
+    """
+    queue = await swap_event_broker.subscribe(wallet_ids)
+    try:
+        last_id = since or 0
+        while since is not None:
+            events = await get_swap_events(wallet_ids, last_id, EVENT_POLL_LIMIT)
+            for event in events:
+                last_id = event.id
+                yield sse_message(event)
+            if len(events) < EVENT_POLL_LIMIT:
+                break
+        while True:
+            queued = await queue.get()
+            if queued is None:
+                return
+            # already sent while catching up
+            if queued.id <= last_id:
+                continue
+            last_id = queued.id
+            yield sse_message(queued)
+    finally:
+        swap_event_broker.unsubscribe(queue)
+
+
+def sse_message(event: SwapEvent) -> dict:
+    return {"id": str(event.id), "event": "swap", "data": event.json()}
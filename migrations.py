@@ -155,3 +155,188 @@ async def m005_fix_settings_table_drop_mempool(db):
     await db.execute("DROP TABLE boltz.settings")
     # NOTE using `boltz.settings` for the RENAME TO clause will not work in sqlite
     await db.execute("ALTER TABLE boltz.settings_backup RENAME TO settings")
+
+
+async def m006_add_settings_pairs_ttl(db):
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_pairs_ttl INT NOT NULL DEFAULT 60"
+    )
+
+
+async def create_index(
+    db, name: str, table: str, columns: str, where: str | None = None
+) -> None:
+    # sqlite expects the schema on the index name, postgres on the table name
+    if db.type == "SQLITE":
+        index, table = f"boltz.{name}", table
+    else:
+        index, table = name, f"boltz.{table}"
+    # partial indexes are supported by sqlite, postgres and cockroachdb
+    where = f" WHERE {where}" if where else ""
+    await db.execute(
+        f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns}){where}"
+    )
+
+
+async def m007_add_jobs(db):
+    await db.execute(
+        f"""
+        CREATE TABLE boltz.jobs (
+            id TEXT PRIMARY KEY,
+            reverse BOOLEAN NOT NULL,
+            kind TEXT NOT NULL,
+            due {db.big_int} NOT NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            last_status TEXT NULL,
+            last_error TEXT NULL,
+            lease_owner TEXT NULL,
+            lease_until {db.big_int} NULL
+        );
+        """
+    )
+    await create_index(db, "jobs_due", "jobs", "due")
+
+
+async def m008_add_nodes_and_leases(db):
+    await db.execute(
+        f"""
+        CREATE TABLE boltz.nodes (
+            id TEXT PRIMARY KEY,
+            heartbeat {db.big_int} NOT NULL
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TABLE boltz.leases (
+            id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            until {db.big_int} NOT NULL
+        );
+        """
+    )
+
+
+async def m009_add_swap_indexes(db):
+    # swap lists per wallet, newest first
+    await create_index(db, "submarineswap_wallet_time", "submarineswap", "wallet, time")
+    await create_index(
+        db,
+        "reverse_submarineswap_wallet_time",
+        "reverse_submarineswap",
+        "wallet, time",
+    )
+    await create_index(
+        db,
+        "auto_reverse_submarineswap_wallet_time",
+        "auto_reverse_submarineswap",
+        "wallet, time",
+    )
+    # pending swaps, a small part of all swaps
+    await create_index(
+        db, "submarineswap_pending", "submarineswap", "time", "status = 'pending'"
+    )
+    await create_index(
+        db,
+        "reverse_submarineswap_pending",
+        "reverse_submarineswap",
+        "time",
+        "status = 'pending'",
+    )
+    # lookups of swaps by boltz id and by invoice
+    await create_index(db, "submarineswap_boltz_id", "submarineswap", "boltz_id")
+    await create_index(
+        db, "reverse_submarineswap_boltz_id", "reverse_submarineswap", "boltz_id"
+    )
+    await create_index(
+        db, "submarineswap_payment_hash", "submarineswap", "payment_hash"
+    )
+
+
+async def m010_add_swap_events(db):
+    await db.execute(
+        f"""
+        CREATE TABLE boltz.swap_events (
+            id {db.serial_primary_key},
+            swap_id TEXT NOT NULL,
+            wallet TEXT NOT NULL,
+            reverse BOOLEAN NOT NULL,
+            status TEXT NOT NULL,
+            boltz_status TEXT NULL,
+            txid TEXT NULL,
+            time TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await create_index(db, "swap_events_wallet_id", "swap_events", "wallet, id")
+
+
+async def m011_add_auto_swap_coalesce_window(db):
+    await db.execute(
+        "ALTER TABLE boltz.auto_reverse_submarineswap "
+        "ADD COLUMN coalesce_window INT NOT NULL DEFAULT 0"
+    )
+
+
+async def m012_add_auto_swap_max_swap_amount(db):
+    await db.execute(
+        "ALTER TABLE boltz.auto_reverse_submarineswap "
+        f"ADD COLUMN max_swap_amount {db.big_int} NULL"
+    )
+
+
+async def m013_add_settings_claim_batch_wait(db):
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_claim_batch_wait INT NOT NULL DEFAULT 0"
+    )
+
+
+async def m014_add_settings_refund_batch_wait(db):
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_refund_batch_wait INT NOT NULL DEFAULT 0"
+    )
+
+
+async def m015_add_settings_rbf_blocks(db):
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_rbf_blocks INT NOT NULL DEFAULT 0"
+    )
+
+
+async def m016_add_onchain_transactions(db):
+    await db.execute(
+        f"""
+        CREATE TABLE boltz.onchain_transactions (
+            id TEXT PRIMARY KEY,
+            pair TEXT NOT NULL,
+            reverse BOOLEAN NOT NULL,
+            swap_ids TEXT NOT NULL,
+            lockup_rawtxs TEXT NOT NULL,
+            tx_hex TEXT NOT NULL,
+            fee {db.big_int} NOT NULL,
+            vsize INT NOT NULL,
+            broadcast_height INT NULL,
+            timeout_block_height INT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            time TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await create_index(
+        db, "onchain_transactions_status", "onchain_transactions", "status"
+    )
+
+
+async def m017_add_settings_recovery(db):
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_recovery_concurrency INT NOT NULL DEFAULT 10"
+    )
+    await db.execute(
+        "ALTER TABLE boltz.settings "
+        "ADD COLUMN boltz_recovery_deadline INT NOT NULL DEFAULT 30"
+    )
@@ -1,32 +1,68 @@
 from datetime import datetime, timezone
 
 from fastapi import Query
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 
 
 class BoltzSettings(BaseModel):
     boltz_network: str = "main"
     boltz_network_liquid: str = "liquidv1"
     boltz_url: str = "https://boltz.exchange/api"
+    boltz_pairs_ttl: int = 60
+    # max seconds to wait for more reverse swaps to claim in one transaction,
+    # capped at `BATCH_MAX_WAIT`
+    boltz_claim_batch_wait: int = 0
+    # max seconds to wait for more expired swaps to refund in one transaction,
+    # capped at `BATCH_MAX_WAIT`
+    boltz_refund_batch_wait: int = 0
+    # blocks a claim or refund may stay unconfirmed before its fee is bumped
+    boltz_rbf_blocks: int = 0
+    # swaps checked at once after a restart, and max seconds to check each one
+    boltz_recovery_concurrency: int = 10
+    boltz_recovery_deadline: int = 30
 
 
-class SubmarineSwap(BaseModel):
+SWAP_LIST_MAX_LIMIT = 1000
+AUTO_SWAP_MAX_COALESCE_WINDOW = 3600
+
+
+class SwapFilters(BaseModel):
+    status: str | None = None
+    asset: str | None = None
+    direction: str | None = None
+    since: int | None = None  # unix timestamp
+    until: int | None = None  # unix timestamp
+    cursor: str | None = None  # `X-Next-Cursor` header of the previous page
+    limit: int = 100
+
+    @validator("limit")
+    @classmethod
+    def clamp_limit(cls, limit: int) -> int:
+        return max(1, min(limit, SWAP_LIST_MAX_LIMIT))
+
+
+class SubmarineSwapSummary(BaseModel):
+    """the columns of a swap shown in lists, without secrets"""
+
     id: str
     wallet: str
     asset: str
     amount: int
     direction: str
-    feerate: bool
-    feerate_value: int | None = None
-    payment_hash: str
     time: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     status: str
-    refund_privkey: str
-    refund_address: str
     boltz_id: str
     expected_amount: int
     timeout_block_height: int
     address: str
+
+
+class SubmarineSwap(SubmarineSwapSummary):
+    feerate: bool
+    feerate_value: int | None = None
+    payment_hash: str
+    refund_privkey: str
+    refund_address: str
     bip21: str
     redeem_script: str
     blinding_key: str | None = None
@@ -42,25 +78,30 @@ class CreateSubmarineSwap(BaseModel):
     feerate_value: int | None = Query(None)
 
 
-class ReverseSubmarineSwap(BaseModel):
+class ReverseSubmarineSwapSummary(BaseModel):
+    """the columns of a reverse swap shown in lists, without secrets"""
+
     id: str
     wallet: str
     asset: str
     amount: int
     direction: str
-    feerate: bool
-    feerate_value: int | None = None
     onchain_address: str
     instant_settlement: bool
     time: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     status: str
     boltz_id: str
-    preimage: str
-    claim_privkey: str
     lockup_address: str
-    invoice: str
     onchain_amount: int
     timeout_block_height: int
+
+
+class ReverseSubmarineSwap(ReverseSubmarineSwapSummary):
+    feerate: bool
+    feerate_value: int | None = None
+    preimage: str
+    claim_privkey: str
+    invoice: str
     redeem_script: str
     blinding_key: str | None = None
 
@@ -87,6 +128,10 @@ class AutoReverseSubmarineSwap(BaseModel):
     instant_settlement: bool
     time: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     count: int
+    # seconds to wait for more payments before sizing one swap from the balance
+    coalesce_window: int = 0
+    # surpluses above the boltz limits or this cap are split into several swaps
+    max_swap_amount: int | None = None
 
 
 class CreateAutoReverseSubmarineSwap(BaseModel):
@@ -97,3 +142,83 @@ class CreateAutoReverseSubmarineSwap(BaseModel):
     instant_settlement: bool = Query(...)
     onchain_address: str = Query(...)
     feerate_limit: int | None = Query(None)
+    coalesce_window: int = Query(0, ge=0, le=AUTO_SWAP_MAX_COALESCE_WINDOW)
+    max_swap_amount: int | None = Query(None, gt=0)
+
+
+class SwapTask(BaseModel):
+    swap_id: str
+    stage: str
+    started_at: datetime
+    age: float = 0
+    error: str | None = None
+
+
+class SwapJob(BaseModel):
+    id: str  # swap id
+    reverse: bool
+    kind: str = "check"  # check, claim or refund
+    due: int  # unix timestamp
+    attempts: int = 0
+    last_status: str | None = None
+    last_error: str | None = None
+    lease_owner: str | None = None
+    lease_until: int | None = None
+
+
+class SwapEvent(BaseModel):
+    id: int
+    swap_id: str
+    wallet: str
+    reverse: bool
+    status: str  # status of the swap in lnbits
+    boltz_status: str | None = None  # status of the swap at boltz
+    txid: str | None = None  # claim or refund transaction
+    time: datetime
+
+
+class OnchainTransaction(BaseModel):
+    """broadcasted claim or refund transaction, kept to replace it by fee"""
+
+    id: str  # txid
+    pair: str
+    reverse: bool  # claim of reverse swaps, otherwise refund of swaps
+    swap_ids: list[str]
+    lockup_rawtxs: list[str]  # in the order of `swap_ids`
+    tx_hex: str
+    fee: int
+    vsize: int
+    broadcast_height: int | None = None  # set with the next fee bump check
+    timeout_block_height: int  # earliest timeout of the swaps
+    status: str = "pending"  # pending, replaced, confirmed or expired
+    time: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def feerate(self) -> float:
+        return self.fee / self.vsize
+
+
+class BoltzDashboard(BaseModel):
+    """first pages of the swap lists and the boltz pairs, for the index page"""
+
+    swaps: list[SubmarineSwapSummary]
+    swaps_cursor: str | None = None
+    reverse_swaps: list[ReverseSubmarineSwapSummary]
+    reverse_swaps_cursor: str | None = None
+    auto_reverse_swaps: list[AutoReverseSubmarineSwap]
+    auto_reverse_swaps_cursor: str | None = None
+    # fees and limits, `None` if boltz is unreachable
+    pairs: dict | None = None
+    # the event stream resumes from here
+    last_event_id: int
+
+
+class InvoiceQueueStats(BaseModel):
+    workers: int
+    busy: int
+    pending: int  # received from lnbits, not yet dispatched to a worker
+    queued: list[int]  # dispatched to each worker, not yet handled
+    processed: int
+    failed: int
+    lag: float  # seconds from dispatch to handling of the last invoice
+    max_lag: float
@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+import time
+import uuid
+
+from loguru import logger
+
+from .crud import delete_stale_nodes_and_leases, get_live_node_ids, heartbeat_node
+
+NODE_HEARTBEAT_INTERVAL = 15
+NODE_TIMEOUT = 60  # a node without heartbeat for this long is considered dead
+
+
+class NodeRegistry:
+    """
+    Coordinates several lnbits processes sharing one database. Every process is a
+    node with a heartbeat in `boltz.nodes`, pending swaps are sharded across the
+    live nodes with rendezvous hashing, so only few swaps move when a node joins
+    or leaves. Shards of dead nodes are taken over once their job leases expire.
+    """
+
+    def __init__(self) -> None:
+        self.node_id = uuid.uuid4().hex
+        # until the first heartbeat this node owns everything
+        self.live_nodes: list[str] = [self.node_id]
+
+    def owner(self, key: str) -> str:
+        return max(
+            self.live_nodes,
+            key=lambda node_id: hashlib.sha256(f"{node_id}:{key}".encode()).digest(),
+        )
+
+    def is_mine(self, key: str) -> bool:
+        return self.owner(key) == self.node_id
+
+    async def heartbeat(self) -> None:
+        now = int(time.time())
+        await heartbeat_node(self.node_id, now)
+        await delete_stale_nodes_and_leases(now - NODE_TIMEOUT, now)
+        live_nodes = await get_live_node_ids(now - NODE_TIMEOUT)
+        if self.node_id not in live_nodes:
+            live_nodes.append(self.node_id)
+        if sorted(live_nodes) != self.live_nodes:
+            self.live_nodes = sorted(live_nodes)
+            logger.info(
+                f"Boltz - node: {self.node_id}, {len(self.live_nodes)} live nodes"
+            )
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as exc:
+                logger.error(f"Boltz - node heartbeat failed: {exc!s}")
+            await asyncio.sleep(NODE_HEARTBEAT_INTERVAL)
+
+
+node_registry = NodeRegistry()
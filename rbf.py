@@ -0,0 +1,220 @@
+import asyncio
+from collections.abc import Sequence
+
+from embit.transaction import Transaction
+from loguru import logger
+
+from .boltz_client.boltz import BoltzApiException, BoltzClient
+from .boltz_client.onchain import transaction_fee, tx_vsize
+from .crud import (
+    create_onchain_transaction,
+    create_swap_event,
+    get_or_create_boltz_settings,
+    get_pending_onchain_transactions,
+    get_reverse_submarine_swap,
+    get_submarine_swap,
+    replace_onchain_transaction,
+    update_onchain_transaction,
+)
+from .models import OnchainTransaction, ReverseSubmarineSwap, SubmarineSwap
+from .nodes import node_registry
+from .utils import create_boltz_client, swap_claim_input, swap_refund_input
+
+RBF_CHECK_INTERVAL = 60
+# blocks before the timeout of a claim from which its fee is bumped every block
+RBF_URGENT_BLOCKS = 6
+RBF_BUMP_FACTOR = 1.25
+RBF_URGENT_BUMP_FACTOR = 2
+# sat/vbyte, a replacement pays at least the incremental relay fee more
+RBF_MIN_INCREMENT = 1
+RBF_MAX_FEERATE = 500
+# share of the spent lockups the fee of a replacement may take at most
+RBF_MAX_FEE_SHARE = 0.1
+# the replaced transaction or another spend of a lockup is confirmed already
+SPENT_ERRORS = ("missingorspent", "missing inputs", "already in block chain")
+
+
+class FeeBumper:
+    """
+    Replaces claim and refund transactions that are not confirmed after
+    `boltz_rbf_blocks` blocks with a higher feerate. Claims are bumped every
+    block once the timeout of their swaps is near, boltz refunds its lockup
+    after it, then they are not bumped anymore. Fees never exceed
+    `RBF_MAX_FEE_SHARE` of the swapped amount. Only BTC transactions are kept,
+    they signal replace-by-fee, and only while `boltz_rbf_blocks` is set.
+    """
+
+    async def track(
+        self,
+        client: BoltzClient,
+        txid: str,
+        swaps: Sequence[SubmarineSwap | ReverseSubmarineSwap],
+        lockup_rawtxs: list[str],
+    ) -> None:
+        """keep a broadcasted claim or refund transaction of `swaps`"""
+        tx_hex = client.broadcasts.pop(txid, None)
+        if client.pair != "BTC/BTC" or not tx_hex:
+            return
+        try:
+            settings = await get_or_create_boltz_settings()
+            if not settings.boltz_rbf_blocks:
+                return
+            await create_onchain_transaction(
+                self.onchain_transaction(client, txid, tx_hex, swaps, lockup_rawtxs)
+            )
+        except Exception as exc:
+            logger.error(f"Boltz - could not keep transaction {txid}: {exc!s}")
+
+    def onchain_transaction(
+        self,
+        client: BoltzClient,
+        txid: str,
+        tx_hex: str,
+        swaps: Sequence[SubmarineSwap | ReverseSubmarineSwap],
+        lockup_rawtxs: list[str],
+        broadcast_height: int | None = None,
+    ) -> OnchainTransaction:
+        return OnchainTransaction(
+            id=txid,
+            pair=client.pair,
+            reverse=isinstance(swaps[0], ReverseSubmarineSwap),
+            swap_ids=[swap.id for swap in swaps],
+            lockup_rawtxs=lockup_rawtxs,
+            tx_hex=tx_hex,
+            fee=transaction_fee(tx_hex, lockup_rawtxs),
+            vsize=tx_vsize(Transaction.from_string(tx_hex)),
+            broadcast_height=broadcast_height,
+            timeout_block_height=min(swap.timeout_block_height for swap in swaps),
+        )
+
+    async def check(self) -> None:
+        settings = await get_or_create_boltz_settings()
+        if not settings.boltz_rbf_blocks:
+            return
+        txs = [
+            tx
+            for tx in await get_pending_onchain_transactions()
+            if node_registry.is_mine(tx.id)
+        ]
+        if not txs:
+            return
+        client = await create_boltz_client("BTC/BTC")
+        height = await client.get_block_height()
+        for tx in txs:
+            try:
+                await self.bump_if_due(client, tx, height, settings.boltz_rbf_blocks)
+            except Exception as exc:
+                logger.warning(f"Boltz - fee bump of {tx.id} failed: {exc!s}")
+
+    async def bump_if_due(
+        self, client: BoltzClient, tx: OnchainTransaction, height: int, blocks: int
+    ) -> str | None:
+        """replace `tx` if it is unconfirmed for too long, returns the new txid"""
+        if tx.broadcast_height is None:
+            await update_onchain_transaction(tx.id, broadcast_height=height)
+            return None
+        if tx.reverse and height >= tx.timeout_block_height:
+            # boltz can refund the lockups, a higher fee only costs the user
+            logger.warning(f"Boltz - claim {tx.id} not confirmed before the timeout")
+            await update_onchain_transaction(tx.id, status="expired")
+            return None
+        urgent = tx.reverse and tx.timeout_block_height - height <= RBF_URGENT_BLOCKS
+        if height - tx.broadcast_height < (1 if urgent else blocks):
+            return None
+        if await client.get_transaction_confirmations(tx.id):
+            await update_onchain_transaction(tx.id, status="confirmed")
+            return None
+        max_feerate = RBF_MAX_FEE_SHARE * lockup_amount(tx) / tx.vsize
+        feerate = await self.bump_feerate(client, tx.feerate, urgent, max_feerate)
+        if feerate is None:
+            logger.warning(f"Boltz - fee of {tx.id} is at the max feerate already")
+            return None
+
+        swaps = await self.get_swaps(tx)
+        try:
+            if isinstance(swaps[0], ReverseSubmarineSwap):
+                claims = [
+                    swap_claim_input(swap, rawtx)
+                    for swap, rawtx in zip(swaps, tx.lockup_rawtxs, strict=True)
+                    if isinstance(swap, ReverseSubmarineSwap)
+                ]
+                txid = await client.claim_reverse_swaps(
+                    claims, swaps[0].onchain_address, feerate=feerate
+                )
+            else:
+                refunds = [
+                    swap_refund_input(swap, rawtx)
+                    for swap, rawtx in zip(swaps, tx.lockup_rawtxs, strict=True)
+                    if isinstance(swap, SubmarineSwap)
+                ]
+                txid = await client.refund_swaps(refunds, feerate=feerate)
+        except BoltzApiException as exc:
+            # confirmed meanwhile, or the confirmation was not reported
+            if any(error in str(exc).lower() for error in SPENT_ERRORS):
+                await update_onchain_transaction(tx.id, status="confirmed")
+                return None
+            raise
+
+        replacement = self.onchain_transaction(
+            client,
+            txid,
+            client.broadcasts.pop(txid),
+            swaps,
+            tx.lockup_rawtxs,
+            broadcast_height=height,
+        )
+        await replace_onchain_transaction(tx.id, replacement)
+        for swap in swaps:
+            await create_swap_event(swap, txid=txid)
+        logger.info(
+            f"Boltz - fee bumped to {replacement.feerate:.1f} sat/vbyte, "
+            f"txid: {txid}, replaced: {tx.id}"
+        )
+        return txid
+
+    async def bump_feerate(
+        self,
+        client: BoltzClient,
+        feerate: float,
+        urgent: bool,
+        max_feerate: float = RBF_MAX_FEERATE,
+    ) -> float | None:
+        """next feerate of a replacement, None if it can not be raised anymore"""
+        factor = RBF_URGENT_BUMP_FACTOR if urgent else RBF_BUMP_FACTOR
+        bumped = max(
+            feerate * factor,
+            feerate + RBF_MIN_INCREMENT,
+            await client.resolve_feerate() or 0,
+        )
+        bumped = min(bumped, max_feerate, RBF_MAX_FEERATE)
+        return bumped if bumped > feerate else None
+
+    async def get_swaps(
+        self, tx: OnchainTransaction
+    ) -> list[SubmarineSwap] | list[ReverseSubmarineSwap]:
+        swaps: list[SubmarineSwap] | list[ReverseSubmarineSwap]
+        if tx.reverse:
+            reverse_swaps = [await get_reverse_submarine_swap(i) for i in tx.swap_ids]
+            swaps = [swap for swap in reverse_swaps if swap]
+        else:
+            submarine_swaps = [await get_submarine_swap(i) for i in tx.swap_ids]
+            swaps = [swap for swap in submarine_swaps if swap]
+        if len(swaps) != len(tx.swap_ids):
+            raise ValueError(f"swap of transaction {tx.id} not found")
+        return swaps
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception as exc:
+                logger.error(f"Boltz - fee bump check failed: {exc!s}")
+            await asyncio.sleep(RBF_CHECK_INTERVAL)
+
+
+def lockup_amount(tx: OnchainTransaction) -> int:
+    """amount of the lockups spent by a transaction, its outputs plus its fee"""
+    return tx.fee + sum(out.value for out in Transaction.from_string(tx.tx_hex).vout)
+
+
+fee_bumper = FeeBumper()
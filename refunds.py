@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import itertools
+from abc import ABC, abstractmethod
+from contextlib import suppress
+
+from loguru import logger
+
+from .crud import get_pending_submarine_swap_timeouts, get_submarine_swap
+from .models import SubmarineSwap
+from .utils import create_boltz_client
+from .watcher import swap_watcher
+
+CHAIN_TIP_POLL_INTERVAL = 10
+REFUND_SCHEDULER_RETRY_INTERVAL = 30
+# seconds between reloads of the pending swaps while none are scheduled, swaps
+# created on other nodes are only seen in the database
+REFUND_SCHEDULER_RELOAD_INTERVAL = 60
+
+
+class ChainTipSource(ABC):
+    """block height of a chain, the refund scheduler waits on it for new blocks"""
+
+    @abstractmethod
+    async def wait_for_tip(self, height: int | None = None) -> int:
+        """the current block height, once it is above `height`"""
+
+
+class BoltzChainTipSource(ChainTipSource):
+    """polls the block height of the chain of a pair from boltz"""
+
+    def __init__(self, pair: str, interval: float = CHAIN_TIP_POLL_INTERVAL) -> None:
+        self.pair = pair
+        self.interval = interval
+
+    async def wait_for_tip(self, height: int | None = None) -> int:
+        while True:
+            client = await create_boltz_client(self.pair)
+            tip = await client.get_block_height()
+            if height is None or tip > height:
+                return tip
+            await asyncio.sleep(self.interval)
+
+
+class LocalChainTipSource(ChainTipSource):
+    """block height set by hand, e.g. by tests or a local node's block notify"""
+
+    def __init__(self, height: int = 0) -> None:
+        self.height = height
+        self._changed = asyncio.Event()
+
+    def set_tip(self, height: int) -> None:
+        self.height = height
+        self._changed.set()
+
+    async def wait_for_tip(self, height: int | None = None) -> int:
+        while height is not None and self.height <= height:
+            self._changed.clear()
+            await self._changed.wait()
+        return self.height
+
+
+class RefundScheduler:
+    """
+    Pending swaps of a pair in a min-heap on their timeout block height. With
+    every new block of the chain tip source, the swaps due at it are loaded, so
+    swaps created on other nodes are scheduled too, and the swaps whose refund
+    became valid are handed to the watcher right away, which refunds them on
+    the node owning them if boltz did not pay. Nothing is broadcasted before the
+    timeout, and nothing waits for the next poll of the watcher after it. The
+    chain tip is not polled while no swaps are scheduled.
+    """
+
+    def __init__(self, pair: str, source: ChainTipSource) -> None:
+        self.pair = pair
+        self.source = source
+        self.tip: int | None = None
+        self._heap: list[tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._scheduled: set[str] = set()
+        # due swaps handed to the watcher, which retries them on its own
+        self._woken: set[str] = set()
+        self._added = asyncio.Event()
+
+    def add(self, swap: SubmarineSwap) -> None:
+        self._push(swap.id, swap.timeout_block_height)
+        self._added.set()
+
+    def _push(self, swap_id: str, timeout_block_height: int) -> None:
+        if swap_id in self._scheduled:
+            return
+        self._scheduled.add(swap_id)
+        heapq.heappush(self._heap, (timeout_block_height, next(self._seq), swap_id))
+
+    async def load(self, max_height: int | None = None) -> None:
+        """schedule the pending swaps, only those due at `max_height` if set"""
+        swaps = await get_pending_submarine_swap_timeouts(self.pair, max_height)
+        # woken swaps which are still pending are due, so they are loaded
+        self._woken.intersection_update(swap_id for swap_id, _ in swaps)
+        for swap_id, timeout_block_height in swaps:
+            if swap_id not in self._woken:
+                self._push(swap_id, timeout_block_height)
+
+    def pop_due(self, height: int) -> list[str]:
+        """ids of the swaps refundable at `height`, removed from the heap"""
+        due = []
+        while self._heap and self._heap[0][0] <= height:
+            _, _, swap_id = heapq.heappop(self._heap)
+            self._scheduled.discard(swap_id)
+            due.append(swap_id)
+        return due
+
+    async def step(self) -> None:
+        """wait for the next block with scheduled swaps and wake the due ones"""
+        while not self._heap:
+            self._added.clear()
+            await self.load()
+            if not self._heap:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(
+                        self._added.wait(), REFUND_SCHEDULER_RELOAD_INTERVAL
+                    )
+        self.tip = await self.source.wait_for_tip(self.tip)
+        swap_watcher.set_block_height(self.pair, self.tip)
+        await self.load(self.tip)
+        for swap_id in self.pop_due(self.tip):
+            # swaps paid or refunded meanwhile stay in the heap until due
+            swap = await get_submarine_swap(swap_id)
+            if not swap or swap.status != "pending":
+                continue
+            logger.debug(
+                f"Boltz - swap: {swap.boltz_id} refundable at block {self.tip}"
+            )
+            # the watcher hands swaps of other nodes over to their owner
+            swap_watcher.wake(swap)
+            self._woken.add(swap.id)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.step()
+            except Exception as exc:
+                logger.error(f"Boltz - {self.pair} refund scheduler: {exc!s}")
+                await asyncio.sleep(REFUND_SCHEDULER_RETRY_INTERVAL)
+
+
+refund_schedulers = {
+    pair: RefundScheduler(pair, BoltzChainTipSource(pair))
+    for pair in ("BTC/BTC", "L-BTC/BTC")
+}
+
+
+def schedule_refund(swap: SubmarineSwap) -> None:
+    scheduler = refund_schedulers.get(swap.asset)
+    if scheduler:
+        scheduler.add(swap)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Coroutine
+from datetime import datetime, timezone
+
+from loguru import logger
+
+from .models import SwapTask
+
+
+class TaskSupervisor:
+    """
+    Registry of all per swap tasks (hold invoice payments, watcher checks, claims).
+    Keeps a reference to every task so it is not garbage collected mid-flight,
+    logs and remembers crashes and cancels everything on shutdown.
+    """
+
+    def __init__(self, max_crashes: int = 100) -> None:
+        self.tasks: dict[asyncio.Task, SwapTask] = {}
+        self.crashes: deque[SwapTask] = deque(maxlen=max_crashes)
+
+    def create_task(self, swap_id: str, stage: str, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=f"ext_boltz_{stage}_{swap_id}")
+        self.tasks[task] = SwapTask(
+            swap_id=swap_id,
+            stage=stage,
+            started_at=datetime.now(timezone.utc),
+        )
+        task.add_done_callback(self._done)
+        return task
+
+    def set_stage(self, stage: str) -> None:
+        """update the stage of the current task, e.g. from `check` to `claim`"""
+        task = asyncio.current_task()
+        if task and task in self.tasks:
+            self.tasks[task].stage = stage
+
+    def get_stage(self, task: asyncio.Task) -> str | None:
+        info = self.tasks.get(task)
+        return info.stage if info else None
+
+    def list_tasks(self) -> list[SwapTask]:
+        now = time.time()
+        tasks = [*self.tasks.values(), *self.crashes]
+        for task in tasks:
+            task.age = round(now - task.started_at.timestamp(), 3)
+        return sorted(tasks, key=lambda task: task.started_at)
+
+    def cancel_all(self) -> None:
+        for task in list(self.tasks.keys()):
+            task.cancel()
+
+    def _done(self, task: asyncio.Task) -> None:
+        info = self.tasks.pop(task, None)
+        if not info or task.cancelled():
+            return
+        exc = task.exception()
+        if exc:
+            info.error = str(exc) or exc.__class__.__name__
+            self.crashes.append(info)
+            logger.error(
+                f"Boltz - {info.stage} task of swap: {info.swap_id} crashed - {exc!s}"
+            )
+
+
+task_supervisor = TaskSupervisor()
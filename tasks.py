@@ -1,173 +1,474 @@
 import asyncio
+import hashlib
+import time
+from collections import Counter
 
-from lnbits.core.crud import get_wallet
+from lnbits.core.crud import get_standalone_payment, get_wallet
 from lnbits.core.models import Payment
 from lnbits.core.services import check_transaction_status, fee_reserve_total
 from lnbits.tasks import register_invoice_listener
 from loguru import logger
 
-from .boltz_client.boltz import BoltzNotFoundException, BoltzSwapStatusException
+from .auto_swaps import auto_swap_index
+from .boltz_client.boltz import BoltzClient
+from .consumers import InvoiceConsumerPool
 from .crud import (
+    acquire_lease,
     create_reverse_submarine_swap,
+    delete_jobs,
+    get_all_jobs,
     get_all_pending_reverse_submarine_swaps,
     get_all_pending_submarine_swaps,
     get_auto_reverse_submarine_swap_by_wallet,
-    get_submarine_swap,
+    get_or_create_boltz_settings,
+    lease_job,
+    release_lease,
     update_auto_swap_count,
     update_swap_status,
 )
-from .models import CreateReverseSubmarineSwap, ReverseSubmarineSwap, SubmarineSwap
-from .utils import create_boltz_client, execute_reverse_swap
+from .models import (
+    AutoReverseSubmarineSwap,
+    CreateReverseSubmarineSwap,
+    ReverseSubmarineSwap,
+    SubmarineSwap,
+)
+from .nodes import node_registry
+from .supervisor import task_supervisor
+from .utils import create_boltz_client, execute_reverse_swap, split_amount
+from .watcher import JOB_LEASE_TIME, WatchedSwap, next_check_interval, swap_watcher
 
 
 async def wait_for_paid_invoices():
-    invoice_queue = asyncio.Queue()
+    invoice_queue: asyncio.Queue[Payment] = asyncio.Queue()
     register_invoice_listener(invoice_queue, "ext_boltz")
+    await invoice_consumers.run(invoice_queue)
 
-    while True:
-        payment = await invoice_queue.get()
-        await on_invoice_paid(payment)
+
+# every lnbits node may receive the same paid invoice, only one handles it
+PAYMENT_LEASE_TIME = 86400
 
 
 async def on_invoice_paid(payment: Payment) -> None:
+    is_boltz = payment.extra.get("tag") == "boltz"
+    if not is_boltz and payment.wallet_id not in auto_swap_index:
+        # the vast majority of invoices, skipped without database queries
+        return
+
+    now = int(time.time())
+    if not await acquire_lease(
+        f"payment:{payment.payment_hash}",
+        node_registry.node_id,
+        now,
+        now + PAYMENT_LEASE_TIME,
+    ):
+        logger.debug(f"Boltz - payment: {payment.payment_hash} handled by other node.")
+        return
 
-    await check_for_auto_swap(payment)
+    if payment.wallet_id in auto_swap_index:
+        await check_for_auto_swap(payment)
 
-    if payment.extra.get("tag") != "boltz":
-        # not a boltz invoice
+    if not is_boltz:
         return
 
     swap_id = payment.extra.get("swap_id")
-    if swap_id:
-        swap = await get_submarine_swap(swap_id)
-        if swap:
-            await update_swap_status(swap_id, "complete")
+    if swap_id and await update_swap_status(swap_id, "complete", reverse=False):
+        swap_watcher.unwatch(swap_id)
+
+
+def needs_worker(payment: Payment) -> bool:
+    """only auto swaps may be slow, all other invoices are handled right away"""
+    return payment.wallet_id in auto_swap_index
+
+
+invoice_consumers = InvoiceConsumerPool(on_invoice_paid, queued=needs_worker)
+
+
+# serializes the auto swaps of a wallet across lnbits nodes, renewed while a
+# swap runs
+AUTO_SWAP_LOCK_TIME = 60
+# max seconds an invoice worker waits for the lock of a wallet, after that the
+# auto swap is retried later, outside of the worker
+AUTO_SWAP_LOCK_WAIT = 10
+AUTO_SWAP_RETRY_DELAY = 30
+# until the hold invoice of a new auto swap is deducted from the wallet balance
+AUTO_SWAP_SETTLE_TIMEOUT = 10
+# swaps a surplus above the boltz limits is split into at most
+AUTO_SWAP_MAX_SWAPS = 10
+
+auto_swap_locks: dict[str, asyncio.Lock] = {}
+# coalesced auto swaps of wallets, waiting for their window to pass
+coalesced_auto_swaps: dict[str, asyncio.Task] = {}
 
 
 async def check_for_auto_swap(payment: Payment) -> None:
     auto_swap = await get_auto_reverse_submarine_swap_by_wallet(payment.wallet_id)
-    if auto_swap:
-        wallet = await get_wallet(payment.wallet_id)
-        if wallet:
-            reserve = fee_reserve_total(wallet.balance_msat) / 1000
-            balance = wallet.balance_msat / 1000
-            amount = balance - auto_swap.balance - reserve
-            if amount >= auto_swap.amount:
-                try:
-                    client = await create_boltz_client(auto_swap.asset)
-                except Exception as exc:
-                    logger.error(f"Boltz API issues: {exc!s}")
-                    return
-                fees = client.get_fee_estimation_claim()
-                if auto_swap.feerate_limit and fees > auto_swap.feerate_limit:
-                    logger.warning(
-                        "Boltz: auto reverse swap not created, fee limit exceeded: "
-                        f"{auto_swap.feerate_limit}, actual fees: {fees}"
-                    )
-                    return
-                claim_privkey_wif, preimage_hex, swap = (
-                    await client.create_reverse_swap(amount=int(amount))
-                )
-                new_swap = await create_reverse_submarine_swap(
-                    CreateReverseSubmarineSwap(
-                        wallet=auto_swap.wallet,
-                        amount=int(amount),
-                        instant_settlement=auto_swap.instant_settlement,
-                        onchain_address=auto_swap.onchain_address,
-                        feerate=False,
-                    ),
-                    claim_privkey_wif,
-                    preimage_hex,
-                    swap,
-                )
-                await execute_reverse_swap(client, new_swap)
-                await update_auto_swap_count(auto_swap.id, auto_swap.count + 1)
-
-                logger.info(
-                    "Boltz: auto reverse swap created with amount: "
-                    f"{amount}, boltz_id: {new_swap.boltz_id}"
-                )
-
-
-async def check_for_pending_swaps():
+    if not auto_swap:
+        return
+    if not auto_swap.coalesce_window:
+        await run_auto_swap(payment.wallet_id)
+        return
+    if payment.wallet_id in coalesced_auto_swaps:
+        # the waiting auto swap is sized from a balance including this payment
+        return
+    coalesced_auto_swaps[payment.wallet_id] = task_supervisor.create_task(
+        f"auto_{payment.wallet_id}",
+        "coalesce",
+        coalesce_auto_swap(payment.wallet_id, auto_swap.coalesce_window),
+    )
+
+
+async def coalesce_auto_swap(wallet_id: str, window: int) -> None:
+    try:
+        await asyncio.sleep(window)
+    finally:
+        # payments from now on are not covered by this auto swap
+        coalesced_auto_swaps.pop(wallet_id, None)
+    await run_auto_swap(wallet_id)
+
+
+async def run_auto_swap(wallet_id: str) -> None:
+    """auto swap the surplus of a wallet, one at a time per wallet"""
+    lease_id = f"auto_swap:{wallet_id}"
+    lock = auto_swap_locks.setdefault(wallet_id, asyncio.Lock())
+    if not await acquire_auto_swap_lock(lock, lease_id):
+        logger.debug(
+            f"Boltz - auto swap of wallet: {wallet_id} is running, "
+            f"retrying in {AUTO_SWAP_RETRY_DELAY}s."
+        )
+        retry_auto_swap(wallet_id)
+        return
+    renewal = asyncio.create_task(renew_auto_swap_lease(lease_id))
+    try:
+        # read again, it may have been changed while waiting for the lock
+        auto_swap = await get_auto_reverse_submarine_swap_by_wallet(wallet_id)
+        if auto_swap:
+            await execute_auto_swap(auto_swap)
+    finally:
+        renewal.cancel()
+        try:
+            await release_lease(lease_id, node_registry.node_id)
+        finally:
+            lock.release()
+
+
+async def acquire_auto_swap_lock(lock: asyncio.Lock, lease_id: str) -> bool:
+    """take the local lock and the lease of a wallet, waits a bounded time"""
+    deadline = time.monotonic() + AUTO_SWAP_LOCK_WAIT
+    try:
+        await asyncio.wait_for(lock.acquire(), AUTO_SWAP_LOCK_WAIT)
+    except asyncio.TimeoutError:
+        return False
+    try:
+        while True:
+            now = int(time.time())
+            if await acquire_lease(
+                lease_id, node_registry.node_id, now, now + AUTO_SWAP_LOCK_TIME
+            ):
+                return True
+            # another node swaps the wallet, its lease expires if it died
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 1))
+    except BaseException:
+        lock.release()
+        raise
+    lock.release()
+    return False
+
+
+async def renew_auto_swap_lease(lease_id: str) -> None:
+    """keep the lease of a running auto swap, it may take longer than the lease"""
+    while True:
+        await asyncio.sleep(AUTO_SWAP_LOCK_TIME / 3)
+        now = int(time.time())
+        try:
+            renewed = await acquire_lease(
+                lease_id, node_registry.node_id, now, now + AUTO_SWAP_LOCK_TIME
+            )
+        except Exception as exc:
+            logger.warning(f"Boltz - could not renew lease: {lease_id} - {exc!s}")
+            continue
+        if not renewed:
+            logger.error(f"Boltz - lease: {lease_id} expired during the auto swap.")
+            return
+
+
+def retry_auto_swap(wallet_id: str) -> None:
+    """run the auto swap of a wallet later, like a coalesced one"""
+    if wallet_id in coalesced_auto_swaps:
+        return
+    coalesced_auto_swaps[wallet_id] = task_supervisor.create_task(
+        f"auto_{wallet_id}",
+        "coalesce",
+        coalesce_auto_swap(wallet_id, AUTO_SWAP_RETRY_DELAY),
+    )
+
+
+async def execute_auto_swap(auto_swap: AutoReverseSubmarineSwap) -> None:
+    wallet = await get_wallet(auto_swap.wallet)
+    if not wallet:
+        return
+    reserve = fee_reserve_total(wallet.balance_msat) / 1000
+    available = wallet.balance_msat / 1000 - auto_swap.balance
+    amount = available - reserve
+    if amount < auto_swap.amount:
+        return
     try:
+        client = await create_boltz_client(auto_swap.asset)
+    except Exception as exc:
+        logger.error(f"Boltz API issues: {exc!s}")
+        return
+    fees = client.get_fee_estimation_claim()
+    if auto_swap.feerate_limit and fees > auto_swap.feerate_limit:
+        logger.warning(
+            "Boltz: auto reverse swap not created, fee limit exceeded: "
+            f"{auto_swap.feerate_limit}, actual fees: {fees}"
+        )
+        return
+
+    amounts = auto_swap_amounts(auto_swap, client, available, amount)
+    if not amounts:
+        logger.warning(
+            f"Boltz: auto reverse swap not created, amount: {amount} "
+            f"below the boltz minimal: {client.limits['minimal']}"
+        )
+        return
+
+    results = await asyncio.gather(
+        *(create_auto_swap(client, auto_swap, part) for part in amounts),
+        return_exceptions=True,
+    )
+    new_swaps = []
+    for result in results:
+        if isinstance(result, ReverseSubmarineSwap):
+            new_swaps.append(result)
+        else:
+            logger.error(f"Boltz: auto reverse swap failed: {result!s}")
+    if not new_swaps:
+        return
+    await update_auto_swap_count(auto_swap.id, auto_swap.count + len(new_swaps))
+    # keep the lock until the balance reflects the swaps, the next auto swap of
+    # the wallet would be sized from a balance still containing their amounts
+    await wait_for_auto_swap_payments(auto_swap.wallet, new_swaps)
+
+
+def auto_swap_amounts(
+    auto_swap: AutoReverseSubmarineSwap,
+    client: BoltzClient,
+    available: float,
+    amount: float,
+) -> list[int]:
+    """split a surplus into swaps within the boltz limits and the per swap cap"""
+    minimal, maximal = client.limits["minimal"], client.limits["maximal"]
+    if auto_swap.max_swap_amount:
+        maximal = min(maximal, auto_swap.max_swap_amount)
+    amounts = split_amount(int(amount), minimal, maximal)[:AUTO_SWAP_MAX_SWAPS]
+    # every payment of a split surplus needs its own fee reserve, resizing the
+    # swaps changes their reserves, the budget shrinks until they fit
+    while amounts:
+        reserves = sum(fee_reserve_total(part * 1000) for part in amounts) / 1000
+        if sum(amounts) + reserves <= available:
+            break
+        budget = min(int(available - reserves), sum(amounts) - 1)
+        amounts = split_amount(budget, minimal, maximal)[:AUTO_SWAP_MAX_SWAPS]
+    return amounts
+
+
+async def wait_for_auto_swap_payments(
+    wallet_id: str, swaps: list[ReverseSubmarineSwap]
+) -> None:
+    payment_hashes = {
+        hashlib.sha256(bytes.fromhex(swap.preimage)).hexdigest() for swap in swaps
+    }
+    deadline = time.time() + AUTO_SWAP_SETTLE_TIMEOUT
+    while time.time() < deadline:
+        for payment_hash in list(payment_hashes):
+            if await get_standalone_payment(payment_hash, wallet_id=wallet_id):
+                payment_hashes.discard(payment_hash)
+        if not payment_hashes:
+            return
+        await asyncio.sleep(0.2)
+    logger.warning(
+        f"Boltz - auto swap payments not recorded yet: {', '.join(payment_hashes)}"
+    )
+
+
+async def create_auto_swap(
+    client: BoltzClient, auto_swap: AutoReverseSubmarineSwap, amount: int
+) -> ReverseSubmarineSwap:
+    claim_privkey_wif, preimage_hex, swap = await client.create_reverse_swap(
+        amount=amount
+    )
+    new_swap = await create_reverse_submarine_swap(
+        CreateReverseSubmarineSwap(
+            wallet=auto_swap.wallet,
+            amount=amount,
+            instant_settlement=auto_swap.instant_settlement,
+            onchain_address=auto_swap.onchain_address,
+            feerate=False,
+        ),
+        claim_privkey_wif,
+        preimage_hex,
+        swap,
+    )
+    await execute_reverse_swap(new_swap)
+    logger.info(
+        "Boltz: auto reverse swap created with amount: "
+        f"{amount}, boltz_id: {new_swap.boltz_id}"
+    )
+    return new_swap
+
+
+# stages of a check which broadcast a transaction, see `SwapWatcher.check`
+BROADCAST_STAGES = ("claim", "refund")
+
+
+async def check_for_pending_swaps(
+    concurrency: int | None = None, deadline: float | None = None
+) -> dict[str, int]:
+    """
+    recover pending swaps after a restart. swaps with a persisted job are handed
+    back to the swap watcher as they were, without asking boltz. all other swaps
+    are checked once, at most `concurrency` at a time and each for at most
+    `deadline` seconds, both default to the boltz settings. swaps which are not
+    finished by then are left to the swap watcher. with several lnbits nodes,
+    every node only recovers its shard.
+    """
+    try:
+        if concurrency is None or deadline is None:
+            settings = await get_or_create_boltz_settings()
+            concurrency = concurrency or settings.boltz_recovery_concurrency
+            deadline = deadline or settings.boltz_recovery_deadline
+        await node_registry.heartbeat()
         swaps = await get_all_pending_submarine_swaps()
         reverse_swaps = await get_all_pending_reverse_submarine_swaps()
-        if len(swaps) > 0 or len(reverse_swaps) > 0:
-            logger.debug("Boltz - startup swap check")
+        jobs = {job.id: job for job in await get_all_jobs()}
     except Exception:
         logger.error(
             "Boltz - startup swap check, database is not created yet, do nothing"
         )
-        return
+        return {}
 
-    if len(swaps) > 0:
-        logger.debug(f"Boltz - {len(swaps)} pending swaps")
-        for swap in swaps:
-            await check_swap(swap)
+    summary: Counter[str] = Counter()
+    all_swaps: list[SubmarineSwap | ReverseSubmarineSwap] = [*swaps, *reverse_swaps]
+    pending: list[SubmarineSwap | ReverseSubmarineSwap] = []
+    for swap in all_swaps:
+        job = jobs.pop(swap.id, None)
+        if not node_registry.is_mine(swap.id):
+            continue
+        if job:
+            swap_watcher.resume(swap, job)
+            summary["resumed"] += 1
+        else:
+            pending.append(swap)
+    if jobs:
+        # jobs of swaps which are not pending anymore, removed by any node
+        await delete_jobs(list(jobs.keys()))
 
-    if len(reverse_swaps) > 0:
-        logger.debug(f"Boltz - {len(reverse_swaps)} pending reverse swaps")
-        for reverse_swap in reverse_swaps:
-            await check_reverse_swap(reverse_swap)
+    total = len(pending)
+    if total == 0:
+        return dict(summary)
+    logger.debug(
+        f"Boltz - startup swap check, {len(swaps)} pending swaps, "
+        f"{len(reverse_swaps)} pending reverse swaps, {summary['resumed']} resumed"
+    )
 
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    progress_step = max(total // 10, 1)
 
-async def check_swap(swap: SubmarineSwap):
-    try:
-        payment_status = await check_transaction_status(swap.wallet, swap.payment_hash)
-        if payment_status.paid:
-            logger.debug(f"Boltz - swap: {swap.boltz_id} got paid while offline.")
-            await update_swap_status(swap.id, "complete")
-        else:
-            client = await create_boltz_client(swap.asset)
-            try:
-                _ = client.swap_status(swap.id)
-            except Exception:
-                await client.refund_swap(
-                    privkey_wif=swap.refund_privkey,
-                    boltz_id=swap.boltz_id,
-                    lockup_address=swap.address,
-                    receive_address=swap.refund_address,
-                    redeem_script_hex=swap.redeem_script,
-                    timeout_block_height=swap.timeout_block_height,
-                    # feerate=swap.feerate_value if swap.feerate else None,
-                    blinding_key=swap.blinding_key,
-                )
-                await update_swap_status(swap.id, "refunded")
-    except BoltzNotFoundException:
-        logger.debug(f"Boltz - swap: {swap.boltz_id} does not exist.")
-        await update_swap_status(swap.id, "failed")
-    except Exception as exc:
-        logger.error(f"Boltz - unhandled exception, swap: {swap.id} - {exc!s}")
+    async def _recover(swap: SubmarineSwap | ReverseSubmarineSwap):
+        assert deadline is not None
+        async with semaphore:
+            outcome = await recover_swap(swap, deadline)
+        summary[outcome] += 1
+        done = sum(summary.values()) - summary["resumed"]
+        if done % progress_step == 0 or done == total:
+            logger.debug(f"Boltz - startup swap check, {done}/{total} checked")
+
+    await asyncio.gather(*[_recover(swap) for swap in pending])
 
+    logger.info(
+        "Boltz - startup swap check done, "
+        f"resumed: {summary['resumed']}, complete: {summary['complete']}, "
+        f"refunded: {summary['refunded']}, failed: {summary['failed']}, "
+        f"waiting: {summary['waiting']}"
+    )
+    return dict(summary)
 
-async def check_reverse_swap(reverse_swap: ReverseSubmarineSwap):
+
+async def check_with_deadline(watched: WatchedSwap, deadline: float) -> str | None:
+    """
+    check a swap for at most `deadline` seconds. a claim or refund which is
+    being broadcasted is not cut off, the check runs on until it is done and
+    its outcome is recorded.
+    """
+    task = task_supervisor.create_task(
+        watched.swap.id, "recover", swap_watcher.check(watched)
+    )
     try:
+        return await asyncio.wait_for(asyncio.shield(task), deadline)
+    except asyncio.TimeoutError:
+        if task_supervisor.get_stage(task) in BROADCAST_STAGES:
+            return await task
+        task.cancel()
+        raise
+
 
-        client = await create_boltz_client(reverse_swap.asset)
-        _ = client.swap_status(reverse_swap.boltz_id)
-        await client.claim_reverse_swap(
-            boltz_id=reverse_swap.boltz_id,
-            lockup_address=reverse_swap.lockup_address,
-            receive_address=reverse_swap.onchain_address,
-            privkey_wif=reverse_swap.claim_privkey,
-            preimage_hex=reverse_swap.preimage,
-            redeem_script_hex=reverse_swap.redeem_script,
-            zeroconf=reverse_swap.instant_settlement,
-            # feerate=reverse_swap.feerate_value if reverse_swap.feerate else None,
-            blinding_key=reverse_swap.blinding_key,
+async def recover_swap(
+    swap: SubmarineSwap | ReverseSubmarineSwap, deadline: float
+) -> str:
+    """
+    check a pending swap once, returns its new status or `waiting`. the swap is
+    checked under its job lease, like in the swap watcher, so no other node
+    claims or refunds it meanwhile.
+    """
+    watched = WatchedSwap(swap=swap)
+    outcome = None
+    now = int(time.time())
+    try:
+        leased = await lease_job(
+            watched.to_job(), node_registry.node_id, now, now + JOB_LEASE_TIME
         )
-        await update_swap_status(reverse_swap.id, "complete")
-
-    except BoltzSwapStatusException as exc:
-        logger.debug(f"Boltz - swap_status: {exc!s}")
-        await update_swap_status(reverse_swap.id, "failed")
-    # should only happen while development when regtest is reset
-    except BoltzNotFoundException:
-        logger.debug(f"Boltz - reverse swap: {reverse_swap.boltz_id} does not exist.")
-        await update_swap_status(reverse_swap.id, "failed")
     except Exception as exc:
-        logger.error(
-            "Boltz - unhandled exception, reverse swap: "
-            f"{reverse_swap.boltz_id} - {exc!s}"
+        logger.warning(f"Boltz - could not lease swap: {swap.boltz_id} - {exc!s}")
+        swap_watcher.watch(swap, delay=next_check_interval(watched))
+        return "waiting"
+    if not leased:
+        logger.debug(f"Boltz - swap: {swap.boltz_id} is leased by another node.")
+        return "waiting"
+    try:
+        if isinstance(swap, SubmarineSwap):
+            payment_status = await check_transaction_status(
+                swap.wallet, swap.payment_hash
+            )
+            if payment_status.paid:
+                logger.debug(f"Boltz - swap: {swap.boltz_id} got paid while offline.")
+                outcome = "complete"
+        if not outcome:
+            outcome = await check_with_deadline(watched, deadline)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"Boltz - startup swap check, swap: {swap.boltz_id} "
+            f"not done after {deadline}s"
         )
+    except Exception as exc:
+        watched.attempts += 1
+        logger.error(f"Boltz - unhandled exception, swap: {swap.boltz_id} - {exc!s}")
+
+    if outcome and watched.batch:
+        # finished by the swap watcher once its batch transaction is sent
+        swap_watcher.defer(watched, outcome)
+        return "waiting"
+    if outcome:
+        await update_swap_status(
+            swap.id,
+            outcome,
+            reverse=isinstance(swap, ReverseSubmarineSwap),
+            boltz_status=watched.last_status,
+            txid=watched.txid,
+        )
+        return outcome
+
+    swap_watcher.watch(swap, delay=next_check_interval(watched))
+    return "waiting"
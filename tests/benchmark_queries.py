@@ -0,0 +1,169 @@
+"""
+Benchmark of the hot swap queries, before and after the `m009_add_swap_indexes`
+migration. Runs against the lnbits database configured in the environment:
+SQLite in `LNBITS_DATA_FOLDER` or Postgres via `LNBITS_DATABASE_URL`. Use an
+empty scratch database, the boltz tables are created by the benchmark, e.g.
+
+    LNBITS_DATA_FOLDER=/tmp/boltz-bench \\
+        uv run python -m boltz.tests.benchmark_queries --rows 100000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from .. import migrations
+from ..crud import (
+    db,
+    get_all_pending_reverse_submarine_swaps,
+    get_all_pending_submarine_swaps,
+    get_auto_reverse_submarine_swap_by_wallet,
+    get_reverse_submarine_swaps,
+    get_submarine_swaps,
+)
+
+INDEX_MIGRATION = "m009_add_swap_indexes"
+
+
+async def create_tables() -> None:
+    try:
+        await db.fetchone("SELECT id FROM boltz.submarineswap LIMIT 1")
+    except Exception:
+        pass
+    else:
+        raise SystemExit("boltz tables exist, use an empty database.")
+    for name in sorted(dir(migrations)):
+        if name.startswith("m") and name[1:4].isdigit() and name < INDEX_MIGRATION:
+            await getattr(migrations, name)(db)
+
+
+async def insert_rows(rows: int, wallets: int, pending: float) -> None:
+    now = int(time.time())
+
+    def _swap(i: int) -> dict:
+        return {
+            "id": f"swap_{i}",
+            "wallet": f"wallet_{i % wallets}",
+            "payment_hash": f"hash_{i}",
+            "amount": 100_000,
+            "status": "pending" if random.random() < pending else "complete",
+            "boltz_id": f"boltz_{i}",
+            "time": now - i,
+        }
+
+    swap_query = f"""
+        INSERT INTO boltz.submarineswap (
+            id, wallet, payment_hash, amount, status, boltz_id, refund_address,
+            refund_privkey, expected_amount, timeout_block_height, address, bip21,
+            redeem_script, time
+        ) VALUES (
+            :id, :wallet, :payment_hash, :amount, :status, :boltz_id, 'address',
+            'privkey', :amount, 800000, 'address', 'bip21', 'script',
+            {db.timestamp_placeholder("time")}
+        )
+    """
+    reverse_query = f"""
+        INSERT INTO boltz.reverse_submarineswap (
+            id, wallet, onchain_address, amount, instant_settlement, status,
+            boltz_id, timeout_block_height, redeem_script, preimage, claim_privkey,
+            lockup_address, invoice, onchain_amount, time
+        ) VALUES (
+            :id, :wallet, 'address', :amount, false, :status, :boltz_id, 800000,
+            'script', 'preimage', 'privkey', 'address', 'invoice', :amount,
+            {db.timestamp_placeholder("time")}
+        )
+    """
+    auto_query = f"""
+        INSERT INTO boltz.auto_reverse_submarineswap (
+            id, wallet, onchain_address, amount, balance, instant_settlement, time
+        ) VALUES (
+            :id, :wallet, 'address', 100000, 0, false,
+            {db.timestamp_placeholder("time")}
+        )
+    """
+    batch = 5_000
+    async with db.connect() as conn:
+        for start in range(0, rows, batch):
+            values = [_swap(i) for i in range(start, min(start + batch, rows))]
+            await conn.conn.execute(text(conn.rewrite_query(swap_query)), values)
+            await conn.conn.execute(text(conn.rewrite_query(reverse_query)), values)
+        autos = [
+            {"id": f"auto_{i}", "wallet": f"wallet_{i}", "time": now}
+            for i in range(0, wallets, 10)
+        ]
+        await conn.conn.execute(text(conn.rewrite_query(auto_query)), autos)
+        await conn.conn.commit()
+
+
+async def measure(runs: int, wallets: int) -> dict[str, float]:
+    """median milliseconds per query"""
+
+    async def boltz_id_lookup():
+        await db.fetchone(
+            "SELECT * FROM boltz.reverse_submarineswap WHERE boltz_id = :boltz_id",
+            {"boltz_id": f"boltz_{random.randrange(wallets)}"},
+        )
+
+    async def payment_hash_lookup():
+        await db.fetchone(
+            "SELECT * FROM boltz.submarineswap WHERE payment_hash = :payment_hash",
+            {"payment_hash": f"hash_{random.randrange(wallets)}"},
+        )
+
+    queries = {
+        "swaps by wallet": lambda: get_submarine_swaps(
+            f"wallet_{random.randrange(wallets)}"
+        ),
+        "reverse swaps by wallet": lambda: get_reverse_submarine_swaps(
+            f"wallet_{random.randrange(wallets)}"
+        ),
+        "auto swap by wallet": lambda: get_auto_reverse_submarine_swap_by_wallet(
+            f"wallet_{random.randrange(wallets)}"
+        ),
+        "pending swaps": get_all_pending_submarine_swaps,
+        "pending reverse swaps": get_all_pending_reverse_submarine_swaps,
+        "reverse swap by boltz_id": boltz_id_lookup,
+        "swap by payment_hash": payment_hash_lookup,
+    }
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            await query()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+async def main(rows: int, wallets: int, pending: float, runs: int) -> None:
+    await create_tables()
+    start = time.perf_counter()
+    await insert_rows(rows, wallets, pending)
+    print(
+        f"{db.type}: inserted {rows} swaps and {rows} reverse swaps "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    before = await measure(runs, wallets)
+    await getattr(migrations, INDEX_MIGRATION)(db)
+    after = await measure(runs, wallets)
+
+    print(f"{'query':<28}{'before ms':>12}{'after ms':>12}")
+    for name, value in before.items():
+        print(f"{name:<28}{value:>12.2f}{after[name]:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split(".")[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--wallets", type=int, default=1_000)
+    parser.add_argument(
+        "--pending", type=float, default=0.001, help="share of pending swaps"
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.wallets, args.pending, args.runs))
@@ -1,10 +1,22 @@
+import re
+
 import pytest_asyncio
+from lnbits.core.models import Payment
+from lnbits.db import Database
+from lnbits.settings import settings
 
-from ..models import CreateReverseSubmarineSwap
+from .. import crud, migrations, watcher
+from ..boltz_client.boltz import BoltzSwapStatusResponse, BoltzSwapTransactionResponse
+from ..models import (
+    BoltzSettings,
+    CreateReverseSubmarineSwap,
+    ReverseSubmarineSwap,
+    SubmarineSwap,
+)
 
 
-@pytest_asyncio.fixture(scope="session")
-async def reverse_swap(from_wallet):
+@pytest_asyncio.fixture(scope="session", name="reverse_swap")
+async def reverse_swap_data(from_wallet):
     data = CreateReverseSubmarineSwap(
         wallet=from_wallet.id,
         instant_settlement=True,
@@ -12,3 +24,112 @@ async def reverse_swap(from_wallet):
         amount=20_000,
     )
     return data
+
+
+@pytest_asyncio.fixture
+async def database(monkeypatch, tmp_path):
+    """the crud functions on a fresh, migrated sqlite database"""
+    monkeypatch.setattr(settings, "lnbits_data_folder", str(tmp_path))
+    test_db = Database("ext_boltz")
+    for name in sorted(dir(migrations)):
+        if re.match(r"m\d{3}_", name):
+            await getattr(migrations, name)(test_db)
+    monkeypatch.setattr(crud, "db", test_db)
+    yield test_db
+    await test_db.engine.dispose()
+
+
+# swaps, a fake boltz client and invoices shared by the unit tests
+
+reverse_swap = ReverseSubmarineSwap(
+    id="reverse",
+    wallet="wallet",
+    asset="BTC/BTC",
+    amount=100_000,
+    direction="send",
+    feerate=False,
+    onchain_address="bcrt1q4vfyszl4p8cuvqh07fyhtxve5fxq8e2ux5gx43",
+    instant_settlement=False,
+    status="pending",
+    boltz_id="boltz_reverse",
+    preimage="00",
+    claim_privkey="privkey",
+    lockup_address="bcrt1q3cwq33y435h52gq3qqsdtczh38ltlnf69zvypm",
+    invoice="lnbcrt1",
+    onchain_amount=99_000,
+    timeout_block_height=200,
+    redeem_script="00",
+)
+
+swap = SubmarineSwap(
+    id="swap",
+    wallet="wallet",
+    asset="BTC/BTC",
+    amount=100_000,
+    direction="receive",
+    feerate=False,
+    payment_hash="hash",
+    status="pending",
+    refund_privkey="privkey",
+    refund_address="bcrt1q4vfyszl4p8cuvqh07fyhtxve5fxq8e2ux5gx43",
+    boltz_id="boltz_swap",
+    expected_amount=101_000,
+    timeout_block_height=200,
+    address="bcrt1q3cwq33y435h52gq3qqsdtczh38ltlnf69zvypm",
+    bip21="bitcoin:",
+    redeem_script="00",
+)
+
+
+class FakeClient:
+    pair = "BTC/BTC"
+
+    def __init__(self, status: str, tx_hex: str | None = None, height: int = 100):
+        self.status = BoltzSwapStatusResponse(
+            status=status, transaction={"hex": tx_hex} if tx_hex else None
+        )
+        self.height = height
+        self.claimed: list[str] = []
+        self.refunded: list[str] = []
+        self.broadcasts: dict[str, str] = {}
+
+    async def swap_status(self, boltz_id):
+        return self.status
+
+    async def get_block_height(self):
+        return self.height
+
+    async def swap_transaction(self, boltz_id):
+        return BoltzSwapTransactionResponse(transactionHex="lockup")
+
+    async def claim_reverse_swap(self, **kwargs):
+        self.claimed.append(kwargs["lockup_rawtx"])
+        return "claim_txid"
+
+    async def refund_swap(self, **kwargs):
+        self.refunded.append(kwargs["lockup_rawtx"])
+        return "refund_txid"
+
+
+def use_client(monkeypatch, client: FakeClient, settings: BoltzSettings | None = None):
+    async def create_boltz_client(pair):
+        return client
+
+    async def get_or_create_boltz_settings():
+        return settings or BoltzSettings()
+
+    monkeypatch.setattr(watcher, "create_boltz_client", create_boltz_client)
+    monkeypatch.setattr(
+        watcher, "get_or_create_boltz_settings", get_or_create_boltz_settings
+    )
+
+
+def paid_invoice(wallet_id: str, payment_hash: str | None = None) -> Payment:
+    return Payment(
+        checking_id=payment_hash or wallet_id,
+        payment_hash=payment_hash or wallet_id,
+        wallet_id=wallet_id,
+        amount=1000,
+        fee=0,
+        bolt11="lnbcrt1",
+    )
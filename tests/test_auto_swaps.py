@@ -0,0 +1,44 @@
+import pytest
+
+from .. import auto_swaps, tasks
+from ..auto_swaps import AutoSwapIndex
+from .conftest import paid_invoice
+
+
+@pytest.mark.asyncio
+async def test_auto_swap_index_skips_other_wallets(monkeypatch):
+    index = AutoSwapIndex()
+    assert "wallet" in index
+
+    async def get_wallet_ids():
+        # an auto swap created and one deleted while the index is loading
+        index.add("created")
+        index.discard("deleted")
+        return ["wallet", "deleted"]
+
+    monkeypatch.setattr(
+        auto_swaps, "get_auto_reverse_submarine_swap_wallet_ids", get_wallet_ids
+    )
+    await index.load()
+    assert index.wallet_ids == {"wallet", "created"}
+    assert "other" not in index
+
+    leases: list[str] = []
+    auto_swapped: list[str] = []
+
+    async def acquire_lease(lease_id, owner, now, until):
+        leases.append(lease_id)
+        return True
+
+    async def check_for_auto_swap(payment):
+        auto_swapped.append(payment.wallet_id)
+
+    monkeypatch.setattr(tasks, "auto_swap_index", index)
+    monkeypatch.setattr(tasks, "acquire_lease", acquire_lease)
+    monkeypatch.setattr(tasks, "check_for_auto_swap", check_for_auto_swap)
+
+    await tasks.on_invoice_paid(paid_invoice("other"))
+    assert leases == []
+    await tasks.on_invoice_paid(paid_invoice("wallet"))
+    assert leases == ["payment:wallet"]
+    assert auto_swapped == ["wallet"]
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from .. import batches, watcher
+from ..batches import ClaimBatcher, RefundBatcher, TransactionBatcher, claim_batcher
+from ..models import BoltzSettings
+from ..watcher import SwapWatcher, WatchedSwap
+from .conftest import FakeClient, reverse_swap, swap, use_client
+
+
+@pytest.mark.asyncio
+async def test_claim_batcher_claims_one_transaction(monkeypatch):
+    batches: list[list[str]] = []
+
+    class BatchClient(FakeClient):
+        fail_batch = False
+
+        async def claim_reverse_swaps(self, claims, receive_address, feerate=None):
+            if self.fail_batch:
+                raise ValueError("lockup already spent")
+            batches.append([claim.lockup_rawtx for claim in claims])
+            return "batch_txid"
+
+    client = BatchClient("transaction.confirmed", "lockup")
+    settings = BoltzSettings(boltz_claim_batch_wait=1)
+    use_client(monkeypatch, client, settings)
+    swap_watcher = SwapWatcher()
+    other = reverse_swap.copy(update={"id": "other", "boltz_id": "boltz_other"})
+
+    # a full batch is claimed without waiting
+    monkeypatch.setattr(claim_batcher, "max_size", 2)
+    watched = [WatchedSwap(swap=reverse_swap), WatchedSwap(swap=other)]
+    outcomes = [await swap_watcher.check(item) for item in watched]
+    assert outcomes == ["complete", "complete"]
+    txids = await asyncio.gather(*(item.batch for item in watched if item.batch))
+    assert txids == ["batch_txid", "batch_txid"]
+    assert batches == [["lockup", "lockup"]]
+    assert client.claimed == []
+
+    # a failed batch falls back to single claims
+    client.fail_batch = True
+    batcher = ClaimBatcher()
+    txids = await asyncio.gather(
+        batcher.claim(client, reverse_swap, "lockup_1", wait=0.01),
+        batcher.claim(client, other, "lockup_2", wait=0.01),
+    )
+    assert txids == ["claim_txid", "claim_txid"]
+    assert client.claimed == ["lockup_1", "lockup_2"]
+
+
+@pytest.mark.asyncio
+async def test_batched_claim_does_not_hold_a_check_slot(monkeypatch):
+    class BatchClient(FakeClient):
+        async def claim_reverse_swaps(self, claims, receive_address, feerate=None):
+            return "batch_txid"
+
+    client = BatchClient("transaction.confirmed", "lockup")
+    use_client(monkeypatch, client, BoltzSettings(boltz_claim_batch_wait=3600))
+    updates: list[tuple] = []
+
+    async def lease_job(job, owner, now, until):
+        return True
+
+    async def update_swap_status(swap_id, status, reverse, boltz_status, txid):
+        updates.append((swap_id, status, txid))
+
+    monkeypatch.setattr(watcher, "lease_job", lease_job)
+    monkeypatch.setattr(watcher, "update_swap_status", update_swap_status)
+    monkeypatch.setattr(batches, "BATCH_MAX_WAIT", 0.05)
+    swap_watcher = SwapWatcher(max_concurrent_checks=1)
+    other = reverse_swap.copy(update={"id": "other", "boltz_id": "boltz_other"})
+
+    # both checks end right away, the batch waits at most BATCH_MAX_WAIT
+    for item in (reverse_swap, other):
+        await asyncio.wait_for(swap_watcher._dispatch(swap_watcher.watch(item)), 1)
+    assert not swap_watcher._semaphore.locked()
+    assert updates == []
+    batch = swap_watcher.swaps["reverse"].batch
+    assert batch
+    # no second claim while the batch is waiting
+    heap = list(swap_watcher._heap)
+    swap_watcher.schedule("reverse")
+    assert swap_watcher._heap == heap
+
+    await batch
+    await asyncio.sleep(0.01)
+    assert sorted(updates) == [
+        ("other", "complete", "batch_txid"),
+        ("reverse", "complete", "batch_txid"),
+    ]
+    assert swap_watcher.swaps == {}
+
+
+@pytest.mark.asyncio
+async def test_refund_batcher_marks_batch_refunded(monkeypatch):
+    refunded: list[tuple[list[str], str | None]] = []
+
+    class BatchClient(FakeClient):
+        fail_batch = False
+
+        async def refund_swaps(self, refunds, feerate=None):
+            if self.fail_batch:
+                raise ValueError("lockup already spent")
+            return "batch_txid"
+
+    async def update_swap_statuses(swap_ids, status, reverse, txid=None):
+        assert status == "refunded" and not reverse
+        refunded.append((swap_ids, txid))
+        return []
+
+    monkeypatch.setattr(batches, "update_swap_statuses", update_swap_statuses)
+    client = BatchClient("swap.expired", height=300)
+    use_client(monkeypatch, client, BoltzSettings(boltz_refund_batch_wait=1))
+    swap_watcher = SwapWatcher()
+    other = swap.copy(update={"id": "other", "boltz_id": "boltz_other"})
+
+    monkeypatch.setattr(batches.refund_batcher, "max_size", 2)
+    watched = [WatchedSwap(swap=swap), WatchedSwap(swap=other)]
+    outcomes = [await swap_watcher.check(item) for item in watched]
+    assert outcomes == ["refunded", "refunded"]
+    txids = await asyncio.gather(*(item.batch for item in watched if item.batch))
+    assert txids == ["batch_txid", "batch_txid"]
+    assert refunded == [(["swap", "other"], "batch_txid")]
+    assert client.refunded == []
+
+    # a failed batch falls back to single refunds, marked by the watcher
+    client.fail_batch = True
+    batcher = RefundBatcher()
+    txids = await asyncio.gather(
+        batcher.refund(client, swap, "lockup_1", wait=0.01),
+        batcher.refund(client, other, "lockup_2", wait=0.01),
+    )
+    assert txids == ["refund_txid", "refund_txid"]
+    assert client.refunded == ["lockup_1", "lockup_2"]
+    assert len(refunded) == 1
+
+
+def test_transaction_batcher_is_abstract():
+    with pytest.raises(TypeError):
+        TransactionBatcher(max_size=2)  # type: ignore[abstract]
@@ -0,0 +1,320 @@
+import asyncio
+import time
+from math import ceil
+
+import pytest
+from embit import ec, script
+from embit.networks import NETWORKS
+from embit.transaction import Transaction, TransactionInput, TransactionOutput
+
+from ..boltz_client.boltz import (
+    BoltzApiException,
+    BoltzClient,
+    BoltzConfig,
+    BoltzSwapStatusResponse,
+)
+from ..boltz_client.helpers import close_http_clients, get_http_client
+from ..boltz_client.onchain import (
+    RBF_SEQUENCE,
+    ClaimInput,
+    RefundInput,
+    create_batch_claim_tx,
+    create_batch_refund_tx,
+    tx_vsize,
+)
+from ..boltz_client.websocket import BoltzSwapStatusStream
+from ..models import BoltzSettings
+from ..utils import BoltzClientPool
+
+
+@pytest.mark.asyncio
+async def test_http_client_is_pooled_per_host():
+    client = get_http_client("https://boltz.exchange/api/getpairs")
+    assert get_http_client("https://boltz.exchange/api/swapstatus") is client
+    assert get_http_client("http://localhost:9001/getpairs") is not client
+
+    boltz = BoltzClient(BoltzConfig(pairs=["BTC/BTC"]))
+    assert boltz.http_client is client
+
+    await close_http_clients()
+    assert client.is_closed
+    assert get_http_client("https://boltz.exchange/api") is not client
+    await close_http_clients()
+
+
+PAIRS = {
+    "BTC/BTC": {
+        "hash": "btc-hash",
+        "fees": {"percentage": 0.5},
+        "limits": {"minimal": 10_000, "maximal": 1_000_000},
+    },
+    "L-BTC/BTC": {
+        "hash": "lbtc-hash",
+        "fees": {"percentage": 0.1},
+        "limits": {"minimal": 1_000, "maximal": 1_000_000},
+    },
+}
+
+
+@pytest.mark.asyncio
+async def test_client_pool_caches_pairs(monkeypatch):
+    calls = []
+
+    async def get_pairs(self):
+        calls.append(self.pair)
+        return PAIRS
+
+    monkeypatch.setattr(BoltzClient, "get_pairs", get_pairs)
+    pool = BoltzClientPool()
+    settings = BoltzSettings()
+
+    client = await pool.get("BTC/BTC", settings)
+    assert client.pair_hash == "btc-hash"
+    assert await pool.get("BTC/BTC", settings) is client
+    assert len(calls) == 1
+
+    liquid = await pool.get("L-BTC/BTC", settings)
+    assert liquid.pair_hash == "lbtc-hash"
+    assert len(calls) == 2
+
+    # stale pairs are served while they are refreshed in the background
+    client.pairs_updated_at -= settings.boltz_pairs_ttl + 1
+    assert await pool.get("BTC/BTC", settings) is client
+    assert pool._refresh_task
+    await pool._refresh_task
+    assert len(calls) == 3
+    assert time.time() - client.pairs_updated_at < settings.boltz_pairs_ttl
+    pool.clear()
+
+
+@pytest.mark.asyncio
+async def test_client_pool_rebuilds_on_settings_change(monkeypatch):
+    async def get_pairs(self):
+        return PAIRS
+
+    monkeypatch.setattr(BoltzClient, "get_pairs", get_pairs)
+    pool = BoltzClientPool()
+    client = await pool.get("BTC/BTC", BoltzSettings())
+    assert await pool.get("BTC/BTC", BoltzSettings(boltz_pairs_ttl=10)) is client
+
+    regtest = BoltzSettings(boltz_network="regtest", boltz_url="http://localhost")
+    rebuilt = await pool.get("BTC/BTC", regtest)
+    assert rebuilt is not client
+    assert rebuilt.network == "regtest"
+    pool.clear()
+
+
+def _swap_update(boltz_id: str, status: str, tx_hex: str | None = None) -> dict:
+    update: dict = {"id": boltz_id, "status": status}
+    if tx_hex:
+        update["transaction"] = {"id": "txid", "hex": tx_hex}
+    return {"event": "update", "channel": "swap.update", "args": [update]}
+
+
+@pytest.mark.asyncio
+async def test_status_stream_dispatches_updates():
+    stream = BoltzSwapStatusStream("ws://127.0.0.1:1", reconnect_interval=60)
+    async with await stream.updates("swap1") as updates:
+        await stream.subscribe(["swap2"])
+        assert stream.boltz_ids == ["swap1", "swap2"]
+        stream.handle_message(_swap_update("swap2", "swap.created"))
+        stream.handle_message(_swap_update("swap1", "transaction.mempool", "00"))
+        status = await updates.next(timeout=1)
+        assert status.status == "transaction.mempool"
+        assert status.transaction == {"id": "txid", "hex": "00"}
+        assert updates.queue.empty()
+    assert stream.boltz_ids == ["swap2"]
+    await stream.unsubscribe(["swap2"])
+    assert stream.boltz_ids == []
+    stream.stop()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_tx_on_status_uses_stream(monkeypatch):
+    config = BoltzConfig(pairs=["BTC/BTC"], poll_interval=60, ws_poll_interval=60)
+    client = BoltzClient(config)
+    client.status_stream = BoltzSwapStatusStream("ws://127.0.0.1:1", 60)
+    polls = []
+
+    async def swap_status(boltz_id):
+        polls.append(boltz_id)
+        return BoltzSwapStatusResponse(status="swap.created")
+
+    monkeypatch.setattr(client, "swap_status", swap_status)
+    task = asyncio.create_task(client.wait_for_tx_on_status("swap1", zeroconf=False))
+    await asyncio.sleep(0.01)
+    client.status_stream.handle_message(_swap_update("swap1", "transaction.mempool"))
+    client.status_stream.handle_message(
+        _swap_update("swap1", "transaction.confirmed", "00")
+    )
+    assert await asyncio.wait_for(task, 1) == "00"
+    assert polls == ["swap1"]
+    assert client.status_stream.boltz_ids == []
+    client.status_stream.stop()
+
+
+def lockup_tx(redeem_script: script.Script, value: int, nested: bool = False) -> str:
+    lockup_script = script.p2wsh(redeem_script)
+    if nested:
+        lockup_script = script.p2sh(lockup_script)
+    tx = Transaction(
+        vin=[TransactionInput(bytes(32), 0)],
+        vout=[
+            TransactionOutput(1_000, script.p2wpkh(ec.PrivateKey(bytes([1] * 32)))),
+            TransactionOutput(value, lockup_script),
+        ],
+    )
+    return tx.serialize().hex()
+
+
+def test_batch_claim_tx_signs_every_input():
+    net = NETWORKS["regtest"]
+    receive_address = script.p2wpkh(ec.PrivateKey(bytes([2] * 32))).address(net)
+    claims = []
+    for i in range(3):
+        privkey = ec.PrivateKey(bytes([i + 3] * 32))
+        redeem_script = script.Script(data=bytes([0x21]) + privkey.sec() + b"\xac")
+        claims.append(
+            ClaimInput(
+                lockup_address=script.p2wsh(redeem_script).address(net),
+                lockup_rawtx=lockup_tx(redeem_script, 100_000 * (i + 1)),
+                privkey_wif=privkey.wif(net),
+                preimage_hex=f"{i:064x}",
+                redeem_script_hex=redeem_script.data.hex(),
+            )
+        )
+
+    tx = Transaction.from_string(create_batch_claim_tx(claims, receive_address, 500))
+    assert len(tx.vin) == 3
+    assert [vin.vout for vin in tx.vin] == [1, 1, 1]
+    assert len(tx.vout) == 1
+    assert tx.vout[0].value == 600_000 - 500
+    assert tx.vout[0].script_pubkey.address(net) == receive_address
+    for index, claim in enumerate(claims):
+        sig, preimage, redeem_script_data = tx.vin[index].witness.items
+        assert preimage.hex() == claim.preimage_hex
+        sighash = tx.sighash_segwit(
+            index, script.Script(data=redeem_script_data), 100_000 * (index + 1)
+        )
+        pubkey = ec.PrivateKey.from_wif(claim.privkey_wif).get_public_key()
+        assert pubkey.verify(ec.Signature.parse(sig[:-1]), sighash)
+
+    with pytest.raises(ValueError):
+        create_batch_claim_tx([], receive_address, 500)
+
+
+def test_batch_claim_fee_estimation():
+    client = BoltzClient(BoltzConfig(pairs=["BTC/BTC"]))
+    client.fees = {"minerFees": {"baseAsset": {"reverse": {"claim": 270}}}}
+    assert client.get_fee_estimation_batch_claim(1) == 270
+    # the transaction overhead is paid once
+    assert client.get_fee_estimation_batch_claim(10) < 10 * 270
+
+
+def test_batch_refund_tx_sets_max_locktime():
+    net = NETWORKS["regtest"]
+    addresses = [
+        script.p2wpkh(ec.PrivateKey(bytes([i] * 32))).address(net) for i in (1, 2)
+    ]
+    refunds = []
+    for i in range(3):
+        privkey = ec.PrivateKey(bytes([i + 3] * 32))
+        redeem_script = script.Script(data=bytes([0x21]) + privkey.sec() + b"\xac")
+        refunds.append(
+            RefundInput(
+                lockup_address=script.p2sh(script.p2wsh(redeem_script)).address(net),
+                lockup_rawtx=lockup_tx(redeem_script, 100_000, nested=True),
+                privkey_wif=privkey.wif(net),
+                redeem_script_hex=redeem_script.data.hex(),
+                timeout_block_height=200 + i,
+                receive_address=addresses[i % 2],
+            )
+        )
+
+    tx = Transaction.from_string(create_batch_refund_tx(refunds, 900))
+    assert tx.locktime == 202
+    assert len(tx.vin) == 3
+    # one output per refund address, the fees shared by input count
+    assert [vout.value for vout in tx.vout] == [200_000 - 600, 100_000 - 300]
+    assert [vout.script_pubkey.address(net) for vout in tx.vout] == addresses
+    for index, refund in enumerate(refunds):
+        vin = tx.vin[index]
+        assert vin.sequence == RBF_SEQUENCE
+        assert vin.script_sig.data[:3] == bytes([34, 0, 32])
+        sig, preimage, redeem_script_data = vin.witness.items
+        assert preimage == b""
+        sighash = tx.sighash_segwit(
+            index, script.Script(data=redeem_script_data), 100_000
+        )
+        pubkey = ec.PrivateKey.from_wif(refund.privkey_wif).get_public_key()
+        assert pubkey.verify(ec.Signature.parse(sig[:-1]), sighash)
+
+    with pytest.raises(ValueError):
+        create_batch_refund_tx(refunds, 300_000)
+
+
+def test_batch_refund_fee_estimation():
+    client = BoltzClient(BoltzConfig(pairs=["BTC/BTC"]))
+    client.fees = {"minerFees": {"baseAsset": {"normal": 340}}}
+    assert client.get_fee_estimation_batch_refund(1) == 340
+    assert client.get_fee_estimation_batch_refund(10) < 10 * 340
+    assert client.get_fee_estimation_batch_refund(
+        10, 2
+    ) > client.get_fee_estimation_batch_refund(10)
+
+
+def test_feerate_fee_covers_signed_vsize():
+    net = NETWORKS["regtest"]
+    receive_address = script.p2wpkh(ec.PrivateKey(bytes([2] * 32))).address(net)
+    privkey = ec.PrivateKey(bytes([3] * 32))
+    redeem_script = script.Script(data=bytes([0x21]) + privkey.sec() + b"\xac")
+    claim = ClaimInput(
+        lockup_address=script.p2wsh(redeem_script).address(net),
+        lockup_rawtx=lockup_tx(redeem_script, 100_000),
+        privkey_wif=privkey.wif(net),
+        preimage_hex="00" * 32,
+        redeem_script_hex=redeem_script.data.hex(),
+    )
+    for feerate in (1, 2.5, 50):
+        tx = Transaction.from_string(
+            create_batch_claim_tx([claim], receive_address, 500, feerate=feerate)
+        )
+        fee = 100_000 - tx.vout[0].value
+        assert fee == ceil(tx_vsize(tx) * feerate)
+    # without a feerate the static fee is paid
+    tx = Transaction.from_string(create_batch_claim_tx([claim], receive_address, 500))
+    assert tx.vout[0].value == 100_000 - 500
+    with pytest.raises(ValueError):
+        create_batch_claim_tx([claim], receive_address, 500, feerate=0)
+
+    # witness bytes count a quarter
+    size = len(tx.serialize())
+    witness = 2 + len(tx.vin[0].witness.serialize())
+    assert tx_vsize(tx) == ceil((size - witness) + witness / 4)
+    assert tx_vsize(Transaction.from_string(claim.lockup_rawtx)) == len(
+        bytes.fromhex(claim.lockup_rawtx)
+    )
+
+
+@pytest.mark.asyncio
+async def test_resolve_feerate(monkeypatch):
+    client = BoltzClient(BoltzConfig(pairs=["BTC/BTC"]))
+    requests = []
+
+    async def request(funcname, url, **kwargs):
+        requests.append(url)
+        return {"BTC": 4.2, "L-BTC": 0.1}
+
+    monkeypatch.setattr(client, "request", request)
+    assert await client.resolve_feerate(12) == 12
+    assert await client.resolve_feerate() == 4.2
+    assert await client.resolve_feerate() == 4.2
+    assert len(requests) == 1
+    assert requests[0].endswith("/v2/chain/fees")
+
+    async def unreachable(funcname, url, **kwargs):
+        raise BoltzApiException("unreachable")
+
+    client._feerate = None
+    monkeypatch.setattr(client, "request", unreachable)
+    assert await client.resolve_feerate() is None
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from lnbits.core.models import Payment
+
+from ..consumers import InvoiceConsumerPool
+from .conftest import paid_invoice
+
+
+@pytest.mark.asyncio
+async def test_invoice_consumers_keep_wallet_order():
+    slow = asyncio.Event()
+    handled: list[str] = []
+
+    async def handler(payment: Payment):
+        if payment.payment_hash == "slow_1":
+            await slow.wait()
+        if payment.payment_hash == "broken":
+            raise RuntimeError("boom")
+        handled.append(payment.payment_hash)
+
+    pool = InvoiceConsumerPool(handler, workers=4, queue_size=10)
+    fast_wallet = next(
+        f"wallet_{i}"
+        for i in range(100)
+        if pool.worker(f"wallet_{i}") != pool.worker("slow")
+    )
+    source: asyncio.Queue[Payment] = asyncio.Queue()
+    for payment in (
+        paid_invoice("slow", "slow_1"),
+        paid_invoice("slow", "slow_2"),
+        paid_invoice(fast_wallet, "fast"),
+        paid_invoice(fast_wallet, "broken"),
+    ):
+        source.put_nowait(payment)
+    task = asyncio.create_task(pool.run(source))
+    await asyncio.sleep(0.01)
+
+    # a slow invoice only holds back the invoices of its own wallet
+    assert handled == ["fast"]
+    stats = pool.stats()
+    assert stats.busy == 1
+    assert stats.failed == 1
+    assert stats.queued[pool.worker("slow")] == 1
+
+    slow.set()
+    await asyncio.sleep(0.01)
+    assert handled == ["fast", "slow_1", "slow_2"]
+    assert pool.stats().processed == 3
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_invoice_consumers_only_queue_accepted_wallets():
+    slow = asyncio.Event()
+    handled: list[str] = []
+
+    async def handler(payment: Payment):
+        if payment.wallet_id == "auto":
+            await slow.wait()
+        handled.append(payment.payment_hash)
+
+    pool = InvoiceConsumerPool(
+        handler, workers=1, queue_size=10, queued=lambda p: p.wallet_id == "auto"
+    )
+    source: asyncio.Queue[Payment] = asyncio.Queue()
+    for payment in (paid_invoice("auto", "auto_1"), paid_invoice("other", "other")):
+        source.put_nowait(payment)
+    task = asyncio.create_task(pool.run(source))
+    await asyncio.sleep(0.01)
+
+    # the only worker is busy with the auto swap, the other wallet does not wait
+    assert handled == ["other"]
+    assert pool.stats().busy == 1
+
+    slow.set()
+    await asyncio.sleep(0.01)
+    assert handled == ["other", "auto_1"]
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
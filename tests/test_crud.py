@@ -0,0 +1,191 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from .. import crud
+from ..crud import next_cursor, parse_cursor, swap_list_query, update_swap_status
+from ..models import SubmarineSwapSummary, SwapFilters, SwapJob
+from .conftest import reverse_swap, swap
+
+
+def test_swap_list_query_binds_wallets_and_filters():
+    query, values = swap_list_query(
+        "boltz.submarineswap",
+        ["wallet1", "wallet2' OR '1'='1"],
+        SwapFilters(status="pending", since=1_700_000_000, limit=5000),
+    )
+    assert "wallet IN (:wallet_0, :wallet_1)" in query
+    assert values["wallet_1"] == "wallet2' OR '1'='1"
+    assert "status = :status" in query
+    assert "direction" not in query
+    assert "ORDER BY time DESC, id DESC LIMIT :limit" in query
+    assert values["limit"] == 1000
+
+    query, values = swap_list_query("boltz.submarineswap", "wallet1")
+    assert "LIMIT" not in query
+    assert values == {"wallet_0": "wallet1"}
+
+
+def test_swap_list_cursor():
+    page = [swap.copy(update={"time": datetime.fromtimestamp(1_700_000_000.5)})]
+    assert next_cursor(page, limit=2) is None
+    cursor = next_cursor(page, limit=1)
+    assert cursor == "1700000000.500000:swap"
+    assert parse_cursor(cursor) == (
+        datetime.fromtimestamp(1_700_000_000.5, timezone.utc),
+        "swap",
+    )
+
+    _, values = swap_list_query(
+        "boltz.submarineswap", "wallet1", SwapFilters(cursor=cursor)
+    )
+    assert values["cursor_id"] == "swap"
+    assert values["cursor_time"] == 1_700_000_000.5
+    with pytest.raises(ValueError):
+        parse_cursor("invalid")
+
+
+def test_swap_summary_query_skips_secrets():
+    query, _ = swap_list_query(
+        "boltz.submarineswap",
+        "wallet1",
+        columns=list(SubmarineSwapSummary.__fields__),
+    )
+    assert "SELECT id, wallet, asset" in query
+    for secret in ("refund_privkey", "redeem_script", "bip21", "payment_hash"):
+        assert secret not in query
+
+
+@pytest.mark.asyncio
+async def test_update_swap_status_rejects_illegal_transitions():
+    with pytest.raises(ValueError, match="complete -> refunded"):
+        await update_swap_status("swap", "refunded", reverse=False, expected="complete")
+    with pytest.raises(ValueError, match="pending -> pending"):
+        await update_swap_status("swap", "pending", reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_update_swap_status_sets_once_and_logs_event(database):
+    await database.insert("boltz.submarineswap", swap)
+    await database.insert("boltz.reverse_submarineswap", reverse_swap)
+
+    updated = await update_swap_status("swap", "complete", reverse=False)
+    assert updated and updated.status == "complete"
+    # finished by another worker meanwhile
+    assert await update_swap_status("swap", "refunded", reverse=False) is None
+    assert await update_swap_status("reverse", "failed", reverse=False) is None
+
+    updated_swaps = await crud.update_swap_statuses(
+        ["swap", "reverse"], "refunded", reverse=True, txid="txid"
+    )
+    assert [s.id for s in updated_swaps] == ["reverse"]
+    assert (await crud.get_submarine_swap("swap")).status == "complete"
+    events = await crud.get_all_swap_events(0)
+    assert [(e.swap_id, e.status, e.txid) for e in events] == [
+        ("swap", "complete", None),
+        ("reverse", "refunded", "txid"),
+    ]
+    assert await crud.get_last_swap_event_id() == events[-1].id
+
+
+@pytest.mark.asyncio
+async def test_jobs_are_leased_by_one_node(database):
+    job = SwapJob(id="swap", reverse=False, due=100)
+    await crud.upsert_jobs([job], owner="a", now=100)
+    assert await crud.lease_job(job, "a", now=100, until=200)
+    assert not await crud.lease_job(job, "b", now=150, until=250)
+    assert await crud.lease_job(job, "a", now=150, until=250)
+
+    # a leased job is not rescheduled by another node, its owner releases it
+    await crud.upsert_jobs([job.copy(update={"due": 300})], owner="b", now=200)
+    (stored,) = await crud.get_all_jobs()
+    assert (stored.due, stored.lease_owner) == (100, "a")
+    await crud.upsert_jobs([job.copy(update={"due": 300})], owner="a", now=200)
+    (stored,) = await crud.get_all_jobs()
+    assert (stored.due, stored.lease_owner) == (300, None)
+
+    # expired leases are taken over, missing jobs are created leased
+    assert await crud.lease_job(job, "a", now=300, until=400)
+    assert await crud.lease_job(job, "b", now=401, until=500)
+    missing = SwapJob(id="reverse", reverse=True, due=100)
+    assert await crud.lease_job(missing, "b", now=401, until=500)
+    assert not await crud.lease_job(missing, "a", now=402, until=500)
+    jobs = {j.id: j.lease_owner for j in await crud.get_all_jobs()}
+    assert jobs == {"swap": "b", "reverse": "b"}
+
+    await crud.delete_jobs(["swap", "reverse"])
+    assert await crud.get_all_jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_named_lease_is_held_by_one_node(database):
+    assert await crud.acquire_lease("auto_swap", "a", now=100, until=200)
+    assert not await crud.acquire_lease("auto_swap", "b", now=150, until=250)
+    assert await crud.acquire_lease("auto_swap", "a", now=150, until=250)
+    await crud.release_lease("auto_swap", "b")
+    assert not await crud.acquire_lease("auto_swap", "b", now=200, until=300)
+    await crud.release_lease("auto_swap", "a")
+    assert await crud.acquire_lease("auto_swap", "b", now=200, until=300)
+    # expired
+    assert await crud.acquire_lease("auto_swap", "a", now=301, until=400)
+
+
+@pytest.mark.asyncio
+async def test_pending_submarine_swap_timeouts(database):
+    for swap_id, timeout, status in (
+        ("early", 101, "pending"),
+        ("late", 105, "pending"),
+        ("paid", 101, "complete"),
+    ):
+        await database.insert(
+            "boltz.submarineswap",
+            swap.copy(
+                update={
+                    "id": swap_id,
+                    "timeout_block_height": timeout,
+                    "status": status,
+                }
+            ),
+        )
+    timeouts = await crud.get_pending_submarine_swap_timeouts("BTC/BTC")
+    assert sorted(timeouts) == [("early", 101), ("late", 105)]
+    assert await crud.get_pending_submarine_swap_timeouts("BTC/BTC", 104) == [
+        ("early", 101)
+    ]
+    assert await crud.get_pending_submarine_swap_timeouts("L-BTC/BTC") == []
+
+
+@pytest.mark.asyncio
+async def test_swap_list_pages_swaps_of_the_same_second(database):
+    second = datetime.fromtimestamp(1_700_000_000, timezone.utc)
+    for i in range(5):
+        created = second.replace(microsecond=100_000 * (i + 1))
+        await database.insert(
+            "boltz.submarineswap",
+            swap.copy(update={"id": f"s{i}", "payment_hash": f"h{i}", "time": created}),
+        )
+    await database.insert(
+        "boltz.submarineswap",
+        swap.copy(
+            update={
+                "id": "old",
+                "payment_hash": "old",
+                "time": second.replace(second=0),
+            }
+        ),
+    )
+
+    pages: list[list[str]] = []
+    filters = SwapFilters(limit=2, since=1_700_000_000)
+    while True:
+        page = await crud.get_submarine_swap_summaries("wallet", filters)
+        pages.append([s.id for s in page])
+        cursor = next_cursor(page, filters.limit)
+        if not cursor:
+            break
+        filters = filters.copy(update={"cursor": cursor})
+    assert pages == [["s4", "s3"], ["s2", "s1"], ["s0"]]
+
+    filters = SwapFilters(since=1_699_999_960, until=1_700_000_000)
+    page = await crud.get_submarine_swap_summaries("wallet", filters)
+    assert [s.id for s in page] == ["old"]
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from .. import events
+from ..events import SwapEventBroker, swap_event_stream
+from ..models import SwapEvent
+
+
+def swap_event(event_id: int, wallet: str = "wallet") -> SwapEvent:
+    return SwapEvent(
+        id=event_id,
+        swap_id="swap",
+        wallet=wallet,
+        reverse=False,
+        status="pending",
+        time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+@pytest.mark.asyncio
+async def test_swap_event_stream_catches_up_and_skips_duplicates(monkeypatch):
+    broker = SwapEventBroker()
+
+    async def get_last_swap_event_id():
+        return 2
+
+    async def get_swap_events(wallet_ids, since, limit):
+        return [swap_event(i) for i in (2, 3) if i > since]
+
+    async def get_all_swap_events(since, limit):
+        return [swap_event(3), swap_event(4), swap_event(5, wallet="other")]
+
+    monkeypatch.setattr(events, "swap_event_broker", broker)
+    monkeypatch.setattr(events, "get_last_swap_event_id", get_last_swap_event_id)
+    monkeypatch.setattr(events, "get_swap_events", get_swap_events)
+    monkeypatch.setattr(events, "get_all_swap_events", get_all_swap_events)
+
+    stream = swap_event_stream(["wallet"], since=1)
+    assert (await anext(stream))["id"] == "2"
+    assert (await anext(stream))["id"] == "3"
+
+    await broker.poll()
+    assert broker.last_id == 5
+    message = await asyncio.wait_for(anext(stream), 1)
+    assert message["event"] == "swap"
+    assert SwapEvent.parse_raw(message["data"]) == swap_event(4)
+
+    await stream.aclose()
+    assert broker._subscribers == {}
+    await broker.poll()
+    assert broker.last_id is None
+
+
+@pytest.mark.asyncio
+async def test_swap_event_broker_drops_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(events, "EVENT_QUEUE_SIZE", 2)
+    broker = SwapEventBroker()
+    broker.last_id = 0
+    queue = await broker.subscribe(["wallet"])
+    for i in range(3):
+        broker.publish(swap_event(i))
+    assert broker._subscribers == {}
+    assert queue.get_nowait() == swap_event(1)
+    assert queue.get_nowait() is None
@@ -0,0 +1,17 @@
+from ..nodes import NodeRegistry
+
+
+def test_node_registry_shards_swaps():
+    nodes = NodeRegistry()
+    assert nodes.is_mine("swap")
+
+    nodes.live_nodes = sorted([nodes.node_id, "node_b", "node_c"])
+    swap_ids = [f"swap_{i}" for i in range(300)]
+    owners = {swap_id: nodes.owner(swap_id) for swap_id in swap_ids}
+    assert set(owners.values()) == set(nodes.live_nodes)
+
+    # only the swaps of a leaving node move to other nodes
+    nodes.live_nodes.remove("node_c")
+    for swap_id, owner in owners.items():
+        if owner != "node_c":
+            assert nodes.owner(swap_id) == owner
@@ -0,0 +1,195 @@
+import pytest
+from embit import ec, script
+from embit.networks import NETWORKS
+from embit.transaction import Transaction
+
+from .. import rbf
+from ..boltz_client.boltz import BoltzApiException
+from ..boltz_client.onchain import RBF_SEQUENCE, create_batch_claim_tx, tx_vsize
+from ..models import BoltzSettings
+from ..rbf import FeeBumper
+from ..utils import swap_claim_input
+from .conftest import reverse_swap
+from .test_boltz_client import lockup_tx
+
+NET = NETWORKS["regtest"]
+PRIVKEY = ec.PrivateKey(bytes([3] * 32))
+REDEEM_SCRIPT = script.Script(data=bytes([0x21]) + PRIVKEY.sec() + b"\xac")
+LOCKUP_RAWTX = lockup_tx(REDEEM_SCRIPT, 100_000)
+
+swap = reverse_swap.copy(
+    update={
+        "lockup_address": script.p2wsh(REDEEM_SCRIPT).address(NET),
+        "claim_privkey": PRIVKEY.wif(NET),
+        "preimage": "00" * 32,
+        "redeem_script": REDEEM_SCRIPT.data.hex(),
+        "onchain_address": script.p2wpkh(PRIVKEY).address(NET),
+    }
+)
+
+
+class ClaimClient:
+    pair = "BTC/BTC"
+
+    def __init__(self, feerate: float | None = None) -> None:
+        self.broadcasts: dict[str, str] = {}
+        self.feerate = feerate
+        self.error: str | None = None
+        self.confirmations: dict[str, int] = {}
+
+    async def resolve_feerate(self, feerate=None):
+        return feerate or self.feerate
+
+    async def get_transaction_confirmations(self, txid):
+        return self.confirmations.get(txid, 0)
+
+    async def claim_reverse_swaps(self, claims, receive_address, feerate=None):
+        if self.error:
+            raise BoltzApiException(self.error)
+        rawtx = create_batch_claim_tx(claims, receive_address, 500, feerate)
+        txid = Transaction.from_string(rawtx).txid().hex()
+        self.broadcasts[txid] = rawtx
+        return txid
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    txs: dict = {}
+
+    async def create_onchain_transaction(tx):
+        txs[tx.id] = tx
+
+    async def update_onchain_transaction(txid, status=None, broadcast_height=None):
+        txs[txid] = txs[txid].copy(
+            update={
+                "status": status or txs[txid].status,
+                "broadcast_height": broadcast_height or txs[txid].broadcast_height,
+            }
+        )
+
+    async def replace_onchain_transaction(txid, tx):
+        await update_onchain_transaction(txid, status="replaced")
+        txs[tx.id] = tx
+
+    async def get_reverse_submarine_swap(swap_id):
+        return swap
+
+    async def create_swap_event(swap, txid=None):
+        pass
+
+    async def get_or_create_boltz_settings():
+        return BoltzSettings(boltz_rbf_blocks=3)
+
+    for func in (
+        create_onchain_transaction,
+        update_onchain_transaction,
+        replace_onchain_transaction,
+        get_reverse_submarine_swap,
+        create_swap_event,
+        get_or_create_boltz_settings,
+    ):
+        monkeypatch.setattr(rbf, func.__name__, func)
+    return txs
+
+
+@pytest.mark.asyncio
+async def test_fee_bumper_replaces_unconfirmed_claim(stored):
+    bumper = FeeBumper()
+    client = ClaimClient()
+    txid = await client.claim_reverse_swaps(
+        [swap_claim_input(swap, LOCKUP_RAWTX)], swap.onchain_address, 2
+    )
+    await bumper.track(client, txid, [swap], [LOCKUP_RAWTX])
+    tx = stored[txid]
+    assert client.broadcasts == {}
+    assert tx.reverse and tx.swap_ids == ["reverse"]
+    assert tx.fee == 100_000 - Transaction.from_string(tx.tx_hex).vout[0].value
+    assert tx.vsize == tx_vsize(Transaction.from_string(tx.tx_hex))
+    assert Transaction.from_string(tx.tx_hex).vin[0].sequence == RBF_SEQUENCE
+
+    # the height is taken with the first check, then it waits `blocks` blocks
+    assert await bumper.bump_if_due(client, tx, 100, blocks=3) is None
+    tx = stored[txid]
+    assert tx.broadcast_height == 100
+    assert await bumper.bump_if_due(client, tx, 102, blocks=3) is None
+
+    replaced_by = await bumper.bump_if_due(client, tx, 103, blocks=3)
+    assert replaced_by
+    assert stored[txid].status == "replaced"
+    replacement = stored[replaced_by]
+    assert replacement.broadcast_height == 103
+    assert replacement.feerate >= tx.feerate + rbf.RBF_MIN_INCREMENT
+    assert replacement.fee >= tx.fee + replacement.vsize
+
+    # close to the timeout of the claim it is bumped every block, and harder
+    urgent = replacement.copy(update={"timeout_block_height": 108})
+    bumped = await bumper.bump_if_due(client, urgent, 104, blocks=3)
+    assert bumped
+    assert stored[bumped].feerate >= 2 * replacement.feerate
+
+    # a confirmed transaction is not signed and broadcasted again
+    client.confirmations[bumped] = 1
+    client.error = "unexpected broadcast"
+    assert await bumper.bump_if_due(client, stored[bumped], 110, blocks=3) is None
+    assert stored[bumped].status == "confirmed"
+
+    # neither if its confirmation is not reported, but its inputs are spent
+    client.confirmations.clear()
+    client.error = "bad-txns-inputs-missingorspent"
+    stored[bumped] = stored[bumped].copy(update={"status": "pending"})
+    assert await bumper.bump_if_due(client, stored[bumped], 110, blocks=3) is None
+    assert stored[bumped].status == "confirmed"
+
+
+@pytest.mark.asyncio
+async def test_fee_bumper_does_not_track_without_rbf(monkeypatch, stored):
+    async def get_or_create_boltz_settings():
+        return BoltzSettings(boltz_rbf_blocks=0)
+
+    monkeypatch.setattr(
+        rbf, "get_or_create_boltz_settings", get_or_create_boltz_settings
+    )
+    client = ClaimClient()
+    txid = await client.claim_reverse_swaps(
+        [swap_claim_input(swap, LOCKUP_RAWTX)], swap.onchain_address, 2
+    )
+    await FeeBumper().track(client, txid, [swap], [LOCKUP_RAWTX])
+    assert client.broadcasts == {}
+    assert stored == {}
+
+
+@pytest.mark.asyncio
+async def test_bump_feerate():
+    bumper = FeeBumper()
+    assert await bumper.bump_feerate(ClaimClient(), 2, urgent=False) == 3
+    assert await bumper.bump_feerate(ClaimClient(), 10, urgent=False) == 12.5
+    assert await bumper.bump_feerate(ClaimClient(), 10, urgent=True) == 20
+    # the fee estimation wins if it is higher
+    assert await bumper.bump_feerate(ClaimClient(30), 10, urgent=False) == 30
+    assert await bumper.bump_feerate(ClaimClient(), rbf.RBF_MAX_FEERATE, True) is None
+    # capped by the share of the swapped amount the fee may take
+    assert await bumper.bump_feerate(ClaimClient(30), 10, False, 12) == 12
+    assert await bumper.bump_feerate(ClaimClient(), 10, True, 10) is None
+
+
+@pytest.mark.asyncio
+async def test_fee_bumper_stops_at_timeout_and_amount_cap(stored):
+    bumper = FeeBumper()
+    client = ClaimClient()
+    txid = await client.claim_reverse_swaps(
+        [swap_claim_input(swap, LOCKUP_RAWTX)], swap.onchain_address, 50
+    )
+    await bumper.track(client, txid, [swap], [LOCKUP_RAWTX])
+    tx = stored[txid].copy(update={"broadcast_height": 100})
+    assert rbf.lockup_amount(tx) == 100_000
+
+    # an urgent claim doubles its feerate, but not beyond 10% of the amount
+    bumped = await bumper.bump_if_due(client, tx, 195, blocks=3)
+    assert bumped
+    assert stored[bumped].fee <= 100_000 * rbf.RBF_MAX_FEE_SHARE + stored[bumped].vsize
+    assert await bumper.bump_if_due(client, stored[bumped], 196, blocks=3) is None
+
+    # after the timeout boltz may refund, the claim is not bumped anymore
+    assert await bumper.bump_if_due(client, stored[bumped], 200, blocks=3) is None
+    assert stored[bumped].status == "expired"
+    assert len(client.broadcasts) == 0
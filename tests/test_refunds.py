@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from .. import refunds
+from ..boltz_client.boltz import BoltzBlockHeightException, BoltzClient, BoltzConfig
+from ..refunds import LocalChainTipSource, RefundScheduler
+from .conftest import swap
+
+
+class FakeWatcher:
+    def __init__(self) -> None:
+        self.woken: list[str] = []
+        self.heights: dict[str, int] = {}
+
+    def wake(self, swap):
+        self.woken.append(swap.id)
+
+    def set_block_height(self, pair, height):
+        self.heights[pair] = height
+
+
+@pytest.fixture
+def swaps(monkeypatch):
+    stored = {
+        swap_id: swap.copy(update={"id": swap_id, "timeout_block_height": timeout})
+        for swap_id, timeout in (("late", 105), ("early", 102), ("paid", 103))
+    }
+
+    async def get_submarine_swap(swap_id):
+        return stored.get(swap_id)
+
+    async def get_pending_submarine_swap_timeouts(asset, max_height=None):
+        return [
+            (s.id, s.timeout_block_height)
+            for s in stored.values()
+            if s.status == "pending"
+            and (max_height is None or s.timeout_block_height <= max_height)
+        ]
+
+    monkeypatch.setattr(refunds, "get_submarine_swap", get_submarine_swap)
+    monkeypatch.setattr(
+        refunds,
+        "get_pending_submarine_swap_timeouts",
+        get_pending_submarine_swap_timeouts,
+    )
+    return stored
+
+
+@pytest.mark.asyncio
+async def test_local_chain_tip_source_waits_for_new_block():
+    source = LocalChainTipSource(100)
+    assert await source.wait_for_tip() == 100
+    waiting = asyncio.create_task(source.wait_for_tip(100))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    source.set_tip(101)
+    assert await asyncio.wait_for(waiting, 1) == 101
+
+
+@pytest.mark.asyncio
+async def test_refund_scheduler_wakes_swaps_at_their_timeout(monkeypatch, swaps):
+    fake_watcher = FakeWatcher()
+    monkeypatch.setattr(refunds, "swap_watcher", fake_watcher)
+    source = LocalChainTipSource(100)
+    scheduler = RefundScheduler("BTC/BTC", source)
+    for scheduled in swaps.values():
+        scheduler.add(scheduled)
+    scheduler.add(swaps["late"])
+    assert len(scheduler._heap) == 3
+
+    await scheduler.step()
+    assert fake_watcher.heights == {"BTC/BTC": 100}
+    assert fake_watcher.woken == []
+
+    # not before the timeout block, and in order of the timeouts
+    source.set_tip(102)
+    await scheduler.step()
+    assert fake_watcher.woken == ["early"]
+
+    swaps["paid"] = swaps["paid"].copy(update={"status": "complete"})
+    source.set_tip(106)
+    await scheduler.step()
+    assert fake_watcher.woken == ["early", "late"]
+    assert fake_watcher.heights == {"BTC/BTC": 106}
+    assert scheduler._heap == []
+
+
+@pytest.mark.asyncio
+async def test_refund_scheduler_reloads_swaps_of_other_nodes(monkeypatch, swaps):
+    fake_watcher = FakeWatcher()
+    monkeypatch.setattr(refunds, "swap_watcher", fake_watcher)
+    source = LocalChainTipSource(100)
+    scheduler = RefundScheduler("BTC/BTC", source)
+    del swaps["late"], swaps["paid"]
+    await scheduler.step()
+    assert fake_watcher.woken == []
+
+    # created on another node after this one started, and maybe owned by any
+    # node, the watcher forgets it if it is not this node's
+    swaps["other"] = swap.copy(update={"id": "other", "timeout_block_height": 101})
+    source.set_tip(101)
+    await scheduler.step()
+    assert fake_watcher.woken == ["other"]
+
+    source.set_tip(102)
+    await scheduler.step()
+    assert fake_watcher.woken == ["other", "early"]
+    assert scheduler._heap == []
+
+
+@pytest.mark.asyncio
+async def test_refund_scheduler_does_not_poll_without_swaps(monkeypatch, swaps):
+    fake_watcher = FakeWatcher()
+    monkeypatch.setattr(refunds, "swap_watcher", fake_watcher)
+    monkeypatch.setattr(refunds, "REFUND_SCHEDULER_RELOAD_INTERVAL", 0.01)
+    polls: list[int | None] = []
+
+    class CountingSource(LocalChainTipSource):
+        async def wait_for_tip(self, height=None):
+            polls.append(height)
+            return await super().wait_for_tip(height)
+
+    scheduler = RefundScheduler("BTC/BTC", CountingSource(100))
+    swaps.clear()
+    step = asyncio.create_task(scheduler.step())
+    await asyncio.sleep(0.05)
+    assert not step.done()
+    assert polls == []
+
+    # found with the next reload, e.g. created on another node
+    swaps["other"] = swap.copy(update={"id": "other", "timeout_block_height": 100})
+    await asyncio.wait_for(step, 1)
+    assert polls == [None]
+    assert fake_watcher.woken == ["other"]
+
+
+def test_chain_tip_source_is_abstract():
+    with pytest.raises(TypeError):
+        refunds.ChainTipSource()  # type: ignore[abstract]
+
+
+@pytest.mark.asyncio
+async def test_refund_is_rejected_before_timeout(monkeypatch):
+    client = BoltzClient(BoltzConfig(pairs=["BTC/BTC"]))
+
+    async def get_block_height():
+        return 199
+
+    monkeypatch.setattr(client, "get_block_height", get_block_height)
+    with pytest.raises(BoltzBlockHeightException):
+        await client.check_block_height(200)
+    await client.check_block_height(199)
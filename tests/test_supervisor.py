@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from ..supervisor import TaskSupervisor
+
+
+@pytest.mark.asyncio
+async def test_task_supervisor_tracks_and_surfaces_crashes():
+    supervisor = TaskSupervisor()
+    event = asyncio.Event()
+
+    async def claim():
+        supervisor.set_stage("claim")
+        await event.wait()
+
+    async def crash():
+        raise RuntimeError("boom")
+
+    running = supervisor.create_task("reverse", "check", claim())
+    crashed = supervisor.create_task("swap", "pay_invoice", crash())
+    await asyncio.sleep(0)
+    await asyncio.gather(crashed, return_exceptions=True)
+
+    tasks = {task.swap_id: task for task in supervisor.list_tasks()}
+    assert tasks["reverse"].stage == "claim"
+    assert tasks["reverse"].error is None
+    assert tasks["swap"].error == "boom"
+
+    supervisor.cancel_all()
+    await asyncio.gather(running, return_exceptions=True)
+    assert running.cancelled()
+    assert supervisor.tasks == {}
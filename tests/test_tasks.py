@@ -0,0 +1,223 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from lnbits.wallets.base import PaymentStatus
+
+from .. import tasks
+from ..models import AutoReverseSubmarineSwap, SwapJob
+from .conftest import FakeClient, paid_invoice, reverse_swap, swap, use_client
+
+
+async def no_heartbeat():
+    pass
+
+
+@pytest.mark.asyncio
+async def test_startup_recovery_summary(monkeypatch):
+    client = FakeClient("transaction.confirmed", "lockup")
+    use_client(monkeypatch, client)
+
+    async def swap_status(boltz_id):
+        if boltz_id == "boltz_swap":
+            await asyncio.sleep(10)
+        return client.status
+
+    resumed = swap.copy(update={"id": "resumed", "boltz_id": "boltz_resumed"})
+    taken = swap.copy(update={"id": "taken", "boltz_id": "boltz_taken"})
+
+    async def pending_swaps():
+        return [swap, resumed, taken]
+
+    async def pending_reverse_swaps():
+        return [reverse_swap]
+
+    async def get_all_jobs():
+        return [
+            SwapJob(id="resumed", reverse=False, due=int(time.time()) + 60, attempts=2),
+            SwapJob(id="stale", reverse=True, due=0),
+        ]
+
+    deleted = []
+
+    async def delete_jobs(job_ids):
+        deleted.extend(job_ids)
+
+    async def check_transaction_status(wallet, payment_hash):
+        return PaymentStatus(paid=False)
+
+    updates = []
+
+    async def update_swap_status(swap_id, status, reverse, boltz_status, txid):
+        updates.append((swap_id, status))
+
+    leased = []
+
+    async def lease_job(job, owner, now, until):
+        # checked by another node, which started at the same time
+        leased.append(job.id)
+        return job.id != "taken"
+
+    monkeypatch.setattr(client, "swap_status", swap_status)
+    monkeypatch.setattr(tasks, "get_all_pending_submarine_swaps", pending_swaps)
+    monkeypatch.setattr(
+        tasks, "get_all_pending_reverse_submarine_swaps", pending_reverse_swaps
+    )
+
+    monkeypatch.setattr(tasks.node_registry, "heartbeat", no_heartbeat)
+    monkeypatch.setattr(tasks, "get_all_jobs", get_all_jobs)
+    monkeypatch.setattr(tasks, "delete_jobs", delete_jobs)
+    monkeypatch.setattr(tasks, "check_transaction_status", check_transaction_status)
+    monkeypatch.setattr(tasks, "update_swap_status", update_swap_status)
+    monkeypatch.setattr(tasks, "lease_job", lease_job)
+
+    summary = await tasks.check_for_pending_swaps(concurrency=2, deadline=0.1)
+    assert summary == {"resumed": 1, "complete": 1, "waiting": 2}
+    assert updates == [("reverse", "complete")]
+    assert sorted(leased) == ["reverse", "swap", "taken"]
+    assert "taken" not in tasks.swap_watcher.swaps
+    assert deleted == ["stale"]
+    assert "swap" in tasks.swap_watcher.swaps
+    assert tasks.swap_watcher.swaps["resumed"].attempts == 2
+    tasks.swap_watcher.unwatch("swap")
+    tasks.swap_watcher.unwatch("resumed")
+
+
+@pytest.mark.asyncio
+async def test_auto_swaps_are_coalesced_per_wallet(monkeypatch):
+    auto_swap = AutoReverseSubmarineSwap(
+        id="auto",
+        wallet="wallet",
+        asset="BTC/BTC",
+        amount=10_000,
+        balance=0,
+        onchain_address="bcrt1q4vfyszl4p8cuvqh07fyhtxve5fxq8e2ux5gx43",
+        instant_settlement=True,
+        count=0,
+    ).copy(update={"coalesce_window": 0.05})
+    executed: list[str] = []
+
+    async def get_auto_swap(wallet_id):
+        return auto_swap
+
+    async def acquire_lease(lease_id, owner, now, until):
+        return True
+
+    async def release_lease(lease_id, owner):
+        pass
+
+    async def execute_auto_swap(auto_swap):
+        executed.append(auto_swap.wallet)
+
+    monkeypatch.setattr(
+        tasks, "get_auto_reverse_submarine_swap_by_wallet", get_auto_swap
+    )
+    monkeypatch.setattr(tasks, "acquire_lease", acquire_lease)
+    monkeypatch.setattr(tasks, "release_lease", release_lease)
+    monkeypatch.setattr(tasks, "execute_auto_swap", execute_auto_swap)
+
+    for i in range(3):
+        await tasks.check_for_auto_swap(paid_invoice("wallet", f"hash_{i}"))
+    coalesced = tasks.coalesced_auto_swaps["wallet"]
+    assert executed == []
+    await coalesced
+    assert executed == ["wallet"]
+    assert "wallet" not in tasks.coalesced_auto_swaps
+
+    auto_swap.coalesce_window = 0
+    await tasks.check_for_auto_swap(paid_invoice("wallet", "hash_3"))
+    assert executed == ["wallet", "wallet"]
+
+
+@pytest.mark.asyncio
+async def test_auto_swap_splits_surplus(monkeypatch):
+    auto_swap = AutoReverseSubmarineSwap(
+        id="auto",
+        wallet="wallet",
+        asset="BTC/BTC",
+        amount=10_000,
+        balance=0,
+        onchain_address="bcrt1q4vfyszl4p8cuvqh07fyhtxve5fxq8e2ux5gx43",
+        instant_settlement=True,
+        count=0,
+        max_swap_amount=100_000,
+    )
+    client = SimpleNamespace(limits={"minimal": 10_000, "maximal": 1_000_000})
+    amounts = tasks.auto_swap_amounts(auto_swap, client, 250_000, 249_000)
+    assert len(amounts) == 3
+    assert max(amounts) - min(amounts) <= 1
+    # resized to leave a fee reserve for each of the payments
+    reserves = sum(tasks.fee_reserve_total(amount * 1000) for amount in amounts)
+    assert sum(amounts) + reserves / 1000 <= 250_000
+
+    # a cap below the boltz minimal does not create swaps boltz would reject
+    capped = auto_swap.copy(update={"max_swap_amount": 5_000})
+    assert tasks.auto_swap_amounts(capped, client, 250_000, 249_000) == []
+
+
+@pytest.mark.asyncio
+async def test_recovery_deadline_does_not_cut_off_claims(monkeypatch):
+    class SlowClaimClient(FakeClient):
+        async def claim_reverse_swap(self, **kwargs):
+            await asyncio.sleep(0.1)
+            return await super().claim_reverse_swap(**kwargs)
+
+    client = SlowClaimClient("transaction.confirmed", "lockup")
+    use_client(monkeypatch, client)
+    updates = []
+
+    async def update_swap_status(swap_id, status, reverse, boltz_status, txid):
+        updates.append((swap_id, status, txid))
+
+    async def lease_job(job, owner, now, until):
+        return True
+
+    monkeypatch.setattr(tasks, "update_swap_status", update_swap_status)
+    monkeypatch.setattr(tasks, "lease_job", lease_job)
+    assert await tasks.recover_swap(reverse_swap, deadline=0.01) == "complete"
+    assert client.claimed == ["lockup"]
+    assert updates == [("reverse", "complete", "claim_txid")]
+
+
+@pytest.mark.asyncio
+async def test_auto_swap_lock_wait_is_bounded(monkeypatch):
+    executed: list[str] = []
+    renewals: list[int] = []
+
+    async def get_auto_swap(wallet_id):
+        return wallet_id
+
+    async def acquire_lease(lease_id, owner, now, until):
+        renewals.append(now)
+        return lease_id != "auto_swap:busy"
+
+    async def release_lease(lease_id, owner):
+        pass
+
+    async def execute_auto_swap(auto_swap):
+        await asyncio.sleep(0.05)
+        executed.append(auto_swap)
+
+    monkeypatch.setattr(
+        tasks, "get_auto_reverse_submarine_swap_by_wallet", get_auto_swap
+    )
+    monkeypatch.setattr(tasks, "acquire_lease", acquire_lease)
+    monkeypatch.setattr(tasks, "release_lease", release_lease)
+    monkeypatch.setattr(tasks, "execute_auto_swap", execute_auto_swap)
+    monkeypatch.setattr(tasks, "AUTO_SWAP_LOCK_WAIT", 0.01)
+    monkeypatch.setattr(tasks, "AUTO_SWAP_LOCK_TIME", 0.03)
+
+    # another node holds the lease, the worker gives up and retries later
+    await asyncio.wait_for(tasks.run_auto_swap("busy"), 1)
+    retry = tasks.coalesced_auto_swaps.pop("busy")
+    retry.cancel()
+    await asyncio.gather(retry, return_exceptions=True)
+    assert executed == []
+
+    # the lease is renewed while the auto swap runs
+    renewals.clear()
+    await tasks.run_auto_swap("wallet")
+    assert executed == ["wallet"]
+    assert len(renewals) > 1
+    assert not tasks.auto_swap_locks["wallet"].locked()
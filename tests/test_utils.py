@@ -0,0 +1,12 @@
+from ..utils import split_amount
+
+
+def test_split_amount():
+    assert split_amount(500, 1_000, 10_000) == []
+    assert split_amount(9_000, 1_000, 10_000) == [9_000]
+    assert split_amount(25_001, 1_000, 10_000) == [8_334, 8_334, 8_333]
+    # limits closer than a factor of 2, the remainder is not swapped
+    assert split_amount(25_000, 6_000, 10_000) == [8_334, 8_333, 8_333]
+    assert split_amount(11_000, 6_000, 10_000) == [10_000]
+    # a per swap cap below the boltz minimal, no part is within the limits
+    assert split_amount(50_000, 10_000, 5_000) == []
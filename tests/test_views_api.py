@@ -0,0 +1,86 @@
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from .. import views_api
+from ..models import CreateAutoReverseSubmarineSwap
+from .conftest import reverse_swap, swap
+
+
+def request(headers: dict[str, str] | None = None) -> Request:
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "headers": raw_headers})
+
+
+@pytest.mark.asyncio
+async def test_dashboard_etag(monkeypatch):
+    async def get_swaps(wallet_ids, filters):
+        assert wallet_ids == ["wallet"]
+        return [swap]
+
+    async def get_reverse_swaps(wallet_ids, filters):
+        return [reverse_swap]
+
+    async def get_auto_swaps(wallet_ids, filters):
+        return []
+
+    async def get_last_swap_event_id():
+        return 7
+
+    async def create_boltz_client():
+        raise ConnectionError("boltz is down")
+
+    monkeypatch.setattr(views_api, "get_submarine_swap_summaries", get_swaps)
+    monkeypatch.setattr(
+        views_api, "get_reverse_submarine_swap_summaries", get_reverse_swaps
+    )
+    monkeypatch.setattr(views_api, "get_auto_reverse_submarine_swaps", get_auto_swaps)
+    monkeypatch.setattr(views_api, "get_last_swap_event_id", get_last_swap_event_id)
+    monkeypatch.setattr(views_api, "create_boltz_client", create_boltz_client)
+    key_info = SimpleNamespace(wallet=SimpleNamespace(id="wallet"))
+
+    response = await views_api.api_dashboard(request(), False, 100, key_info)
+    assert response.status_code == HTTPStatus.OK
+    dashboard = views_api.BoltzDashboard.parse_raw(response.body)
+    assert dashboard.swaps[0].id == "swap"
+    assert dashboard.pairs is None
+    assert dashboard.last_event_id == 7
+
+    etag = response.headers["ETag"]
+    response = await views_api.api_dashboard(
+        request({"If-None-Match": f"W/{etag}"}), False, 100, key_info
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.body == b""
+
+
+@pytest.mark.asyncio
+async def test_auto_swap_cap_below_boltz_minimal(monkeypatch):
+    async def get_auto_swap(wallet_id):
+        return None
+
+    async def api_address_validation(address, asset):
+        pass
+
+    async def create_boltz_client(pair):
+        return SimpleNamespace(limits={"minimal": 10_000, "maximal": 1_000_000})
+
+    monkeypatch.setattr(
+        views_api, "get_auto_reverse_submarine_swap_by_wallet", get_auto_swap
+    )
+    monkeypatch.setattr(views_api, "api_address_validation", api_address_validation)
+    monkeypatch.setattr(views_api, "create_boltz_client", create_boltz_client)
+    data = CreateAutoReverseSubmarineSwap(
+        wallet="wallet",
+        asset="BTC/BTC",
+        amount=100_000,
+        instant_settlement=True,
+        onchain_address="bcrt1q4vfyszl4p8cuvqh07fyhtxve5fxq8e2ux5gx43",
+        max_swap_amount=5_000,
+    )
+    with pytest.raises(HTTPException) as exc:
+        await views_api.api_auto_reverse_submarineswap_create(data)
+    assert exc.value.status_code == HTTPStatus.BAD_REQUEST
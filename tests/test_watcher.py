@@ -0,0 +1,208 @@
+import time
+
+import pytest
+
+from .. import watcher
+from ..boltz_client.boltz import BoltzSwapStatusResponse
+from ..models import SwapJob
+from ..watcher import (
+    INTERVAL_CONFIRMATION,
+    INTERVAL_FAST,
+    INTERVAL_IDLE,
+    INTERVAL_URGENT,
+    INTERVAL_WEBSOCKET,
+    SwapWatcher,
+    WatchedSwap,
+    next_check_interval,
+)
+from .conftest import FakeClient, reverse_swap, swap, use_client
+
+
+def test_next_check_interval():
+    now = time.time()
+    watched = WatchedSwap(swap=reverse_swap, added_at=now)
+    assert next_check_interval(watched, now=now) == INTERVAL_FAST
+    assert next_check_interval(watched, websocket=True, now=now) == INTERVAL_WEBSOCKET
+
+    watched.added_at = now - 3600
+    assert next_check_interval(watched, now=now) == INTERVAL_IDLE
+    watched.last_status = "transaction.mempool"
+    assert next_check_interval(watched, now=now) == INTERVAL_CONFIRMATION
+
+    watched.blocks_left = 2
+    assert next_check_interval(watched, websocket=True, now=now) == INTERVAL_URGENT
+    # refunds are woken at the timeout by the refund scheduler
+    watched.swap = swap
+    assert next_check_interval(watched, now=now) == INTERVAL_CONFIRMATION
+    watched.swap = reverse_swap
+
+    watched.attempts = 2
+    assert next_check_interval(watched, now=now) == INTERVAL_IDLE * 4
+
+
+@pytest.mark.asyncio
+async def test_watcher_claims_confirmed_lockup(monkeypatch):
+    client = FakeClient("transaction.mempool", "lockup")
+    use_client(monkeypatch, client)
+    swap_watcher = SwapWatcher()
+    watched = WatchedSwap(swap=reverse_swap)
+
+    assert await swap_watcher.check(watched) is None
+    assert client.claimed == []
+    assert watched.blocks_left == 100
+
+    watched.pushed_status = BoltzSwapStatusResponse(
+        status="transaction.confirmed", transaction={"hex": "lockup"}
+    )
+    assert await swap_watcher.check(watched) == "complete"
+    assert client.claimed == ["lockup"]
+
+
+@pytest.mark.asyncio
+async def test_watcher_refunds_after_timeout(monkeypatch):
+    client = FakeClient("invoice.failedToPay", height=199)
+    use_client(monkeypatch, client)
+    swap_watcher = SwapWatcher()
+    watched = WatchedSwap(swap=swap)
+
+    assert await swap_watcher.check(watched) is None
+    assert watched.blocks_left == 1
+
+    client.height = 200
+    swap_watcher._heights.clear()
+    assert await swap_watcher.check(watched) == "refunded"
+    assert client.refunded == ["lockup"]
+
+
+def test_watcher_schedule_and_unwatch():
+    swap_watcher = SwapWatcher()
+    swap_watcher.watch(swap, delay=60)
+    swap_watcher.watch(reverse_swap)
+    assert set(swap_watcher.swaps) == {"swap", "reverse"}
+    assert swap_watcher._heap[0][2] == "reverse"
+
+    swap_watcher.on_status_update(
+        "boltz_swap", BoltzSwapStatusResponse(status="transaction.claimed")
+    )
+    watched = swap_watcher.swaps["swap"]
+    assert watched.pushed_status
+    assert watched.due <= time.time()
+
+    swap_watcher.unwatch("swap")
+    assert "swap" not in swap_watcher.swaps
+    assert "boltz_swap" in swap_watcher._unsubscribe
+
+
+@pytest.mark.asyncio
+async def test_watcher_persists_jobs(monkeypatch):
+    upserted: list[SwapJob] = []
+    deleted: list[str] = []
+    database_down = True
+
+    async def upsert_jobs(jobs, owner, now):
+        if database_down:
+            raise RuntimeError("database is locked")
+        upserted.extend(jobs)
+
+    async def delete_jobs(job_ids):
+        deleted.extend(job_ids)
+
+    async def get_due_jobs(now):
+        return []
+
+    async def lease_job(job, owner, now, until):
+        return False
+
+    monkeypatch.setattr(watcher, "upsert_jobs", upsert_jobs)
+    monkeypatch.setattr(watcher, "delete_jobs", delete_jobs)
+    monkeypatch.setattr(watcher, "get_due_jobs", get_due_jobs)
+    monkeypatch.setattr(watcher, "lease_job", lease_job)
+
+    swap_watcher = SwapWatcher()
+    swap_watcher.watch(swap, delay=60)
+    swap_watcher.watch(reverse_swap)
+    # failed writes are kept and written with the next sync
+    await swap_watcher._sync_jobs()
+    assert upserted == []
+    assert swap_watcher._dirty_jobs == {"swap", "reverse"}
+    database_down = False
+    await swap_watcher._sync_jobs()
+    assert {job.id for job in upserted} == {"swap", "reverse"}
+    assert swap_watcher._dirty_jobs == set()
+
+    # a swap leased by another worker is dropped, but its job is kept
+    await swap_watcher._dispatch(swap_watcher.swaps["reverse"])
+    assert "reverse" not in swap_watcher.swaps
+
+    swap_watcher.unwatch("swap")
+    await swap_watcher._sync_jobs()
+    assert deleted == ["swap"]
+
+
+@pytest.mark.asyncio
+async def test_watcher_logs_swap_events(monkeypatch):
+    client = FakeClient("transaction.mempool", "lockup")
+    use_client(monkeypatch, client)
+    events: list[str | None] = []
+    updates: list[tuple] = []
+
+    async def lease_job(job, owner, now, until):
+        return True
+
+    async def create_swap_event(swap, boltz_status=None, txid=None):
+        events.append(boltz_status)
+
+    async def update_swap_status(swap_id, status, reverse, boltz_status, txid):
+        updates.append((swap_id, status, boltz_status, txid))
+
+    monkeypatch.setattr(watcher, "lease_job", lease_job)
+    monkeypatch.setattr(watcher, "create_swap_event", create_swap_event)
+    monkeypatch.setattr(watcher, "update_swap_status", update_swap_status)
+
+    swap_watcher = SwapWatcher()
+    watched = swap_watcher.watch(reverse_swap)
+    await swap_watcher._dispatch(watched)
+    await swap_watcher._dispatch(watched)
+    assert events == ["transaction.mempool"]
+
+    client.status = BoltzSwapStatusResponse(
+        status="transaction.confirmed", transaction={"hex": "lockup"}
+    )
+    await swap_watcher._dispatch(watched)
+    assert updates == [("reverse", "complete", "transaction.confirmed", "claim_txid")]
+    assert "reverse" not in swap_watcher.swaps
+
+
+@pytest.mark.asyncio
+async def test_watcher_retries_failed_status_writes(monkeypatch):
+    client = FakeClient("transaction.confirmed", "lockup")
+    use_client(monkeypatch, client)
+    updates: list[str] = []
+    fail = True
+
+    async def lease_job(job, owner, now, until):
+        return True
+
+    async def update_swap_status(swap_id, status, reverse, boltz_status, txid):
+        if fail:
+            raise ConnectionError("database is locked")
+        updates.append(status)
+
+    monkeypatch.setattr(watcher, "lease_job", lease_job)
+    monkeypatch.setattr(watcher, "update_swap_status", update_swap_status)
+
+    swap_watcher = SwapWatcher()
+    watched = swap_watcher.watch(reverse_swap)
+    await swap_watcher._dispatch(watched)
+    assert client.claimed == ["lockup"]
+    # still watched and rescheduled with backoff
+    assert watched.outcome == "complete"
+    assert watched.attempts == 1
+    assert watched.last_error == "database is locked"
+    assert watched.due - time.time() > INTERVAL_IDLE
+
+    fail = False
+    await swap_watcher._dispatch(watched)
+    assert updates == ["complete"]
+    assert client.claimed == ["lockup"]
+    assert "reverse" not in swap_watcher.swaps
@@ -1,28 +1,106 @@
 import asyncio
 import calendar
 import datetime
+import time
 from collections.abc import Awaitable
 
 from lnbits.core.crud import get_wallet
 from lnbits.core.services import fee_reserve_total, pay_invoice
+from loguru import logger
 
 from .boltz_client.boltz import BoltzClient, BoltzConfig
+from .boltz_client.onchain import ClaimInput, RefundInput
+from .boltz_client.websocket import BoltzSwapStatusStream
 from .crud import get_or_create_boltz_settings
-from .models import ReverseSubmarineSwap
+from .models import BoltzSettings, ReverseSubmarineSwap, SubmarineSwap
+from .supervisor import task_supervisor
+
+
+class BoltzClientPool:
+    """
+    Process wide pool of boltz clients, one per pair.
+    The pairs, fees and limits (incl. the boltz pair hash) live on the clients and
+    are refreshed in the background once they are older than `boltz_pairs_ttl`.
+    Stale fees are caught by boltz itself, through the pair hash on swap creation.
+    All clients share one websocket stream for swap status updates.
+    """
+
+    def __init__(self) -> None:
+        self.clients: dict[str, BoltzClient] = {}
+        self.settings: BoltzSettings | None = None
+        self.status_stream: BoltzSwapStatusStream | None = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    async def get(self, pair: str, settings: BoltzSettings) -> BoltzClient:
+        if self.settings and (
+            self.settings.boltz_url != settings.boltz_url
+            or self.settings.boltz_network != settings.boltz_network
+            or self.settings.boltz_network_liquid != settings.boltz_network_liquid
+        ):
+            # another boltz instance or network, cached clients and pairs are void
+            self.clear()
+        self.settings = settings
+
+        client = self.clients.get(pair)
+        if not client:
+            config = BoltzConfig(
+                pairs=["BTC/BTC", "L-BTC/BTC"],
+                referral_id="lnbits",
+                api_url=settings.boltz_url,
+                network=settings.boltz_network,
+                network_liquid=settings.boltz_network_liquid,
+            )
+            client = BoltzClient(config, pair)
+            if not self.status_stream:
+                self.status_stream = BoltzSwapStatusStream(config.websocket_url)
+            client.status_stream = self.status_stream
+            self.clients[pair] = client
+
+        if not client.pairs_updated_at:
+            async with self._lock:
+                if not client.pairs_updated_at:
+                    await self.refresh_pairs(client)
+        elif time.time() - client.pairs_updated_at > settings.boltz_pairs_ttl:
+            self.refresh_pairs_in_background(client)
+        return client
+
+    async def refresh_pairs(self, client: BoltzClient) -> None:
+        """one `getpairs` request updates the clients of all pairs"""
+        pairs = await client.get_pairs()
+        for _client in self.clients.values():
+            if _client.pair in pairs:
+                _client.set_pairs(pairs)
+
+    def refresh_pairs_in_background(self, client: BoltzClient) -> None:
+        if self._refresh_task and not self._refresh_task.done():
+            return
+
+        async def _refresh():
+            try:
+                await self.refresh_pairs(client)
+            except Exception as exc:
+                logger.warning(f"Boltz - refreshing pairs failed: {exc!s}")
+
+        self._refresh_task = asyncio.create_task(_refresh())
+
+    def clear(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        self._refresh_task = None
+        if self.status_stream:
+            self.status_stream.stop()
+        self.status_stream = None
+        self.clients.clear()
+        self.settings = None
+
+
+boltz_clients = BoltzClientPool()
 
 
 async def create_boltz_client(pair: str = "BTC/BTC") -> BoltzClient:
     settings = await get_or_create_boltz_settings()
-    config = BoltzConfig(
-        pairs=["BTC/BTC", "L-BTC/BTC"],
-        referral_id="lnbits",
-        api_url=settings.boltz_url,
-        network=settings.boltz_network,
-        network_liquid=settings.boltz_network_liquid,
-    )
-    client = BoltzClient(config, pair)
-    await client.init_pairs()
-    return client
+    return await boltz_clients.get(pair, settings)
 
 
 async def check_balance(data) -> bool:
@@ -41,27 +119,18 @@ def get_timestamp():
     return calendar.timegm(date.utctimetuple())
 
 
-async def execute_reverse_swap(client: BoltzClient, swap: ReverseSubmarineSwap):
-    # claim_task is watching for the lockup transaction to arrive / confirm
-    # and if the lockup is there, claim the onchain revealing preimage for hold invoice
-    claim_task = asyncio.create_task(
-        client.claim_reverse_swap(
-            boltz_id=swap.boltz_id,
-            privkey_wif=swap.claim_privkey,
-            preimage_hex=swap.preimage,
-            lockup_address=swap.lockup_address,
-            receive_address=swap.onchain_address,
-            redeem_script_hex=swap.redeem_script,
-            zeroconf=swap.instant_settlement,
-            # feerate=swap.feerate_value if swap.feerate else None,
-            blinding_key=swap.blinding_key,
-        )
-    )
+async def execute_reverse_swap(swap: ReverseSubmarineSwap):
+    from .watcher import swap_watcher
+
+    # the swap watcher is watching for the lockup transaction to arrive / confirm
+    # and if the lockup is there, claims the onchain funds revealing the preimage
+    # for the hold invoice
+    swap_watcher.watch(swap)
+
     # pay_task is paying the hold invoice which gets held until you reveal
     # your preimage when claiming your onchain funds
-    pay_task = pay_invoice_and_update_status(
+    pay_invoice_and_update_status(
         swap.id,
-        claim_task,
         pay_invoice(
             wallet_id=swap.wallet,
             payment_request=swap.invoice,
@@ -73,28 +142,57 @@ async def execute_reverse_swap(client: BoltzClient, swap: ReverseSubmarineSwap):
         ),
     )
 
-    # they need to run be concurrently, because else pay_task will lock the eventloop
-    # and claim_task will not be executed. the lockup transaction can only happen after
-    # you pay the invoice, which cannot be redeemed immediatly -> hold invoice
-    # after getting the lockup transaction, you can claim the onchain funds revealing
-    # the preimage for boltz to redeem the hold invoice
-    asyncio.gather(claim_task, pay_task)
 
-
-def pay_invoice_and_update_status(
-    swap_id: str, wstask: asyncio.Task, awaitable: Awaitable
-) -> asyncio.Task:
+def pay_invoice_and_update_status(swap_id: str, awaitable: Awaitable) -> asyncio.Task:
     async def _pay_invoice(awaitable):
         from .crud import update_swap_status
+        from .watcher import swap_watcher
 
         try:
             awaited = await awaitable
-            await update_swap_status(swap_id, "complete")
+            await update_swap_status(swap_id, "complete", reverse=True)
             return awaited
         except asyncio.exceptions.CancelledError:
             """lnbits process was exited, do nothing and handle it in startup script"""
         except Exception:
-            wstask.cancel()
-            await update_swap_status(swap_id, "failed")
+            swap_watcher.unwatch(swap_id)
+            await update_swap_status(swap_id, "failed", reverse=True)
+
+    return task_supervisor.create_task(swap_id, "pay_invoice", _pay_invoice(awaitable))
+
 
-    return asyncio.create_task(_pay_invoice(awaitable))
+def split_amount(amount: int, minimal: int, maximal: int) -> list[int]:
+    """
+    split `amount` into as few even parts within `minimal` and `maximal` as
+    possible, what does not fit into a part is not included. nothing fits if
+    `maximal` is below `minimal`, e.g. a per swap cap below the boltz minimal.
+    """
+    if amount < minimal or maximal < minimal:
+        return []
+    parts = -(-amount // maximal)
+    size, remainder = divmod(amount, parts)
+    if size < minimal:
+        # limits closer than a factor of 2, use maximal parts
+        return [maximal] * (amount // maximal)
+    return [size + 1 if i < remainder else size for i in range(parts)]
+
+
+def swap_claim_input(swap: ReverseSubmarineSwap, lockup_rawtx: str) -> ClaimInput:
+    return ClaimInput(
+        lockup_address=swap.lockup_address,
+        lockup_rawtx=lockup_rawtx,
+        privkey_wif=swap.claim_privkey,
+        preimage_hex=swap.preimage,
+        redeem_script_hex=swap.redeem_script,
+    )
+
+
+def swap_refund_input(swap: SubmarineSwap, lockup_rawtx: str) -> RefundInput:
+    return RefundInput(
+        lockup_address=swap.address,
+        lockup_rawtx=lockup_rawtx,
+        privkey_wif=swap.refund_privkey,
+        redeem_script_hex=swap.redeem_script,
+        timeout_block_height=swap.timeout_block_height,
+        receive_address=swap.refund_address,
+    )
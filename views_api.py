@@ -1,7 +1,11 @@
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable
 from http import HTTPStatus
 from importlib import util
+from typing import TypeVar
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from lnbits.core.crud import get_user
 from lnbits.core.models import WalletTypeInfo
 from lnbits.core.services import create_invoice
@@ -12,7 +16,9 @@ from lnbits.decorators import (
 )
 from lnbits.helpers import urlsafe_short_hash
 from loguru import logger
+from sse_starlette.sse import EventSourceResponse
 
+from .auto_swaps import auto_swap_index
 from .boltz_client.boltz import SwapDirection
 from .boltz_client.onchain import validate_address
 from .crud import (
@@ -21,26 +27,44 @@ from .crud import (
     create_submarine_swap,
     delete_auto_reverse_submarine_swap,
     delete_boltz_settings,
+    get_auto_reverse_submarine_swap,
     get_auto_reverse_submarine_swap_by_wallet,
     get_auto_reverse_submarine_swaps,
+    get_last_swap_event_id,
     get_or_create_boltz_settings,
     get_reverse_submarine_swap,
-    get_reverse_submarine_swaps,
+    get_reverse_submarine_swap_summaries,
     get_submarine_swap,
-    get_submarine_swaps,
+    get_submarine_swap_summaries,
+    get_swap_events,
+    next_cursor,
     update_boltz_settings,
     update_swap_status,
 )
+from .events import swap_event_stream
 from .models import (
+    SWAP_LIST_MAX_LIMIT,
     AutoReverseSubmarineSwap,
+    BoltzDashboard,
     BoltzSettings,
     CreateAutoReverseSubmarineSwap,
     CreateReverseSubmarineSwap,
     CreateSubmarineSwap,
+    InvoiceQueueStats,
     ReverseSubmarineSwap,
+    ReverseSubmarineSwapSummary,
     SubmarineSwap,
+    SubmarineSwapSummary,
+    SwapEvent,
+    SwapFilters,
+    SwapTask,
 )
+from .rbf import fee_bumper
+from .refunds import schedule_refund
+from .supervisor import task_supervisor
+from .tasks import invoice_consumers
 from .utils import check_balance, create_boltz_client, execute_reverse_swap
+from .watcher import swap_watcher
 
 try:
     util.find_spec("wallycore")
@@ -51,6 +75,13 @@ except ImportError:
 
 boltz_api_router = APIRouter()
 
+TSwap = TypeVar(
+    "TSwap",
+    SubmarineSwapSummary,
+    ReverseSubmarineSwapSummary,
+    AutoReverseSubmarineSwap,
+)
+
 
 def api_liquid_support(asset: str):
     if asset == "L-BTC/BTC" and not liquid_support:
@@ -72,27 +103,54 @@ async def api_address_validation(address: str, asset: str):
     validate_address(address, net, asset)
 
 
+async def api_wallet_ids(key_info: WalletTypeInfo, all_wallets: bool) -> list[str]:
+    if not all_wallets:
+        return [key_info.wallet.id]
+    user = await get_user(key_info.wallet.user)
+    return user.wallet_ids if user else []
+
+
+async def api_swap_page(
+    get_swaps: Callable[[list[str], SwapFilters], Awaitable[list[TSwap]]],
+    wallet_ids: list[str],
+    filters: SwapFilters,
+    response: Response,
+) -> list[TSwap]:
+    try:
+        swaps = await get_swaps(wallet_ids, filters)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail=str(exc)
+        ) from exc
+    cursor = next_cursor(swaps, filters.limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return swaps
+
+
 # NORMAL SWAP
 @boltz_api_router.get(
     "/api/v1/swap",
     name="boltz.get /swap",
     summary="get a list of swaps a swap",
     description="""
-        This endpoint gets a list of normal swaps.
+        This endpoint gets a page of normal swaps, newest first. The next page
+        is requested with the `X-Next-Cursor` response header as `cursor`.
     """,
     response_description="list of normal swaps",
     dependencies=[Depends(require_invoice_key)],
-    response_model=list[SubmarineSwap],
+    response_model=list[SubmarineSwapSummary],
 )
 async def api_submarineswap(
+    response: Response,
     key_info: WalletTypeInfo = Depends(require_invoice_key),
     all_wallets: bool = Query(False),
-) -> list[SubmarineSwap]:
-    wallet_ids = [key_info.wallet.id]
-    if all_wallets:
-        user = await get_user(key_info.wallet.user)
-        wallet_ids = user.wallet_ids if user else []
-    return await get_submarine_swaps(wallet_ids)
+    filters: SwapFilters = Depends(),
+) -> list[SubmarineSwapSummary]:
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    return await api_swap_page(
+        get_submarine_swap_summaries, wallet_ids, filters, response
+    )
 
 
 @boltz_api_router.post(
@@ -132,18 +190,22 @@ async def api_submarineswap_refund(swap_id: str):
 
     try:
         client = await create_boltz_client(swap.asset)
-        await client.refund_swap(
+        lockup_rawtx = await client.wait_for_tx(swap.boltz_id)
+        txid = await client.refund_swap(
             boltz_id=swap.boltz_id,
             privkey_wif=swap.refund_privkey,
             lockup_address=swap.address,
             receive_address=swap.refund_address,
             redeem_script_hex=swap.redeem_script,
             timeout_block_height=swap.timeout_block_height,
-            # feerate=swap.feerate_value if swap.feerate else None,
+            feerate=swap.feerate_value if swap.feerate else None,
             blinding_key=swap.blinding_key,
+            lockup_rawtx=lockup_rawtx,
         )
+        await fee_bumper.track(client, txid, [swap], [lockup_rawtx])
 
-        await update_swap_status(swap.id, "refunded")
+        await update_swap_status(swap.id, "refunded", reverse=False, txid=txid)
+        swap_watcher.unwatch(swap.id)
         return swap
     except Exception as exc:
         raise HTTPException(
@@ -213,6 +275,8 @@ async def api_submarineswap_create(data: CreateSubmarineSwap) -> SubmarineSwap:
     new_swap = await create_submarine_swap(
         data, swap, swap_id, refund_privkey_wif, payment.payment_hash
     )
+    swap_watcher.watch(new_swap)
+    schedule_refund(new_swap)
     return new_swap
 
 
@@ -222,21 +286,23 @@ async def api_submarineswap_create(data: CreateSubmarineSwap) -> SubmarineSwap:
     name="boltz.get /swap/reverse",
     summary="get a list of reverse swaps",
     description="""
-        This endpoint gets a list of reverse swaps.
+        This endpoint gets a page of reverse swaps, newest first. The next page
+        is requested with the `X-Next-Cursor` response header as `cursor`.
     """,
     response_description="list of reverse swaps",
     dependencies=[Depends(require_invoice_key)],
-    response_model=list[ReverseSubmarineSwap],
+    response_model=list[ReverseSubmarineSwapSummary],
 )
 async def api_reverse_submarineswap(
+    response: Response,
     key_info: WalletTypeInfo = Depends(require_invoice_key),
     all_wallets: bool = Query(False),
-):
-    wallet_ids = [key_info.wallet.id]
-    if all_wallets:
-        user = await get_user(key_info.wallet.user)
-        wallet_ids = user.wallet_ids if user else []
-    return await get_reverse_submarine_swaps(wallet_ids)
+    filters: SwapFilters = Depends(),
+) -> list[ReverseSubmarineSwapSummary]:
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    return await api_swap_page(
+        get_reverse_submarine_swap_summaries, wallet_ids, filters, response
+    )
 
 
 @boltz_api_router.post(
@@ -293,7 +359,7 @@ async def api_reverse_submarineswap_create(
     new_swap = await create_reverse_submarine_swap(
         data, claim_privkey_wif, preimage_hex, swap
     )
-    await execute_reverse_swap(client, new_swap)
+    await execute_reverse_swap(new_swap)
     return new_swap
 
 
@@ -302,21 +368,27 @@ async def api_reverse_submarineswap_create(
     name="boltz.get /swap/reverse/auto",
     summary="get a list of auto reverse swaps",
     description="""
-        This endpoint gets a list of auto reverse swaps.
+        This endpoint gets a page of auto reverse swaps, newest first. The next
+        page is requested with the `X-Next-Cursor` response header as `cursor`.
     """,
     response_description="list of auto reverse swaps",
     dependencies=[Depends(require_invoice_key)],
     response_model=list[AutoReverseSubmarineSwap],
 )
 async def api_auto_reverse_submarineswap(
+    response: Response,
     key_info: WalletTypeInfo = Depends(require_invoice_key),
     all_wallets: bool = Query(False),
+    asset: str | None = Query(None),
+    cursor: str | None = Query(None),
+    limit: int = Query(100),
 ) -> list[AutoReverseSubmarineSwap]:
-    wallet_ids = [key_info.wallet.id]
-    if all_wallets:
-        user = await get_user(key_info.wallet.user)
-        wallet_ids = user.wallet_ids if user else []
-    return await get_auto_reverse_submarine_swaps(wallet_ids)
+    # auto swaps have no status and direction
+    filters = SwapFilters(asset=asset, cursor=cursor, limit=limit)
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    return await api_swap_page(
+        get_auto_reverse_submarine_swaps, wallet_ids, filters, response
+    )
 
 
 @boltz_api_router.post(
@@ -331,6 +403,7 @@ async def api_auto_reverse_submarineswap(
     response_model=AutoReverseSubmarineSwap,
     dependencies=[Depends(require_admin_key)],
     responses={
+        400: {"description": "when the max swap amount is below the boltz minimal"},
         405: {
             "description": (
                 "auto reverse swap is active, only 1 swap per wallet possible."
@@ -348,7 +421,19 @@ async def api_auto_reverse_submarineswap_create(
             detail="auto reverse swap is active, only 1 swap per wallet possible.",
         )
     await api_address_validation(data.onchain_address, data.asset)
+    if data.max_swap_amount:
+        client = await create_boltz_client(data.asset)
+        minimal = client.limits["minimal"]
+        if data.max_swap_amount < minimal:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail=(
+                    f"max swap amount: {data.max_swap_amount} is below "
+                    f"the boltz minimal: {minimal}"
+                ),
+            )
     swap = await create_auto_reverse_submarine_swap(data)
+    auto_swap_index.add(swap.wallet)
     return swap
 
 
@@ -363,7 +448,10 @@ async def api_auto_reverse_submarineswap_create(
     dependencies=[Depends(require_admin_key)],
 )
 async def api_auto_reverse_submarineswap_delete(swap_id: str):
+    auto_swap = await get_auto_reverse_submarine_swap(swap_id)
     await delete_auto_reverse_submarine_swap(swap_id)
+    if auto_swap:
+        auto_swap_index.discard(auto_swap.wallet)
     return "OK"
 
 
@@ -418,6 +506,191 @@ async def api_boltz_config():
         ) from exc
 
 
+@boltz_api_router.get(
+    "/api/v1/swap/events",
+    name="boltz.get /swap/events",
+    summary="get swap events since an event id",
+    description="""
+        This endpoint gets the swap status changes after the event id `since`,
+        oldest first. Clients keep the id of the last event and poll with it
+        to sync incrementally instead of reloading their swap lists.
+    """,
+    response_description="list of swap events",
+    dependencies=[Depends(require_invoice_key)],
+    response_model=list[SwapEvent],
+)
+async def api_swap_events(
+    all_wallets: bool = Query(False),
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=SWAP_LIST_MAX_LIMIT),
+    key_info: WalletTypeInfo = Depends(require_invoice_key),
+) -> list[SwapEvent]:
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    return await get_swap_events(wallet_ids, since=since, limit=limit)
+
+
+@boltz_api_router.get(
+    "/api/v1/swap/stream",
+    name="boltz.get /swap/stream",
+    summary="stream swap events",
+    description="""
+        This endpoint streams swap creations and status changes as server-sent
+        `swap` events, with the same payload as `/api/v1/swap/events`. Browsers
+        pass the invoice key as `api-key` query parameter. On reconnect the
+        events after the `Last-Event-ID` header (or `since`) are sent first.
+    """,
+    response_description="stream of swap events",
+    dependencies=[Depends(require_invoice_key)],
+    response_class=EventSourceResponse,
+)
+async def api_swap_stream(
+    request: Request,
+    all_wallets: bool = Query(False),
+    since: int | None = Query(None, ge=0),
+    key_info: WalletTypeInfo = Depends(require_invoice_key),
+) -> EventSourceResponse:
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    return EventSourceResponse(swap_event_stream(wallet_ids, since))
+
+
+# declared after the other `/api/v1/swap/...` routes, which they would shadow
+@boltz_api_router.get(
+    "/api/v1/swap/reverse/{swap_id}",
+    name="boltz.get /swap/reverse/{swap_id}",
+    summary="get a reverse swap",
+    description="""
+        This endpoint gets a reverse swap with all details, e.g. its preimage.
+    """,
+    response_description="reverse swap",
+    dependencies=[Depends(require_invoice_key)],
+    response_model=ReverseSubmarineSwap,
+    responses={404: {"description": "when swap is not found"}},
+)
+async def api_reverse_submarineswap_detail(
+    swap_id: str,
+    key_info: WalletTypeInfo = Depends(require_invoice_key),
+) -> ReverseSubmarineSwap:
+    swap = await get_reverse_submarine_swap(swap_id)
+    if not swap or swap.wallet not in await api_wallet_ids(key_info, True):
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="swap does not exist."
+        )
+    return swap
+
+
+@boltz_api_router.get(
+    "/api/v1/swap/{swap_id}",
+    name="boltz.get /swap/{swap_id}",
+    summary="get a swap",
+    description="""
+        This endpoint gets a normal swap with all details, e.g. its refund key.
+    """,
+    response_description="normal swap",
+    dependencies=[Depends(require_invoice_key)],
+    response_model=SubmarineSwap,
+    responses={404: {"description": "when swap is not found"}},
+)
+async def api_submarineswap_detail(
+    swap_id: str,
+    key_info: WalletTypeInfo = Depends(require_invoice_key),
+) -> SubmarineSwap:
+    swap = await get_submarine_swap(swap_id)
+    if not swap or swap.wallet not in await api_wallet_ids(key_info, True):
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="swap does not exist."
+        )
+    return swap
+
+
+@boltz_api_router.get(
+    "/api/v1/dashboard",
+    name="boltz.get /dashboard",
+    summary="get the swap lists and boltz pairs in one request",
+    description="""
+        This endpoint gets the first page of the normal, reverse and auto swaps,
+        the cached boltz pairs and the id of the latest swap event. It sends an
+        `ETag`, unchanged dashboards are answered with 304 to `If-None-Match`.
+    """,
+    response_description="swap lists and boltz pairs",
+    dependencies=[Depends(require_invoice_key)],
+    response_model=BoltzDashboard,
+    responses={304: {"description": "when the dashboard did not change"}},
+)
+async def api_dashboard(
+    request: Request,
+    all_wallets: bool = Query(False),
+    limit: int = Query(100, ge=1, le=SWAP_LIST_MAX_LIMIT),
+    key_info: WalletTypeInfo = Depends(require_invoice_key),
+) -> Response:
+    wallet_ids = await api_wallet_ids(key_info, all_wallets)
+    filters = SwapFilters(limit=limit)
+    swaps, reverse_swaps, auto_reverse_swaps, last_event_id = await asyncio.gather(
+        get_submarine_swap_summaries(wallet_ids, filters),
+        get_reverse_submarine_swap_summaries(wallet_ids, filters),
+        get_auto_reverse_submarine_swaps(wallet_ids, filters),
+        get_last_swap_event_id(),
+    )
+    try:
+        client = await create_boltz_client()
+        pairs = client.pairs
+    except Exception as exc:
+        logger.warning(f"Boltz - dashboard without pairs: {exc!s}")
+        pairs = None
+
+    dashboard = BoltzDashboard(
+        swaps=swaps,
+        swaps_cursor=next_cursor(swaps, limit),
+        reverse_swaps=reverse_swaps,
+        reverse_swaps_cursor=next_cursor(reverse_swaps, limit),
+        auto_reverse_swaps=auto_reverse_swaps,
+        auto_reverse_swaps_cursor=next_cursor(auto_reverse_swaps, limit),
+        pairs=pairs,
+        last_event_id=last_event_id,
+    )
+    body = dashboard.json()
+    etag = f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@boltz_api_router.get(
+    "/api/v1/tasks",
+    name="boltz.get /tasks",
+    summary="list in-flight swap tasks",
+    description="""
+        This endpoint lists all running per swap tasks with their stage and age,
+        and the most recent crashed ones.
+    """,
+    response_description="list of swap tasks",
+    dependencies=[Depends(check_admin)],
+    response_model=list[SwapTask],
+)
+async def api_swap_tasks() -> list[SwapTask]:
+    return task_supervisor.list_tasks()
+
+
+@boltz_api_router.get(
+    "/api/v1/invoices/queue",
+    name="boltz.get /invoices/queue",
+    summary="get paid invoice queue metrics",
+    description="""
+        This endpoint gets the depth of the paid invoice queues, the number of
+        busy workers and the lag between receiving and handling an invoice.
+    """,
+    response_description="paid invoice queue metrics",
+    dependencies=[Depends(check_admin)],
+    response_model=InvoiceQueueStats,
+)
+async def api_invoice_queue() -> InvoiceQueueStats:
+    return invoice_consumers.stats()
+
+
 @boltz_api_router.get("/api/v1/settings", dependencies=[Depends(check_admin)])
 async def api_get_or_create_settings() -> BoltzSettings:
     return await get_or_create_boltz_settings()
@@ -0,0 +1,597 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from .batches import claim_batcher, refund_batcher
+from .boltz_client.boltz import (
+    BoltzApiException,
+    BoltzClient,
+    BoltzNotFoundException,
+    BoltzSwapStatusException,
+    BoltzSwapStatusResponse,
+    BoltzSwapTransactionException,
+)
+from .boltz_client.websocket import BoltzSwapStatusStream
+from .crud import (
+    create_swap_event,
+    delete_jobs,
+    get_due_jobs,
+    get_or_create_boltz_settings,
+    get_reverse_submarine_swap,
+    get_submarine_swap,
+    lease_job,
+    update_swap_status,
+    upsert_jobs,
+)
+from .models import ReverseSubmarineSwap, SubmarineSwap, SwapJob
+from .nodes import node_registry
+from .rbf import fee_bumper
+from .supervisor import task_supervisor
+from .utils import boltz_clients, create_boltz_client
+
+# check intervals in seconds
+INTERVAL_FAST = 3  # right after the swap was added
+INTERVAL_IDLE = 30  # waiting for the user or for boltz
+INTERVAL_CONFIRMATION = 60  # lockup is in the mempool, waiting for confirmations
+INTERVAL_URGENT = 3  # timeout block height is near
+INTERVAL_WEBSOCKET = 120  # safety net while updates are pushed via websocket
+INTERVAL_MAX_BACKOFF = 900
+FAST_PERIOD = 300  # seconds after being added, the swap is checked fast
+# blocks before the timeout, a reverse swap is checked urgently to claim it in
+# time. refunds are woken at the timeout by the refund scheduler
+URGENT_BLOCKS = 6
+BLOCK_HEIGHT_TTL = 60
+JOB_POLL_INTERVAL = 15  # look for due jobs in the database which are not watched
+JOB_LEASE_TIME = 120  # a worker owns a job for this long while checking it
+
+FAILED_STATUSES = {
+    "swap.expired",
+    "invoice.expired",
+    "invoice.failedToPay",
+    "transaction.failed",
+    "transaction.lockupFailed",
+    "transaction.refunded",
+}
+CONFIRMATION_STATUSES = {"transaction.mempool", "transaction.zeroconf.rejected"}
+
+
+@dataclass
+class WatchedSwap:
+    swap: SubmarineSwap | ReverseSubmarineSwap
+    added_at: float = field(default_factory=time.time)
+    due: float = 0
+    running: bool = False
+    # failed checks in a row, used for backoff
+    attempts: int = 0
+    last_status: str | None = None
+    blocks_left: int | None = None
+    # status pushed by the websocket, consumed by the next check
+    pushed_status: BoltzSwapStatusResponse | None = None
+    # next work on the swap, persisted as job: check, claim or refund
+    kind: str = "check"
+    last_error: str | None = None
+    # claim or refund transaction, recorded in the swap event log
+    txid: str | None = None
+    # claim or refund waiting for its batch transaction, resolves to the txid
+    batch: asyncio.Future[str] | None = None
+    # status the swap finished with, kept while writing it fails
+    outcome: str | None = None
+
+    @property
+    def reverse(self) -> bool:
+        return isinstance(self.swap, ReverseSubmarineSwap)
+
+    def to_job(self) -> SwapJob:
+        return SwapJob(
+            id=self.swap.id,
+            reverse=self.reverse,
+            kind=self.kind,
+            due=int(self.due),
+            attempts=self.attempts,
+            last_status=self.last_status,
+            last_error=self.last_error,
+        )
+
+
+def next_check_interval(
+    watched: WatchedSwap, websocket: bool = False, now: float | None = None
+) -> float:
+    """adaptive check interval: fast when new, slow while confirming, urgent before
+    the timeout of a claim. with a connected websocket non urgent checks are only a
+    safety net."""
+    now = now or time.time()
+    if watched.attempts:
+        return min(INTERVAL_IDLE * 2**watched.attempts, INTERVAL_MAX_BACKOFF)
+    if (
+        watched.reverse
+        and watched.blocks_left is not None
+        and watched.blocks_left <= URGENT_BLOCKS
+    ):
+        return INTERVAL_URGENT
+    if watched.last_status in CONFIRMATION_STATUSES:
+        interval = INTERVAL_CONFIRMATION
+    elif now - watched.added_at < FAST_PERIOD:
+        interval = INTERVAL_FAST
+    else:
+        interval = INTERVAL_IDLE
+    if websocket:
+        interval = max(interval, INTERVAL_WEBSOCKET)
+    return interval
+
+
+class SwapWatcher:
+    """
+    Owns every pending swap and runs as a single task. Swaps are kept in a priority
+    queue ordered by their next check, claims, refunds and status transitions are
+    all dispatched from here with bounded concurrency.
+    The queue is mirrored to the `boltz.jobs` table, so a restart resumes every
+    swap where it left off, with its due time and failed attempts. With several
+    lnbits nodes, every node only works on its own shard of the jobs and holds
+    the job lease while checking, claiming or refunding a swap.
+    """
+
+    def __init__(self, max_concurrent_checks: int = 20):
+        self.swaps: dict[str, WatchedSwap] = {}
+        self._boltz_ids: dict[str, str] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(max_concurrent_checks)
+        self._tasks: set[asyncio.Task] = set()
+        self._heights: dict[str, tuple[int, float]] = {}
+        self._stream: BoltzSwapStatusStream | None = None
+        self._subscribe: set[str] = set()
+        self._unsubscribe: set[str] = set()
+        # job changes, written to the database in bulk by the main loop
+        self._dirty_jobs: set[str] = set()
+        self._deleted_jobs: set[str] = set()
+        self._jobs_polled_at = 0.0
+
+    def watch(
+        self, swap: SubmarineSwap | ReverseSubmarineSwap, delay: float = 0
+    ) -> WatchedSwap:
+        if swap.id in self.swaps:
+            self.swaps[swap.id].swap = swap
+        else:
+            self._add(WatchedSwap(swap=swap))
+        self.schedule(swap.id, delay)
+        return self.swaps[swap.id]
+
+    def _add(self, watched: WatchedSwap) -> None:
+        swap = watched.swap
+        self.swaps[swap.id] = watched
+        self._boltz_ids[swap.boltz_id] = swap.id
+        self._subscribe.add(swap.boltz_id)
+        self._unsubscribe.discard(swap.boltz_id)
+        self._deleted_jobs.discard(swap.id)
+
+    def resume(
+        self, swap: SubmarineSwap | ReverseSubmarineSwap, job: SwapJob
+    ) -> WatchedSwap:
+        """watch a swap from its persisted job"""
+        watched = self.watch(swap, delay=max(job.due - time.time(), 0))
+        watched.kind = job.kind
+        watched.attempts = job.attempts
+        watched.last_status = job.last_status
+        watched.last_error = job.last_error
+        return watched
+
+    def unwatch(self, swap_id: str) -> None:
+        """stop watching a finished swap and delete its job"""
+        self.forget(swap_id)
+        self._dirty_jobs.discard(swap_id)
+        self._deleted_jobs.add(swap_id)
+        self._wakeup.set()
+
+    def forget(self, swap_id: str) -> None:
+        """stop watching a swap on this node, its job is kept for its owner"""
+        watched = self.swaps.pop(swap_id, None)
+        if watched:
+            self._boltz_ids.pop(watched.swap.boltz_id, None)
+            self._subscribe.discard(watched.swap.boltz_id)
+            self._unsubscribe.add(watched.swap.boltz_id)
+
+    def schedule(self, swap_id: str, delay: float = 0) -> None:
+        watched = self.swaps.get(swap_id)
+        if not watched or watched.batch:
+            # a batched swap is checked again if its batch fails
+            return
+        watched.due = time.time() + delay
+        heapq.heappush(self._heap, (watched.due, next(self._seq), swap_id))
+        self._dirty_jobs.add(swap_id)
+        self._wakeup.set()
+
+    def wake(self, swap: SubmarineSwap | ReverseSubmarineSwap) -> None:
+        """check a swap right away, e.g. in the block its refund becomes valid"""
+        if swap.id in self.swaps:
+            self.schedule(swap.id)
+        else:
+            self.watch(swap)
+
+    def set_block_height(self, pair: str, height: int) -> None:
+        """a fresh block height of the chain of `pair`, e.g. of a new block"""
+        self._heights[pair] = (height, time.time())
+
+    def on_status_update(self, boltz_id: str, status: BoltzSwapStatusResponse):
+        swap_id = self._boltz_ids.get(boltz_id)
+        if swap_id and swap_id in self.swaps:
+            self.swaps[swap_id].pushed_status = status
+            if not self.swaps[swap_id].running:
+                self.schedule(swap_id)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                self._wakeup.clear()
+                await self._sync_subscriptions()
+                now = time.time()
+                due_swaps = []
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, swap_id = heapq.heappop(self._heap)
+                    watched = self.swaps.get(swap_id)
+                    # skip outdated heap entries
+                    if not watched or watched.due != due or watched.running:
+                        continue
+                    watched.running = True
+                    due_swaps.append(watched)
+                # write job changes before the due jobs are leased
+                await self._sync_jobs()
+                for watched in due_swaps:
+                    if not node_registry.is_mine(watched.swap.id):
+                        # handed over to the node owning the swap
+                        self.forget(watched.swap.id)
+                        continue
+                    task = task_supervisor.create_task(
+                        watched.swap.id, "check", self._dispatch(watched)
+                    )
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                now = time.time()
+                timeout = self._jobs_polled_at + JOB_POLL_INTERVAL - now
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def _sync_subscriptions(self) -> None:
+        """(un)subscribe watched swaps to the websocket stream, in bulk"""
+        stream = boltz_clients.status_stream
+        if not stream:
+            return
+        if stream is not self._stream:
+            self._stream = stream
+            stream.listeners.append(self.on_status_update)
+            stream.start()
+            self._subscribe = set(self._boltz_ids.keys())
+            self._unsubscribe.clear()
+        if self._unsubscribe:
+            await stream.unsubscribe(list(self._unsubscribe))
+            self._unsubscribe.clear()
+        if self._subscribe:
+            await stream.subscribe(list(self._subscribe))
+            self._subscribe.clear()
+
+    async def _sync_jobs(self) -> None:
+        """persist job changes and pick up due jobs which are not watched"""
+        try:
+            await self._write_jobs()
+            if time.time() - self._jobs_polled_at >= JOB_POLL_INTERVAL:
+                self._jobs_polled_at = time.time()
+                await self.poll_jobs()
+        except Exception as exc:
+            logger.error(f"Boltz - could not sync watcher jobs: {exc!s}")
+
+    async def _write_jobs(self) -> None:
+        """changes which fail to be written are kept for the next sync"""
+        deleted, self._deleted_jobs = self._deleted_jobs, set()
+        try:
+            if deleted:
+                await delete_jobs(list(deleted))
+        except Exception:
+            self._deleted_jobs |= deleted - self.swaps.keys()
+            raise
+        dirty, self._dirty_jobs = self._dirty_jobs, set()
+        try:
+            jobs = [self.swaps[_id].to_job() for _id in dirty if _id in self.swaps]
+            if jobs:
+                await upsert_jobs(jobs, node_registry.node_id, int(time.time()))
+        except Exception:
+            self._dirty_jobs |= dirty
+            raise
+
+    async def poll_jobs(self) -> None:
+        """watch due jobs of this node's shard, e.g. handed over by another node"""
+        for job in await get_due_jobs(int(time.time())):
+            if job.id in self.swaps or not node_registry.is_mine(job.id):
+                continue
+            swap: SubmarineSwap | ReverseSubmarineSwap | None
+            if job.reverse:
+                swap = await get_reverse_submarine_swap(job.id)
+            else:
+                swap = await get_submarine_swap(job.id)
+            if swap and swap.status == "pending":
+                self.resume(swap, job)
+            else:
+                self._deleted_jobs.add(job.id)
+
+    async def _dispatch(self, watched: WatchedSwap) -> None:
+        swap = watched.swap
+        now = int(time.time())
+        lease_until = now + JOB_LEASE_TIME
+        try:
+            leased = await lease_job(
+                watched.to_job(), node_registry.node_id, now, lease_until
+            )
+        except Exception as exc:
+            # the swap stays watched, the lease is tried again with the next check
+            logger.warning(f"Boltz - could not lease swap: {swap.boltz_id} - {exc!s}")
+            watched.running = False
+            self.schedule(swap.id, INTERVAL_IDLE)
+            return
+        if not leased:
+            # another node is on it, it is picked up again if its lease expires
+            logger.debug(f"Boltz - swap: {swap.boltz_id} is leased by another node.")
+            watched.running = False
+            self.forget(swap.id)
+            return
+        if watched.outcome:
+            # finished already, only its status is written again
+            watched.running = False
+            await self._finish(watched, watched.outcome)
+            return
+        previous_status = watched.last_status
+        async with self._semaphore:
+            try:
+                outcome = await self.check(watched)
+                watched.attempts = 0
+                watched.last_error = None
+            except Exception as exc:
+                outcome = None
+                watched.attempts += 1
+                watched.last_error = str(exc)
+                logger.warning(
+                    f"Boltz - watcher check failed, swap: {swap.boltz_id}, "
+                    f"attempt: {watched.attempts} - {exc!s}"
+                )
+            finally:
+                watched.running = False
+
+        if outcome and watched.batch:
+            self.defer(watched, outcome)
+            return
+        if outcome:
+            await self._finish(watched, outcome)
+            return
+        if watched.last_status and watched.last_status != previous_status:
+            try:
+                await create_swap_event(swap, boltz_status=watched.last_status)
+            except Exception as exc:
+                logger.warning(
+                    f"Boltz - could not log swap event, swap: {swap.boltz_id} "
+                    f"- {exc!s}"
+                )
+        self._reschedule(watched)
+
+    def _reschedule(self, watched: WatchedSwap) -> None:
+        websocket = bool(self._stream and self._stream.connected.is_set())
+        self.schedule(watched.swap.id, next_check_interval(watched, websocket))
+
+    async def _finish(self, watched: WatchedSwap, outcome: str) -> None:
+        try:
+            await update_swap_status(
+                watched.swap.id,
+                outcome,
+                reverse=watched.reverse,
+                boltz_status=watched.last_status,
+                txid=watched.txid,
+            )
+        except Exception as exc:
+            # written again with backoff, the swap is not claimed or refunded twice
+            watched.outcome = outcome
+            watched.attempts += 1
+            watched.last_error = str(exc)
+            logger.warning(
+                f"Boltz - could not finish swap: {watched.swap.boltz_id} as "
+                f"{outcome}, attempt: {watched.attempts} - {exc!s}"
+            )
+            self._reschedule(watched)
+            return
+        self.unwatch(watched.swap.id)
+
+    def defer(self, watched: WatchedSwap, outcome: str) -> None:
+        """
+        finish a swap with `outcome` once the batch transaction of its claim or
+        refund is sent. the swap does not hold a check slot while it waits, its
+        job lease is kept until then.
+        """
+        assert watched.batch
+        if watched.swap.id not in self.swaps:
+            # checked outside of the watcher, e.g. by the startup recovery
+            self._add(watched)
+
+        def on_batch_done(_: asyncio.Future) -> None:
+            task = task_supervisor.create_task(
+                watched.swap.id, watched.kind, self._finish_batch(watched, outcome)
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        watched.batch.add_done_callback(on_batch_done)
+
+    async def _finish_batch(self, watched: WatchedSwap, outcome: str) -> None:
+        batch, watched.batch = watched.batch, None
+        assert batch
+        exc = asyncio.CancelledError() if batch.cancelled() else batch.exception()
+        if not exc:
+            watched.txid = batch.result()
+            await self._finish(watched, outcome)
+            return
+        watched.attempts += 1
+        watched.last_error = str(exc) or exc.__class__.__name__
+        logger.warning(
+            f"Boltz - batched {watched.kind} failed, swap: {watched.swap.boltz_id}, "
+            f"attempt: {watched.attempts} - {exc!s}"
+        )
+        self._reschedule(watched)
+
+    async def check(self, watched: WatchedSwap) -> str | None:
+        """check a swap once, returns the new swap status if it is finished"""
+        swap = watched.swap
+        client = await create_boltz_client(swap.asset)
+        status = watched.pushed_status
+        watched.pushed_status = None
+        try:
+            if not status:
+                status = await client.swap_status(swap.boltz_id)
+        except BoltzSwapStatusException as exc:
+            status = BoltzSwapStatusResponse(
+                status=exc.status, failureReason=exc.message
+            )
+        except BoltzNotFoundException:
+            logger.debug(f"Boltz - swap: {swap.boltz_id} does not exist.")
+            return "failed"
+        watched.last_status = status.status
+        watched.kind = self._next_kind(swap, status)
+
+        height = await self.block_height(client)
+        if height:
+            watched.blocks_left = swap.timeout_block_height - height
+
+        if isinstance(swap, ReverseSubmarineSwap):
+            return await self._check_reverse_swap(client, watched, swap, status)
+        return await self._check_swap(client, watched, swap, status, height)
+
+    @staticmethod
+    def _next_kind(
+        swap: SubmarineSwap | ReverseSubmarineSwap, status: BoltzSwapStatusResponse
+    ) -> str:
+        if isinstance(swap, ReverseSubmarineSwap):
+            return "claim" if (status.transaction or {}).get("hex") else "check"
+        if status.status in FAILED_STATUSES or status.failureReason:
+            return "refund"
+        return "check"
+
+    async def _check_reverse_swap(
+        self,
+        client: BoltzClient,
+        watched: WatchedSwap,
+        swap: ReverseSubmarineSwap,
+        status: BoltzSwapStatusResponse,
+    ) -> str | None:
+        if status.status == "invoice.settled":
+            return "complete"
+        if status.status in FAILED_STATUSES or status.failureReason:
+            logger.debug(f"Boltz - reverse swap: {swap.boltz_id} {status.status}")
+            return "failed"
+        lockup_rawtx = (status.transaction or {}).get("hex")
+        if not lockup_rawtx:
+            return None
+        if not swap.instant_settlement and status.status != "transaction.confirmed":
+            return None
+        task_supervisor.set_stage("claim")
+        settings = await get_or_create_boltz_settings()
+        if settings.boltz_claim_batch_wait and client.pair == "BTC/BTC":
+            # complete once the batch is claimed, see `defer`
+            watched.batch = claim_batcher.claim(
+                client, swap, lockup_rawtx, settings.boltz_claim_batch_wait
+            )
+            return "complete"
+        watched.txid = await client.claim_reverse_swap(
+            boltz_id=swap.boltz_id,
+            lockup_address=swap.lockup_address,
+            receive_address=swap.onchain_address,
+            privkey_wif=swap.claim_privkey,
+            preimage_hex=swap.preimage,
+            redeem_script_hex=swap.redeem_script,
+            zeroconf=swap.instant_settlement,
+            feerate=swap.feerate_value if swap.feerate else None,
+            blinding_key=swap.blinding_key,
+            lockup_rawtx=lockup_rawtx,
+        )
+        await fee_bumper.track(client, watched.txid, [swap], [lockup_rawtx])
+        logger.info(
+            f"Boltz - reverse swap claimed: {swap.boltz_id}, txid: {watched.txid}"
+        )
+        return "complete"
+
+    async def _check_swap(
+        self,
+        client: BoltzClient,
+        watched: WatchedSwap,
+        swap: SubmarineSwap,
+        status: BoltzSwapStatusResponse,
+        height: int | None,
+    ) -> str | None:
+        if status.status == "transaction.claimed":
+            return "complete"
+        if status.status not in FAILED_STATUSES and not status.failureReason:
+            return None
+
+        # the swap failed, refund the lockup transaction if there is one
+        try:
+            lockup = await client.swap_transaction(swap.boltz_id)
+            assert lockup.transactionHex
+        except (
+            AssertionError,
+            BoltzNotFoundException,
+            BoltzSwapTransactionException,
+        ):
+            logger.debug(f"Boltz - swap: {swap.boltz_id} failed without lockup.")
+            return "failed"
+        except BoltzApiException:
+            if status.status == "swap.expired":
+                logger.debug(f"Boltz - swap: {swap.boltz_id} expired without lockup.")
+                return "failed"
+            raise
+
+        if not height or height < swap.timeout_block_height:
+            return None
+
+        task_supervisor.set_stage("refund")
+        settings = await get_or_create_boltz_settings()
+        if settings.boltz_refund_batch_wait and client.pair == "BTC/BTC":
+            # refunded once the batch is sent, see `defer`. a broadcasted batch
+            # already marks its swaps refunded
+            watched.batch = refund_batcher.refund(
+                client, swap, lockup.transactionHex, settings.boltz_refund_batch_wait
+            )
+            return "refunded"
+        watched.txid = await client.refund_swap(
+            boltz_id=swap.boltz_id,
+            privkey_wif=swap.refund_privkey,
+            lockup_address=swap.address,
+            receive_address=swap.refund_address,
+            redeem_script_hex=swap.redeem_script,
+            timeout_block_height=swap.timeout_block_height,
+            feerate=swap.feerate_value if swap.feerate else None,
+            blinding_key=swap.blinding_key,
+            lockup_rawtx=lockup.transactionHex,
+        )
+        await fee_bumper.track(client, watched.txid, [swap], [lockup.transactionHex])
+        logger.info(f"Boltz - swap refunded: {swap.boltz_id}, txid: {watched.txid}")
+        return "refunded"
+
+    async def block_height(self, client: BoltzClient) -> int | None:
+        """cached block height of the chain of the client's pair"""
+        cached = self._heights.get(client.pair)
+        if cached and time.time() - cached[1] < BLOCK_HEIGHT_TTL:
+            return cached[0]
+        try:
+            height = await client.get_block_height()
+        except Exception as exc:
+            logger.warning(f"Boltz - could not get block height: {exc!s}")
+            return cached[0] if cached else None
+        self._heights[client.pair] = (height, time.time())
+        return height
+
+
+swap_watcher = SwapWatcher()